@@ -0,0 +1,169 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Callable, Dict, List, Optional, TextIO
+
+logger = logging.getLogger("botty.logs")
+
+_STOP = object()
+
+
+class JsonlLogWriter:
+    """
+    Buffered background writer for the JSON-lines activity and error logs.
+
+    Callers only enqueue a dict, which is cheap and safe to do from the
+    event loop. A daemon thread drains the queue, serialises the records and
+    appends them to their files in batches, flushing once `batch_size` lines
+    are pending or `flush_interval` seconds have passed. Files are kept open
+    between batches and rotated when they grow past `max_bytes` or when the
+    `rotate_interval` window (aligned to UTC, so the default rolls over at
+    midnight) changes. Rotated segments are renamed `<file>.<YYYYmmdd-HHMMSS>`
+    and never written to again. `on_flush`, if given, is called from the
+    writer thread with the duration and line count of each flush.
+    """
+    def __init__(
+        self,
+        flush_interval: float = 1.0,
+        batch_size: int = 256,
+        max_bytes: int = 50 * 1024 * 1024,
+        rotate_interval: Optional[float] = 86400,
+        on_flush: Optional[Callable[[float, int], None]] = None,
+    ):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.on_flush = on_flush
+        self._queue: "queue.SimpleQueue" = queue.SimpleQueue()
+        self._files: Dict[str, TextIO] = {}
+        self._sizes: Dict[str, int] = {}
+        self._windows: Dict[str, int] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="botty-log-writer", daemon=True)
+                self._thread.start()
+
+    def write(self, path: str, data: dict) -> None:
+        """Queue a record to be appended to `path` as one JSON line."""
+        if self._thread is None:
+            self.start()
+        self._queue.put((path, data))
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Flush everything queued so far and stop the writer thread."""
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is None:
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout)
+
+    # --- Writer thread ---
+
+    def _run(self) -> None:
+        pending: Dict[str, List[str]] = {}
+        count = 0
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            timeout = max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if item is _STOP:
+                self._flush(pending)
+                self._close_files()
+                return
+            if item is not None:
+                path, data = item
+                try:
+                    line = json.dumps(data, ensure_ascii=False) + "\n"
+                except Exception as e:
+                    logger.error(f"Failed to serialise log record for {path}: {e}")
+                    continue
+                pending.setdefault(path, []).append(line)
+                count += 1
+            if count >= self.batch_size or time.monotonic() >= deadline:
+                self._flush(pending)
+                pending = {}
+                count = 0
+                deadline = time.monotonic() + self.flush_interval
+
+    def _flush(self, pending: Dict[str, List[str]]) -> None:
+        if not pending:
+            return
+        started = time.perf_counter()
+        for path, lines in pending.items():
+            if not lines:
+                continue
+            chunk = "".join(lines)
+            try:
+                f = self._open(path)
+                if self._should_rotate(path, len(chunk.encode("utf-8"))):
+                    f = self._rotate(path)
+                f.write(chunk)
+                f.flush()
+                self._sizes[path] += len(chunk.encode("utf-8"))
+            except Exception as e:
+                logger.error(f"Failed to write to {path}: {e}")
+        if self.on_flush is not None:
+            self.on_flush(time.perf_counter() - started, sum(len(lines) for lines in pending.values()))
+
+    def _window(self, timestamp: float) -> int:
+        if not self.rotate_interval:
+            return 0
+        return int(timestamp // self.rotate_interval)
+
+    def _open(self, path: str) -> TextIO:
+        f = self._files.get(path)
+        if f is None:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            f = open(path, "a", encoding="utf-8")
+            self._files[path] = f
+            try:
+                st = os.stat(path)
+                self._sizes[path] = st.st_size
+                self._windows[path] = self._window(st.st_mtime) if st.st_size else self._window(time.time())
+            except OSError:
+                self._sizes[path] = 0
+                self._windows[path] = self._window(time.time())
+        return f
+
+    def _should_rotate(self, path: str, incoming: int) -> bool:
+        size = self._sizes.get(path, 0)
+        if size == 0:
+            return False
+        if self.max_bytes and size + incoming > self.max_bytes:
+            return True
+        return self._windows.get(path) != self._window(time.time())
+
+    def _rotate(self, path: str) -> TextIO:
+        self._files.pop(path).close()
+        suffix = time.strftime("%Y%m%d-%H%M%S", time.gmtime())
+        target = f"{path}.{suffix}"
+        n = 1
+        while os.path.exists(target):
+            target = f"{path}.{suffix}.{n}"
+            n += 1
+        os.replace(path, target)
+        logger.info(f"Rotated {path} to {target}")
+        return self._open(path)
+
+    def _close_files(self) -> None:
+        for path, f in self._files.items():
+            try:
+                f.close()
+            except Exception as e:
+                logger.error(f"Failed to close {path}: {e}")
+        self._files.clear()
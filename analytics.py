@@ -0,0 +1,210 @@
+"""
+Offline analytics over Botty's JSON-lines logs.
+
+Closed (rotated) log segments are compacted into an indexed SQLite database
+so reports can be answered without parsing every line again:
+
+    python analytics.py compact
+    python analytics.py query replies-per-channel --days 7
+    python analytics.py query error-rate --days 2
+
+Compaction streams each segment line by line and records which segments it
+has already loaded, so it can be run repeatedly (e.g. from cron). The logs
+of sharded processes (`logs/shard-*/`, see launcher.py) are compacted along
+with the top-level ones, into the same database. Queries
+iterate over SQLite cursors, so memory stays flat however much history the
+database holds.
+"""
+import argparse
+import glob
+import json
+import os
+import sqlite3
+import sys
+from datetime import datetime, timedelta
+from typing import Iterator, Tuple
+
+DEFAULT_LOGS_DIR = "logs"
+DEFAULT_DB = os.path.join(DEFAULT_LOGS_DIR, "analytics.db")
+SOURCES = {"activity": "activity.log", "error": "errors.log"}
+BATCH_SIZE = 5000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    day TEXT NOT NULL,
+    hour INTEGER NOT NULL,
+    ts TEXT NOT NULL,
+    source TEXT NOT NULL,
+    event TEXT NOT NULL,
+    channel_id TEXT,
+    channel_name TEXT,
+    user_id TEXT
+);
+CREATE INDEX IF NOT EXISTS events_day_event_channel ON events (day, event, channel_id);
+CREATE INDEX IF NOT EXISTS events_day_source_hour ON events (day, source, hour);
+CREATE TABLE IF NOT EXISTS segments (
+    name TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    rows INTEGER NOT NULL,
+    compacted_at TEXT NOT NULL
+);
+"""
+
+QUERIES = {
+    "replies-per-channel": (
+        "SELECT channel_id, MAX(channel_name), COUNT(*) FROM events"
+        " WHERE day >= ? AND event = 'bot_response'"
+        " GROUP BY channel_id ORDER BY COUNT(*) DESC",
+        ("channel_id", "channel_name", "replies"),
+    ),
+    "messages-per-channel": (
+        "SELECT channel_id, MAX(channel_name), COUNT(*) FROM events"
+        " WHERE day >= ? AND event = 'user_message'"
+        " GROUP BY channel_id ORDER BY COUNT(*) DESC",
+        ("channel_id", "channel_name", "messages"),
+    ),
+    "events-per-day": (
+        "SELECT day, event, COUNT(*) FROM events WHERE day >= ?"
+        " GROUP BY day, event ORDER BY day, event",
+        ("day", "event", "count"),
+    ),
+    "error-rate": (
+        "SELECT day, hour,"
+        " SUM(source = 'error'), SUM(source = 'activity'),"
+        " ROUND(1.0 * SUM(source = 'error') / MAX(SUM(source = 'activity'), 1), 4)"
+        " FROM events WHERE day >= ? GROUP BY day, hour ORDER BY day, hour",
+        ("day", "hour", "errors", "events", "error_rate"),
+    ),
+    "top-users": (
+        "SELECT user_id, COUNT(*) FROM events"
+        " WHERE day >= ? AND event = 'user_message' AND user_id IS NOT NULL"
+        " GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 50",
+        ("user_id", "messages"),
+    ),
+}
+
+
+def connect(db_path: str) -> sqlite3.Connection:
+    directory = os.path.dirname(db_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def closed_segments(logs_dir: str) -> Iterator[Tuple[str, str]]:
+    """Yield (source, path) for every rotated log segment, oldest first, including the shard directories'."""
+    for directory in [logs_dir] + sorted(glob.glob(os.path.join(logs_dir, "shard-*"))):
+        for source, name in SOURCES.items():
+            for path in sorted(glob.glob(os.path.join(directory, name + ".*"))):
+                yield source, path
+
+
+def segment_name(path: str, db_path: str) -> str:
+    """
+    How a segment is recorded: its path relative to the database, since
+    shards' segments often share a file name (activity.log.20261018-000000).
+    """
+    base = os.path.dirname(os.path.abspath(db_path))
+    return os.path.relpath(os.path.abspath(path), base).replace(os.sep, "/")
+
+
+def already_compacted(conn: sqlite3.Connection, name: str, path: str) -> bool:
+    if conn.execute("SELECT 1 FROM segments WHERE name = ?", (name,)).fetchone():
+        return True
+    # Older versions recorded just the file name; take that over if it is clearly this file
+    legacy = os.path.basename(path)
+    if legacy != name:
+        row = conn.execute("SELECT size FROM segments WHERE name = ?", (legacy,)).fetchone()
+        if row is not None and row[0] == os.path.getsize(path):
+            with conn:
+                conn.execute("UPDATE segments SET name = ? WHERE name = ?", (name, legacy))
+            return True
+    return False
+
+
+def parse_rows(source: str, path: str) -> Iterator[tuple]:
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                data = json.loads(line)
+                ts = data["timestamp"]
+            except (ValueError, KeyError, TypeError):
+                continue
+            yield (
+                ts[:10],
+                int(ts[11:13] or 0),
+                ts,
+                source,
+                data.get("event", "unknown"),
+                data.get("channel_id"),
+                data.get("channel_name"),
+                data.get("user_id"),
+            )
+
+
+def compact(logs_dir: str, db_path: str, delete: bool = False) -> int:
+    """Load every not-yet-compacted closed segment. Returns the number of rows added."""
+    conn = connect(db_path)
+    added = 0
+    for source, path in closed_segments(logs_dir):
+        name = segment_name(path, db_path)
+        if already_compacted(conn, name, path):
+            continue
+        rows = 0
+        batch = []
+        with conn:
+            for row in parse_rows(source, path):
+                batch.append(row)
+                if len(batch) >= BATCH_SIZE:
+                    conn.executemany("INSERT INTO events VALUES (?, ?, ?, ?, ?, ?, ?, ?)", batch)
+                    rows += len(batch)
+                    batch = []
+            conn.executemany("INSERT INTO events VALUES (?, ?, ?, ?, ?, ?, ?, ?)", batch)
+            rows += len(batch)
+            conn.execute(
+                "INSERT INTO segments VALUES (?, ?, ?, ?)",
+                (name, os.path.getsize(path), rows, datetime.utcnow().isoformat() + "Z"),
+            )
+        print(f"{name}: {rows} rows", file=sys.stderr)
+        added += rows
+        if delete:
+            os.remove(path)
+    conn.close()
+    return added
+
+
+def query(db_path: str, name: str, days: int) -> None:
+    sql, columns = QUERIES[name]
+    since = (datetime.utcnow() - timedelta(days=days)).strftime("%Y-%m-%d")
+    conn = connect(db_path)
+    print("\t".join(columns))
+    for row in conn.execute(sql, (since,)):
+        print("\t".join("" if v is None else str(v) for v in row))
+    conn.close()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Compact and query Botty's activity logs.")
+    parser.add_argument("--logs", default=DEFAULT_LOGS_DIR, help="log directory (default: logs)")
+    parser.add_argument("--db", default=DEFAULT_DB, help="analytics database (default: logs/analytics.db)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    compact_parser = sub.add_parser("compact", help="load closed log segments into the database")
+    compact_parser.add_argument("--delete", action="store_true", help="remove segments once loaded")
+    query_parser = sub.add_parser("query", help="run a report")
+    query_parser.add_argument("report", choices=sorted(QUERIES))
+    query_parser.add_argument("--days", type=int, default=7, help="look back this many days (default: 7)")
+    args = parser.parse_args(argv)
+
+    if args.command == "compact":
+        added = compact(args.logs, args.db, delete=args.delete)
+        print(f"Compacted {added} rows into {args.db}", file=sys.stderr)
+    else:
+        query(args.db, args.report, args.days)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
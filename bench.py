@@ -0,0 +1,928 @@
+"""
+Offline benchmark and load test for Botty.
+
+Drives the real `on_message`, command and scheduler code paths in bot.py
+against local stand-ins, so throughput can be measured without Discord or
+OpenAI:
+
+    python bench.py                                  # all scenarios
+    python bench.py chat --messages 50000 --rate 5000 --channels 500
+    python bench.py commands --latency 0.2
+    python bench.py scheduler --jobs 20000
+    python bench.py summary --summary-latency 5
+    python bench.py startup --startup-target 2
+    python bench.py facts --fact-days 60
+
+OpenAI is replaced by a stub HTTP server on 127.0.0.1 speaking just enough
+of the API (chat completions, streamed or not, image generation and the
+model list) for the real SDK client, with configurable latency. Discord is
+replaced by fake channel, user and message objects that record what the
+bot sends. Everything runs in a temporary directory so the bot's logs and
+state files are thrown away afterwards.
+
+Each scenario reports throughput, p50/p99 latency, event loop lag and the
+process's peak memory. The summary scenario also checks that replies never
+wait for history summarisation, the facts scenario that no channel is sent
+the same daily fact twice within the facts it remembers, and the startup scenario that a fresh
+process with a large amount of saved state gets to the point of connecting
+to Discord within `--startup-target` seconds and queues every saved job; the exit status is non-zero
+if any check fails.
+"""
+import argparse
+import asyncio
+import base64
+import itertools
+import json
+import logging
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+# --- Stub OpenAI server ---
+
+class StubOpenAI:
+    """
+    Minimal OpenAI-compatible HTTP server. Chat replies are `tokens` words
+    long; the first arrives after `latency` seconds and the rest every
+    `token_interval` seconds. Connections are kept alive so the client's
+    pool behaves as it would against the real API.
+    """
+    def __init__(
+        self,
+        latency: float = 0.05,
+        tokens: int = 20,
+        token_interval: float = 0.0,
+        image_latency: float = 0.5,
+        summary_latency: float = 2.0,
+    ):
+        self.latency = latency
+        self.tokens = tokens
+        self.token_interval = token_interval
+        self.image_latency = image_latency
+        self.summary_latency = summary_latency
+        # System prompt that marks a history summarisation request
+        self.summary_marker: Optional[str] = None
+        # Start of the system prompt that asks for a batch of daily facts
+        self.fact_marker: Optional[str] = None
+        self.requests: Dict[str, int] = {}
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> str:
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        port = self.server.sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{port}/v1"
+
+    async def stop(self) -> None:
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request = await reader.readline()
+                if not request:
+                    return
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", "0") or 0))
+                method, path = request.decode("latin-1").split()[:2]
+                await self._route(method, path.split("?")[0], json.loads(body) if body else {}, writer)
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route(self, method: str, path: str, payload: dict, writer: asyncio.StreamWriter) -> None:
+        self.requests[path] = self.requests.get(path, 0) + 1
+        if path.endswith("/chat/completions"):
+            messages = payload.get("messages") or [{}]
+            if self.summary_marker and messages[0].get("content") == self.summary_marker:
+                self.requests["summary"] = self.requests.get("summary", 0) + 1
+                await asyncio.sleep(self.summary_latency)
+            else:
+                await asyncio.sleep(self.latency)
+            if self.fact_marker and (messages[0].get("content") or "").startswith(self.fact_marker):
+                self.requests["facts"] = self.requests.get("facts", 0) + 1
+                # The bot asks for about 60 tokens per fact
+                content = "\n".join(
+                    f"{i + 1}. Stub fact {uuid.uuid4().hex} is true. Who knew?"
+                    for i in range(max(1, payload.get("max_tokens", 60) // 60))
+                )
+            else:
+                content = self._reply()
+            if payload.get("stream"):
+                await self._stream_chat(payload, writer)
+            else:
+                self._send_json(writer, {
+                    "id": "chatcmpl-bench",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": payload.get("model", "gpt-4o"),
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }],
+                    "usage": {"prompt_tokens": 0, "completion_tokens": self.tokens, "total_tokens": self.tokens},
+                })
+        elif path.endswith("/images/generations"):
+            await asyncio.sleep(self.image_latency)
+            image = self._image(payload.get("prompt", ""))
+            if payload.get("response_format") == "b64_json":
+                data = {"b64_json": base64.b64encode(image).decode("ascii")}
+            else:
+                data = {"url": f"https://images.invalid/{uuid.uuid4().hex}.png"}
+            self._send_json(writer, {"created": int(time.time()), "data": [data]})
+        elif path.endswith("/models"):
+            self._send_json(writer, {
+                "object": "list",
+                "data": [{"id": m, "object": "model", "created": 0, "owned_by": "bench"} for m in ("gpt-4o", "gpt-4o-mini")],
+            })
+        else:
+            self._send_json(writer, {"error": {"message": "not found"}}, status="404 Not Found")
+        await writer.drain()
+
+    def _image(self, prompt: str) -> bytes:
+        """Stand-in image bytes, 64 KB like a small PNG and different per prompt."""
+        return b"\x89PNG\r\n\x1a\n" + (prompt.encode("utf-8") + b"\0") * (65536 // (len(prompt) + 1))
+
+    def _reply(self) -> str:
+        return " ".join(f"word{i}" for i in range(self.tokens))
+
+    def _send_json(self, writer: asyncio.StreamWriter, data: dict, status: str = "200 OK") -> None:
+        body = json.dumps(data).encode("utf-8")
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n".encode("latin-1") + body
+        )
+
+    async def _stream_chat(self, payload: dict, writer: asyncio.StreamWriter) -> None:
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/event-stream\r\n"
+            b"Transfer-Encoding: chunked\r\n\r\n"
+        )
+        model = payload.get("model", "gpt-4o")
+        for i in range(self.tokens):
+            if i and self.token_interval:
+                await writer.drain()
+                await asyncio.sleep(self.token_interval)
+            chunk = {
+                "id": "chatcmpl-bench",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": f"word{i} "}, "finish_reason": None}],
+            }
+            self._write_chunk(writer, f"data: {json.dumps(chunk)}\n\n")
+        self._write_chunk(writer, "data: [DONE]\n\n")
+        writer.write(b"0\r\n\r\n")
+
+    def _write_chunk(self, writer: asyncio.StreamWriter, text: str) -> None:
+        data = text.encode("utf-8")
+        writer.write(f"{len(data):x}\r\n".encode("latin-1") + data + b"\r\n")
+
+
+# --- Fake Discord objects ---
+
+_ids = itertools.count(10_000)
+
+
+class FakeUser:
+    def __init__(self, user_id: int, name: str, bot: bool = False):
+        self.id = user_id
+        self.name = name
+        self.display_name = name
+        self.bot = bot
+        self.mention = f"<@{user_id}>"
+
+    def __str__(self) -> str:
+        return self.name
+
+
+class FakeSentMessage:
+    def __init__(self, channel: "FakeChannel", content: str):
+        self.id = next(_ids)
+        self.channel = channel
+        self.content = content
+
+    async def edit(self, content: str = None, **kwargs) -> "FakeSentMessage":
+        await self.channel.api_call()
+        self.content = content
+        self.channel.edits += 1
+        return self
+
+    async def delete(self) -> None:
+        await self.channel.api_call()
+        self.channel.deletes += 1
+
+
+class FakeTyping:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeChannel:
+    """Stand-in for a Discord text channel; every call costs `latency` seconds."""
+    def __init__(self, channel_id: int, latency: float = 0.0):
+        self.id = channel_id
+        self.name = f"bench-{channel_id}"
+        self.guild = None
+        self.latency = latency
+        self.sent: List[str] = []
+        self.edits = 0
+        self.deletes = 0
+        self.uploads = 0
+
+    def __str__(self) -> str:
+        return self.name
+
+    async def api_call(self) -> None:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def send(self, content: str = None, **kwargs) -> FakeSentMessage:
+        await self.api_call()
+        self.sent.append(content)
+        if "file" in kwargs:
+            self.uploads += 1
+        return FakeSentMessage(self, content)
+
+    def typing(self) -> FakeTyping:
+        return FakeTyping()
+
+
+class FakeMessage:
+    # Set to the bot's ConnectionState; commands.Context reads it on creation
+    _state = None
+
+    def __init__(self, author: FakeUser, channel: FakeChannel, content: str):
+        self.id = next(_ids)
+        self.author = author
+        self.channel = channel
+        self.content = content
+        self.guild = None
+        self.mentions: list = []
+        self.attachments: list = []
+        self.received = time.perf_counter()
+
+
+def make_context_class(commands):
+    class BenchContext(commands.Context):
+        """Context whose replies go to the fake channel instead of the Discord API."""
+        async def send(self, content=None, **kwargs):
+            return await self.channel.send(content, **kwargs)
+
+        def typing(self, **kwargs):
+            return FakeTyping()
+
+    return BenchContext
+
+
+# --- Measurements ---
+
+def percentile(samples: List[float], q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+class LoopLagSampler:
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - started - self.interval))
+
+
+def report(name: str, count: int, elapsed: float, latencies: List[float], lag: LoopLagSampler, extra: str = "") -> None:
+    print(f"\n== {name} ==")
+    print(f"  completed:   {count} in {elapsed:.2f}s ({count / elapsed if elapsed else 0:.0f}/s)")
+    if latencies:
+        print(
+            f"  latency:     p50 {percentile(latencies, 0.5) * 1000:.1f} ms, "
+            f"p99 {percentile(latencies, 0.99) * 1000:.1f} ms, max {max(latencies) * 1000:.1f} ms"
+        )
+    print(
+        f"  loop lag:    p50 {percentile(lag.samples, 0.5) * 1000:.1f} ms, "
+        f"p99 {percentile(lag.samples, 0.99) * 1000:.1f} ms, max {max(lag.samples, default=0) * 1000:.1f} ms"
+    )
+    print(f"  peak memory: {peak_rss_mb():.0f} MB")
+    if extra:
+        print(f"  {extra}")
+
+
+# --- Scenarios ---
+
+async def replay(bot_module, messages: List[FakeMessage], rate: float) -> None:
+    """Feed messages to on_message at `rate` per second (0 = as fast as possible)."""
+    started = time.perf_counter()
+    for i, message in enumerate(messages):
+        if rate:
+            due = started + i / rate
+            delay = due - time.perf_counter()
+            if delay > 0.001:
+                await asyncio.sleep(delay)
+        message.received = time.perf_counter()
+        await bot_module.on_message(message)
+        if not rate and i % 100 == 0:
+            await asyncio.sleep(0)
+
+
+async def drain(bot_module, timeout: float) -> None:
+    deadline = time.perf_counter() + timeout
+    while bot_module.reply_queue.depth() or bot_module.reply_queue.active_channels():
+        if time.perf_counter() > deadline:
+            print(f"  warning: {bot_module.reply_queue.depth()} messages still queued after {timeout:g}s")
+            return
+        await asyncio.sleep(0.01)
+
+
+async def bench_chat(bot_module, args, stub: StubOpenAI) -> None:
+    channels = [FakeChannel(1_000 + i, args.discord_latency) for i in range(args.channels)]
+    users = [FakeUser(100_000 + i, f"user{i}") for i in range(args.users)]
+    messages = [
+        FakeMessage(users[i % len(users)], channels[(i * 7919) % len(channels)], f"benchmark message {i}")
+        for i in range(args.messages)
+    ]
+    latencies: List[float] = []
+    replied = 0
+    original = bot_module.reply_queue.handler
+
+    async def timed_handler(channel_id, batch):
+        nonlocal replied
+        await original(channel_id, batch)
+        done = time.perf_counter()
+        replied += 1
+        latencies.extend(done - m.received for m in batch)
+
+    bot_module.reply_queue.handler = timed_handler
+    lag = LoopLagSampler()
+    lag.start()
+    started = time.perf_counter()
+    try:
+        await replay(bot_module, messages, args.rate)
+        offered = time.perf_counter() - started
+        await drain(bot_module, args.timeout)
+    finally:
+        bot_module.reply_queue.handler = original
+    elapsed = time.perf_counter() - started
+    await lag.stop()
+    sends = sum(len(c.sent) for c in channels)
+    edits = sum(c.edits for c in channels)
+    outcomes = ", ".join(f"{source} {int(n)}" for (source,), n in sorted(bot_module.replies_total.values.items()))
+    report(
+        f"chat: {args.messages} messages over {args.channels} channels",
+        len(latencies), elapsed, latencies, lag,
+        f"offered at {len(messages) / offered:.0f}/s; {replied} completions "
+        f"({stub.requests.get('/v1/chat/completions', 0)} OpenAI calls), {sends} sends, {edits} edits; "
+        f"replies by source: {outcomes}",
+    )
+
+
+async def bench_commands(bot_module, args, stub: StubOpenAI) -> None:
+    channels = [FakeChannel(50_000 + i, args.discord_latency) for i in range(max(1, args.channels // 10))]
+    users = [FakeUser(200_000 + i, f"cmduser{i}") for i in range(args.users)]
+    # Image prompts repeat, so some are served from the cache or share a job
+    templates = ["!image a benchmark picture {n}", "!schedule 23:59 reminder {i}", "!help"]
+    messages = [
+        FakeMessage(users[i % len(users)], channels[i % len(channels)], templates[i % len(templates)].format(i=i, n=i % 40))
+        for i in range(args.commands)
+    ]
+    before = sum(len(c.sent) for c in channels)
+    latencies: List[float] = []
+
+    async def run(message: FakeMessage) -> None:
+        message.received = time.perf_counter()
+        await bot_module.on_message(message)
+        latencies.append(time.perf_counter() - message.received)
+
+    lag = LoopLagSampler()
+    lag.start()
+    started = time.perf_counter()
+    await asyncio.gather(*(run(m) for m in messages))
+    elapsed = time.perf_counter() - started
+    # Images are generated and uploaded in the background
+    await asyncio.wait_for(bot_module.image_jobs.join(), args.timeout)
+    if bot_module.image_deliveries:
+        await asyncio.wait(bot_module.image_deliveries, timeout=args.timeout)
+    images_done = time.perf_counter() - started
+    await lag.stop()
+    cache = bot_module.image_cache
+    report(
+        f"commands: {args.commands} commands",
+        len(latencies), elapsed, latencies, lag,
+        f"{sum(len(c.sent) for c in channels) - before} replies sent; "
+        f"{sum(c.uploads for c in channels)} images uploaded after {images_done:.2f}s from "
+        f"{stub.requests.get('/v1/images/generations', 0)} image calls "
+        f"({cache.hits} cache hits, {bot_module.image_jobs.joined} shared jobs)",
+    )
+
+
+def check_cron_ranges(bot_module) -> bool:
+    """Day of week ranges that wrap past Saturday must parse; other backwards ranges must be refused."""
+    # Python weekdays, Monday = 0
+    expected = {"sat-sun": {5, 6}, "fri-sun": {4, 5, 6}, "fri-mon": {4, 5, 6, 0}, "6-0": {5, 6}, "5-1/2": {4, 6}}
+    ok = True
+    for days, weekdays in expected.items():
+        try:
+            schedule = bot_module.compile_schedule(f"0 9 * * {days}", "Europe/London")
+        except bot_module.CronError as e:
+            print(f"  cron '{days}' was refused: {e}")
+            ok = False
+            continue
+        fires = {schedule.next_after(datetime(2026, 3, 1) + timedelta(days=d)).weekday() for d in range(14)}
+        if schedule.weekdays != weekdays or fires != weekdays:
+            print(f"  cron '{days}' fires on weekdays {sorted(fires)}, expected {sorted(weekdays)}")
+            ok = False
+    try:
+        bot_module.compile_schedule("0 22-2 * * *")
+        print("  cron hour range '22-2' was accepted")
+        ok = False
+    except bot_module.CronError:
+        pass
+    return ok
+
+
+def check_daily_joke_days(bot_module, fires: int = 200) -> bool:
+    """Consecutive daily jokes must land on consecutive local days, one per day."""
+    ok = True
+    for tz_name in ("Europe/London", "America/New_York", "Pacific/Auckland"):
+        tz = bot_module.timezone_for(tz_name)
+        due = bot_module.random_joke_time(datetime(2026, 1, 1, 12), tz_name)
+        days = []
+        for _ in range(fires):
+            days.append(due.replace(tzinfo=timezone.utc).astimezone(tz).date())
+            due = bot_module.next_joke_time(due, due, tz_name)
+        span = (days[-1] - days[0]).days + 1
+        if span != fires or len(set(days)) != fires:
+            print(f"  {fires} daily jokes in {tz_name} covered {span} days, {len(set(days))} of them with a joke")
+            ok = False
+    return ok
+
+
+async def bench_scheduler(bot_module, args, stub: StubOpenAI) -> bool:
+    """
+    Due jobs fire concurrently. Every other job is a weekday cron schedule
+    whose last occurrence was missed during three days of downtime: it must
+    be sent once (catch-up "once") and then move straight to its next
+    future occurrence instead of replaying each missed day. Day of week
+    ranges that wrap around the week, like sat-sun, are checked too, and
+    so is that daily jokes come once on every local day.
+    """
+    channels = {1_000_000 + i: FakeChannel(1_000_000 + i, args.discord_latency) for i in range(max(1, args.channels))}
+    ids = list(channels)
+    now = datetime.utcnow()
+    missed = (now - timedelta(days=3)).isoformat()
+    bot_module.scheduled_messages.clear()
+    for i in range(args.jobs):
+        msg_id = uuid.uuid4().hex[:8]
+        bot_module.scheduled_messages[msg_id] = {
+            "id": msg_id,
+            "channel_id": str(ids[i % len(ids)]),
+            "send_time": now.isoformat() if i % 2 else missed,
+            "content": f"scheduled {i}",
+        }
+        if not i % 2:
+            bot_module.scheduled_messages[msg_id].update(
+                recurring="cron", cron="30 8 * * mon-fri", tz="America/New_York", catchup="once"
+            )
+    bot_module.scheduled_store.save()
+    previous_get_channel = bot_module.bot.get_channel
+    bot_module.bot.get_channel = lambda channel_id: channels.get(channel_id) or previous_get_channel(channel_id)
+
+    lag = LoopLagSampler()
+    lag.start()
+    started = time.perf_counter()
+    task = asyncio.create_task(bot_module.scheduled_message_task())
+    deadline = started + args.timeout
+    while sum(len(c.sent) for c in channels.values()) < args.jobs and time.perf_counter() < deadline:
+        await asyncio.sleep(0.005)
+    elapsed = time.perf_counter() - started
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    await lag.stop()
+    bot_module.bot.get_channel = previous_get_channel
+    fired = sum(len(c.sent) for c in channels.values())
+    lateness = bot_module.delivery_lateness
+    left = list(bot_module.scheduled_messages.values())
+    ok = (
+        fired == args.jobs
+        and len(left) == (args.jobs + 1) // 2
+        and all(datetime.fromisoformat(msg["send_time"]) > now for msg in left)
+        and check_cron_ranges(bot_module)
+        and check_daily_joke_days(bot_module)
+    )
+    report(
+        f"scheduler: {args.jobs} due jobs", fired, elapsed, [], lag,
+        f"{len(left)} recurring jobs rescheduled; sent p50 {lateness.quantile(0.5, 'scheduled') or 0:.2f}s, "
+        f"p99 {lateness.quantile(0.99, 'scheduled') or 0:.2f}s after their due time: {'PASS' if ok else 'FAIL'}",
+    )
+    for msg_id in list(bot_module.scheduled_messages):
+        bot_module.scheduler.cancel(f"msg:{msg_id}")
+    bot_module.scheduled_messages.clear()
+    bot_module.scheduled_store.save()
+    return ok
+
+
+async def bench_summary(bot_module, args, stub: StubOpenAI) -> bool:
+    """Replies made while their channel is being summarised must not wait for the summary."""
+    history = bot_module.history_manager
+    saved = (history.summarize_after, history.keep_recent)
+    history.summarize_after, history.keep_recent = args.summary_after, max(1, args.summary_after // 2)
+    channels = [FakeChannel(2_000_000 + i, args.discord_latency) for i in range(min(args.channels, 20))]
+    users = [FakeUser(300_000 + i, f"chatter{i}") for i in range(len(channels) * 2)]
+    per_channel = args.summary_after * 4
+    messages = [
+        FakeMessage(users[i % len(users)], channels[i % len(channels)], f"long conversation message {i}")
+        for i in range(per_channel * len(channels))
+    ]
+    overlapped: List[float] = []
+    normal: List[float] = []
+    original = bot_module.reply_queue.handler
+
+    async def timed_handler(channel_id, batch):
+        busy = history.is_summarizing(channel_id)
+        started = time.perf_counter()
+        await original(channel_id, batch)
+        (overlapped if busy else normal).append(time.perf_counter() - started)
+
+    bot_module.reply_queue.handler = timed_handler
+    made = history.summaries_made
+    lag = LoopLagSampler()
+    lag.start()
+    started = time.perf_counter()
+    try:
+        # Slow enough that each message gets its own reply
+        await replay(bot_module, messages, rate=len(channels) / (args.latency * 4 + 0.05))
+        await drain(bot_module, args.timeout)
+    finally:
+        bot_module.reply_queue.handler = original
+    elapsed = time.perf_counter() - started
+    deadline = time.perf_counter() + args.summary_latency * 2 + 5
+    while history.stats()["summarizing"] and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+    await lag.stop()
+    history.summarize_after, history.keep_recent = saved
+
+    worst = max(overlapped, default=0.0)
+    ok = bool(overlapped) and worst < args.summary_latency
+    verdict = "PASS" if ok else ("INCONCLUSIVE (no reply overlapped a summary)" if not overlapped else "FAIL")
+    report(
+        f"summary: {len(messages)} messages over {len(channels)} channels",
+        len(overlapped) + len(normal), elapsed, overlapped + normal, lag,
+        f"{history.summaries_made - made} summaries ({stub.requests.get('summary', 0)} calls at "
+        f"{args.summary_latency:g}s); {len(overlapped)} replies during a summary took at most "
+        f"{worst * 1000:.0f} ms: {verdict}",
+    )
+    return ok
+
+
+def write_large_state(logs_dir: str, records: int) -> None:
+    """Saved state the size and shape of a long-running bot's, for the startup scenario."""
+    os.makedirs(logs_dir, exist_ok=True)
+    soon = datetime.utcnow() + timedelta(hours=1)
+    zones = ("Europe/London", "America/New_York", "Asia/Tokyo", "UTC")
+    scheduled = []
+    for i in range(records):
+        msg = {
+            "id": f"{i:08x}",
+            "channel_id": str(3_000_000 + i % 500),
+            "content": f"reminder {i}",
+            "send_time": (soon + timedelta(seconds=i)).isoformat(),
+            "recurring": None,
+            "cron": None,
+            "tz": zones[i % len(zones)],
+            "catchup": "skip",
+        }
+        if i % 3 == 1:
+            msg.update(recurring="cron", cron=f"{i % 60} 9 * * mon-fri")
+        elif i % 3 == 2:
+            # Saved before cron support
+            msg.update(recurring="daily", cron=None, tz="UTC")
+            del msg["catchup"]
+        scheduled.append(msg)
+    facts = {f"{i:012x}": f"Stub fact {i} is true. Who knew?" for i in range(1000)}
+    state = {
+        "bot_config.json": {
+            "model": "gpt-4o",
+            "autoreply": True,
+            "stream": True,
+            "cache_channels": {str(3_000_000 + i): 600 for i in range(1000)},
+            "quotas": {
+                "users": {str(i): {"chat": 50, "weight": 2} for i in range(1000)},
+                "channels": {str(3_000_000 + i): {"image": 5} for i in range(100)},
+            },
+        },
+        "dailyjoke_channels.json": {
+            str(3_000_000 + i): {
+                "enabled": i % 5 != 0,
+                "next_time": (soon + timedelta(seconds=i)).isoformat(),
+                "tz": zones[i % len(zones)],
+            }
+            for i in range(records // 10)
+        },
+        "scheduled_messages.json": scheduled,
+        "stats.json": {
+            "users": {str(i): {"username": f"user{i}", "messages": i % 97, "commands": i % 13} for i in range(records)},
+            "channels": {
+                str(3_000_000 + i): {"messages": i, "responses": i // 2, "name": f"channel-{i}"}
+                for i in range(records // 10)
+            },
+            "events": {"user_message": records * 10, "bot_response": records * 5},
+            "hours": {f"{h:02d}": records for h in range(24)},
+        },
+        "daily_facts.json": {"facts": facts},
+        "daily_facts_seen.json": {str(3_000_000 + i): list(facts)[i % 900:i % 900 + 60] for i in range(records // 10)},
+    }
+    for filename, data in state.items():
+        with open(os.path.join(logs_dir, filename), "w", encoding="utf-8") as f:
+            json.dump(data, f)
+
+
+async def startup_probe() -> None:
+    """
+    Run in a child process: import the bot, run its startup up to the point
+    where it waits for Discord, check that every saved job was scheduled,
+    and print the startup timings.
+    """
+    sys.path.insert(0, HERE)
+    import bot as bot_module
+    startup = asyncio.create_task(bot_module.start_state_and_scheduler())
+    while "jobs_scheduled" not in bot_module.startup_timings and not startup.done():
+        await asyncio.sleep(0.005)
+    if "jobs_scheduled" not in bot_module.startup_timings:
+        # Startup failed before scheduling anything; surface its error
+        await startup
+    # Without a Discord login, waiting for the bot to be ready fails or hangs
+    startup.cancel()
+    await asyncio.gather(startup, return_exceptions=True)
+    timings = dict(bot_module.startup_timings)
+    jokes = sum(1 for info in bot_module.dailyjoke_channels.values() if info.get("enabled"))
+    timings["scheduled_messages"] = len(bot_module.scheduled_messages)
+    timings["jobs"] = len(bot_module.scheduler)
+    timings["jobs_expected"] = len(bot_module.scheduled_messages) + jokes
+    # Read the loaded data the way handlers do
+    timings["recurring"] = sum(1 for msg in bot_module.scheduled_messages.values() if bot_module.recurrence_for(msg))
+    timings["cached_channels"] = sum(1 for i in range(1000) if bot_module.cache_ttl_for(3_000_000 + i))
+    timings["unseen_facts"] = bot_module.fact_pool.unseen("3000000")
+    print(json.dumps(timings))
+
+
+async def bench_startup(bot_module, args, stub: StubOpenAI) -> bool:
+    """Time a cold start of a fresh process; loading saved state must stay off the path to Discord."""
+    logs_dir = os.path.abspath("startup-logs")
+    write_large_state(logs_dir, args.state_records)
+    size = sum(os.path.getsize(os.path.join(logs_dir, name)) for name in os.listdir(logs_dir))
+    env = dict(os.environ, LOGS_DIR=logs_dir)
+    env.pop("SHARED_STATE_DB", None)
+    runs = []
+    for _ in range(3):
+        started = time.perf_counter()
+        proc = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.join(HERE, "bench.py"), "--startup-probe",
+            env=env, stdout=asyncio.subprocess.PIPE, stderr=None if args.verbose else asyncio.subprocess.DEVNULL,
+        )
+        out, _ = await proc.communicate()
+        if proc.returncode != 0:
+            print(f"startup: probe process exited with code {proc.returncode}: FAIL")
+            return False
+        timings = json.loads(out.decode().strip().splitlines()[-1])
+        timings["process"] = time.perf_counter() - started
+        runs.append(timings)
+
+    # Once bot.py is imported, main() goes straight to bot.run()
+    best = min(runs, key=lambda t: t["imports"])
+    to_connect = best["imports"]
+    loaded = (
+        best["scheduled_messages"] == args.state_records
+        and best["jobs"] == best["jobs_expected"]
+        and best["recurring"] == args.state_records - (args.state_records + 2) // 3
+        and best["cached_channels"] == 1000
+        and best["unseen_facts"] == 940
+    )
+    ok = to_connect <= args.startup_target and loaded
+    print(
+        f"startup: {size / 1e6:.1f} MB of saved state; imports {best['imports'] * 1000:.0f} ms, "
+        f"state loaded {(best['state_loaded'] - best['imports']) * 1000:.0f} ms and {best['jobs']} jobs scheduled "
+        f"{(best['jobs_scheduled'] - best['imports']) * 1000:.0f} ms later in the background"
+        f"{'' if loaded else ' (saved state did not load intact)'}, "
+        f"process {best['process'] * 1000:.0f} ms (best of {len(runs)}); "
+        f"time to connect {to_connect:.2f}s against a {args.startup_target:g}s target: {'PASS' if ok else 'FAIL'}"
+    )
+    return ok
+
+
+async def bench_facts(bot_module, args, stub: StubOpenAI) -> bool:
+    """Daily facts over many channels: sends must not wait on OpenAI, and no channel may get a recent repeat."""
+    pool = bot_module.fact_pool
+    pool.refill_interval = 0
+    channels = {4_000_000 + i: FakeChannel(4_000_000 + i, args.discord_latency) for i in range(args.channels * 10)}
+    now = datetime.utcnow().isoformat()
+    for channel_id in channels:
+        bot_module.dailyjoke_channels[str(channel_id)] = {"enabled": True, "next_time": now}
+    previous_get_channel = bot_module.bot.get_channel
+    bot_module.bot.get_channel = lambda channel_id: channels.get(channel_id) or previous_get_channel(channel_id)
+
+    latencies: List[float] = []
+
+    async def send(channel_id: int) -> None:
+        started = time.perf_counter()
+        await bot_module.send_dailyjoke(str(channel_id))
+        latencies.append(time.perf_counter() - started)
+
+    lag = LoopLagSampler()
+    lag.start()
+    started = time.perf_counter()
+    try:
+        for _ in range(args.fact_days):
+            await asyncio.gather(*(send(channel_id) for channel_id in channels))
+            # A day passes between rounds, which is plenty for a refill to land
+            if pool._refill_task is not None:
+                await pool._refill_task
+    finally:
+        bot_module.bot.get_channel = previous_get_channel
+    elapsed = time.perf_counter() - started
+    await lag.stop()
+    for channel_id in channels:
+        bot_module.dailyjoke_channels.pop(str(channel_id), None)
+        bot_module.scheduler.cancel(f"joke:{channel_id}")
+
+    # Facts may come round again once they are older than the pool remembers
+    repeats = sum(
+        1 for c in channels.values() for i, fact in enumerate(c.sent) if fact in c.sent[max(0, i - pool.remember):i]
+    )
+    ok = repeats == 0 and all(len(c.sent) == args.fact_days for c in channels.values())
+    report(
+        f"facts: {len(channels)} channels for {args.fact_days} days",
+        len(latencies), elapsed, latencies, lag,
+        f"{stub.requests.get('facts', 0)} fact generation calls, {len(pool.facts)} facts pooled; "
+        f"{repeats} repeats within a channel: {'PASS' if ok else 'FAIL'}",
+    )
+    return ok
+
+
+SCENARIOS = {
+    "chat": bench_chat,
+    "commands": bench_commands,
+    "scheduler": bench_scheduler,
+    "summary": bench_summary,
+    "facts": bench_facts,
+    "startup": bench_startup,
+}
+
+
+async def main_async(args) -> int:
+    stub = StubOpenAI(args.latency, args.tokens, args.token_interval, args.image_latency, args.summary_latency)
+    base_url = await stub.start()
+
+    # The bot reads its configuration at import time
+    os.environ.update({
+        "DISCORD_TOKEN": "bench",
+        "OPENAI_API_KEY": "bench",
+        "OPENAI_BASE_URL": base_url,
+        "METRICS_PORT": "0",
+        "CHAT_QUOTA": "0",
+        "IMAGE_QUOTA": "0",
+        "OPENAI_REQUESTS_PER_MINUTE": "100000000",
+        "OPENAI_MODEL_REQUESTS_PER_MINUTE": "100000000",
+        "DISCORD_REQUESTS_PER_SECOND": "100000000",
+        "DISCORD_CHANNEL_RATE": "100000000",
+        "OPENAI_MAX_CONCURRENCY": str(args.concurrency),
+        "STREAM_EDIT_INTERVAL": str(args.edit_interval),
+    })
+    sys.path.insert(0, HERE)
+    import_started = time.perf_counter()
+    import bot as bot_module
+    from discord.ext import commands
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+    stub.summary_marker = bot_module.SUMMARY_PROMPT
+    stub.fact_marker = bot_module.FACT_PROMPT.split("{n}")[0]
+    print(f"bot imported in {(time.perf_counter() - import_started) * 1000:.0f} ms; stub OpenAI at {base_url}")
+
+    # What setup_hook and on_ready would do, without connecting to Discord
+    await bot_module.hydrate_state()
+    await bot_module.bot._async_setup_hook()
+    bot_module.bot._ready.set()
+    bot_module.bot_config["stream"] = not args.no_stream
+    bot_module.bot._connection.user = FakeUser(1, "Botty", bot=True)
+    FakeMessage._state = bot_module.bot._connection
+    context_class = make_context_class(commands)
+    get_context = bot_module.bot.get_context
+    bot_module.bot.get_context = lambda origin, cls=context_class: get_context(origin, cls=cls)
+
+    failed = False
+    try:
+        for name in args.scenarios:
+            if await SCENARIOS[name](bot_module, args, stub) is False:
+                failed = True
+    finally:
+        bot_module.history_manager.cancel_summaries()
+        bot_module.image_jobs.cancel()
+        await bot_module.ai_client.close()
+        for store in bot_module.state_stores:
+            store.flush()
+        bot_module.image_cache.flush()
+        if bot_module.history_manager.store is not None:
+            bot_module.history_manager.store.close()
+        bot_module.log_writer.close()
+        await stub.stop()
+    return 1 if failed else 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark Botty against a stub OpenAI server and fake Discord channels.")
+    parser.add_argument("scenarios", nargs="*", metavar="scenario", help=f"one of {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument("--messages", type=int, default=20000, help="chat messages to replay (default: 20000)")
+    parser.add_argument("--rate", type=float, default=5000, help="messages per second, 0 for unthrottled (default: 5000)")
+    parser.add_argument("--channels", type=int, default=200, help="channels to spread traffic over (default: 200)")
+    parser.add_argument("--users", type=int, default=1000, help="distinct users (default: 1000)")
+    parser.add_argument("--commands", type=int, default=300, help="commands to run in the commands scenario (default: 300)")
+    parser.add_argument("--jobs", type=int, default=5000, help="due jobs in the scheduler scenario (default: 5000)")
+    parser.add_argument("--latency", type=float, default=0.05, help="stub OpenAI time to first token, seconds (default: 0.05)")
+    parser.add_argument("--token-interval", type=float, default=0.0, help="stub OpenAI delay between streamed tokens (default: 0)")
+    parser.add_argument("--tokens", type=int, default=20, help="words per stub reply (default: 20)")
+    parser.add_argument("--image-latency", type=float, default=0.5, help="stub image generation time, seconds (default: 0.5)")
+    parser.add_argument("--summary-latency", type=float, default=2.0, help="stub history summarisation time, seconds (default: 2)")
+    parser.add_argument("--summary-after", type=int, default=12, help="history length that triggers a summary in the summary scenario (default: 12)")
+    parser.add_argument("--fact-days", type=int, default=30, help="daily fact rounds in the facts scenario (default: 30)")
+    parser.add_argument("--discord-latency", type=float, default=0.0, help="fake Discord API call time, seconds (default: 0)")
+    parser.add_argument("--concurrency", type=int, default=64, help="OPENAI_MAX_CONCURRENCY for the run (default: 64)")
+    parser.add_argument("--edit-interval", type=float, default=0.2, help="STREAM_EDIT_INTERVAL for the run (default: 0.2)")
+    parser.add_argument("--no-stream", action="store_true", help="use non-streaming completions")
+    parser.add_argument("--timeout", type=float, default=120, help="give up waiting for a scenario after this long (default: 120)")
+    parser.add_argument("--verbose", action="store_true", help="show the bot's INFO logs")
+    parser.add_argument("--state-records", type=int, default=50000, help="scheduled messages and users in the startup scenario's saved state (default: 50000)")
+    parser.add_argument("--startup-target", type=float, default=3.0, help="seconds a cold start may take to reach the Discord login (default: 3)")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary working directory")
+    parser.add_argument("--startup-probe", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.startup_probe:
+        asyncio.run(startup_probe())
+        return 0
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario: {', '.join(unknown)}")
+    args.scenarios = args.scenarios or list(SCENARIOS)
+
+    workdir = tempfile.mkdtemp(prefix="botty-bench-")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        return asyncio.run(main_async(args))
+    finally:
+        os.chdir(cwd)
+        if args.keep:
+            print(f"Working directory kept at {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
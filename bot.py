@@ -1,21 +1,114 @@
 import os
+import atexit
 import logging
-from collections import defaultdict, deque
-from typing import Dict, List, Any
+import random
+import time
+import uuid
+import asyncio
+import io
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Union
+
+# Everything in startup_timings is measured from here
+BOOT_STARTED = time.perf_counter()
 
 import discord
 from discord.ext import commands
 import openai
-import asyncio
-from discord.ext import tasks
 from dotenv import load_dotenv
 
+from activity_log import JsonlLogWriter
+from history import ChannelHistory
+from history_store import SQLiteHistoryStore
+from channel_queue import ChannelWorkQueue
+from reply_stream import StreamingReply, split_message
+from scheduler import Scheduler
+from state_store import JsonStateStore
+from shared_state import SharedStateDB, SQLiteStateStore
+from response_cache import ResponseCache
+from stats import StatsEngine
+from metrics import Registry, monitor_loop_lag, serve as serve_metrics
+from openai_client import OpenAIClient
+from rate_limit import LOW, LoadShedError, RateGovernor
+from fair_share import FairShareScheduler, QuotaExceeded
+from fact_pool import FactPool
+from recurrence import (
+    CATCHUP_ONCE, CATCHUP_POLICIES, CronError, advance, compile_schedule, is_timezone, timezone_for,
+)
+from image_jobs import DONE, GENERATING, ImageCache, ImageJobQueue, ImageQueueFull
+
 # --- Configuration & Logging ---
 
 load_dotenv()
 DISCORD_TOKEN = os.getenv("DISCORD_TOKEN")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 MAX_HISTORY = 100
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "4000"))
+HISTORY_MAX_BYTES = int(os.getenv("HISTORY_MAX_BYTES", str(64 * 1024 * 1024)))
+HISTORY_MAX_CHANNELS = int(os.getenv("HISTORY_MAX_CHANNELS", "0"))
+HISTORY_DB = os.getenv("HISTORY_DB", "")
+HISTORY_SUMMARY_AFTER = int(os.getenv("HISTORY_SUMMARY_AFTER", "40"))
+HISTORY_SUMMARY_KEEP = int(os.getenv("HISTORY_SUMMARY_KEEP", "20"))
+HISTORY_SUMMARY_MODEL = os.getenv("HISTORY_SUMMARY_MODEL", "gpt-4o-mini")
+HISTORY_SUMMARY_CONCURRENCY = int(os.getenv("HISTORY_SUMMARY_CONCURRENCY", "2"))
+REPLY_MAX_TOKENS = 150
+REPLY_DEBOUNCE_SECONDS = float(os.getenv("REPLY_DEBOUNCE_SECONDS", "0"))
+REPLY_MAX_BATCH = int(os.getenv("REPLY_MAX_BATCH", "10"))
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1000"))
+RESPONSE_CACHE_CONTEXT = int(os.getenv("RESPONSE_CACHE_CONTEXT", "2"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "600"))
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "16"))
+OPENAI_IMAGE_CONCURRENCY = int(os.getenv("OPENAI_IMAGE_CONCURRENCY", "2"))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "30"))
+OPENAI_IMAGE_TIMEOUT = float(os.getenv("OPENAI_IMAGE_TIMEOUT", "120"))
+FACT_MODEL = os.getenv("FACT_MODEL", "gpt-4o-mini")
+FACT_POOL_BATCH = int(os.getenv("FACT_POOL_BATCH", "50"))
+FACT_POOL_LOW_WATER = int(os.getenv("FACT_POOL_LOW_WATER", "20"))
+FACT_POOL_MAX = int(os.getenv("FACT_POOL_MAX", "1000"))
+FACT_POOL_REMEMBER = int(os.getenv("FACT_POOL_REMEMBER", "60"))
+IMAGE_MODEL = os.getenv("IMAGE_MODEL", "dall-e-3")
+IMAGE_SIZE = os.getenv("IMAGE_SIZE", "1024x1024")
+IMAGE_MAX_PENDING = int(os.getenv("IMAGE_MAX_PENDING", "50"))
+IMAGE_CACHE_MAX_MB = float(os.getenv("IMAGE_CACHE_MAX_MB", "500"))
+OPENAI_REQUESTS_PER_MINUTE = float(os.getenv("OPENAI_REQUESTS_PER_MINUTE", "500"))
+OPENAI_MODEL_REQUESTS_PER_MINUTE = float(os.getenv("OPENAI_MODEL_REQUESTS_PER_MINUTE", "500"))
+DISCORD_REQUESTS_PER_SECOND = float(os.getenv("DISCORD_REQUESTS_PER_SECOND", "40"))
+# Discord allows about 5 messages per 5 seconds in each channel
+DISCORD_CHANNEL_RATE = float(os.getenv("DISCORD_CHANNEL_RATE", "1"))
+DISCORD_CHANNEL_BURST = float(os.getenv("DISCORD_CHANNEL_BURST", "5"))
+DELIVERY_CONCURRENCY = int(os.getenv("DELIVERY_CONCURRENCY", "50"))
+SCHEDULE_TIMEZONE = os.getenv("SCHEDULE_TIMEZONE", "UTC")
+DAILYJOKE_TIMEZONE = os.getenv("DAILYJOKE_TIMEZONE", "Europe/London")
+# Sends more than SCHEDULE_CATCHUP_GRACE seconds late (e.g. after downtime)
+# are dropped under "skip" and sent once under "once"
+SCHEDULE_CATCHUP = os.getenv("SCHEDULE_CATCHUP", CATCHUP_ONCE)
+SCHEDULE_CATCHUP_GRACE = float(os.getenv("SCHEDULE_CATCHUP_GRACE", "300"))
+RETRY_ATTEMPTS = int(os.getenv("RETRY_ATTEMPTS", "4"))
+BREAKER_THRESHOLD = int(os.getenv("BREAKER_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", "30"))
+CHAT_QUOTA = int(os.getenv("CHAT_QUOTA", "20"))
+CHAT_CHANNEL_QUOTA = int(os.getenv("CHAT_CHANNEL_QUOTA", "0"))
+CHAT_QUOTA_WINDOW = float(os.getenv("CHAT_QUOTA_WINDOW", "60"))
+IMAGE_QUOTA = int(os.getenv("IMAGE_QUOTA", "5"))
+IMAGE_CHANNEL_QUOTA = int(os.getenv("IMAGE_CHANNEL_QUOTA", "0"))
+IMAGE_QUOTA_WINDOW = float(os.getenv("IMAGE_QUOTA_WINDOW", "3600"))
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "1"))
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "256"))
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(50 * 1024 * 1024)))
+LOG_ROTATE_SECONDS = float(os.getenv("LOG_ROTATE_SECONDS", "86400"))
+STATE_SAVE_DEBOUNCE = float(os.getenv("STATE_SAVE_DEBOUNCE", "1"))
+STATS_SNAPSHOT_INTERVAL = float(os.getenv("STATS_SNAPSHOT_INTERVAL", "60"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+STARTUP_TARGET_SECONDS = float(os.getenv("STARTUP_TARGET_SECONDS", "15"))
+LOGS_DIR = os.getenv("LOGS_DIR", "logs")
+# Sharding: set by launcher.py; SHARED_STATE_DB moves config and schedules
+# into a SQLite database every shard process uses
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "0"))
+SHARD_IDS = [int(i) for i in os.getenv("SHARD_IDS", "").split(",") if i.strip()]
+SHARED_STATE_DB = os.getenv("SHARED_STATE_DB", "")
+SHARED_STATE_REFRESH = float(os.getenv("SHARED_STATE_REFRESH", "10"))
 
 logging.basicConfig(
     level=logging.INFO,
@@ -23,356 +116,776 @@ logging.basicConfig(
 )
 logger = logging.getLogger("botty")
 
-import json
-from datetime import datetime
+# Seconds from BOOT_STARTED to each startup milestone
+startup_timings = {}
+
+def mark_startup(phase: str) -> None:
+    if phase not in startup_timings:
+        startup_timings[phase] = time.perf_counter() - BOOT_STARTED
+        logger.info(f"Startup: {phase} after {startup_timings[phase]:.2f}s")
+
+mark_startup("imports")
+
+# --- Metrics ---
+
+metrics_registry = Registry()
+stage_seconds = metrics_registry.histogram(
+    "botty_stage_seconds", "Time spent in each stage of the bot's pipelines", ["stage"]
+)
+messages_total = metrics_registry.counter("botty_messages_total", "User messages queued for an auto-reply")
+replies_total = metrics_registry.counter("botty_replies_total", "Replies produced, by where they came from", ["source"])
+api_errors_total = metrics_registry.counter("botty_api_errors_total", "Failed OpenAI and Discord calls", ["api"])
+delivery_lateness = metrics_registry.histogram(
+    "botty_delivery_lateness_seconds", "How long after its due time each scheduled message or daily fact was sent", ["kind"]
+)
+loop_lag = metrics_registry.gauge("botty_event_loop_lag_seconds", "How late the event loop is running timers")
+metrics_registry.gauge(
+    "botty_time_to_ready_seconds", "Seconds from process start to the first on_ready",
+    lambda: startup_timings.get("ready", float("nan")),
+)
 
-LOGS_DIR = "logs"
 ACTIVITY_LOG = os.path.join(LOGS_DIR, "activity.log")
 ERROR_LOG = os.path.join(LOGS_DIR, "errors.log")
 
+log_writer = JsonlLogWriter(
+    flush_interval=LOG_FLUSH_INTERVAL,
+    batch_size=LOG_BATCH_SIZE,
+    max_bytes=LOG_MAX_BYTES,
+    rotate_interval=LOG_ROTATE_SECONDS,
+    on_flush=lambda seconds, lines: stage_seconds.observe(seconds, "log_write"),
+)
+atexit.register(log_writer.close)
+
 def log_activity(data: dict):
-    """Append a JSON line to the activity log."""
+    """Queue a JSON line for the activity log and count it in the usage stats."""
+    data["timestamp"] = datetime.utcnow().isoformat() + "Z"
+    log_writer.write(ACTIVITY_LOG, data)
+    stats_engine.record(data)
+    stats_store.save()
+
+def log_error(data: dict):
+    """Queue a JSON line for the error log."""
     data["timestamp"] = datetime.utcnow().isoformat() + "Z"
+    log_writer.write(ERROR_LOG, data)
+
 CONFIG_FILE = os.path.join(LOGS_DIR, "bot_config.json")
+DAILYJOKE_FILE = os.path.join(LOGS_DIR, "dailyjoke_channels.json")
+SCHEDULED_MESSAGES_FILE = os.path.join(LOGS_DIR, "scheduled_messages.json")
+STATS_FILE = os.path.join(LOGS_DIR, "stats.json")
+FACTS_FILE = os.path.join(LOGS_DIR, "daily_facts.json")
+FACTS_SEEN_FILE = os.path.join(LOGS_DIR, "daily_facts_seen.json")
 
-def load_bot_config():
-    if not os.path.exists(CONFIG_FILE):
-        return {"model": "gpt-4o", "autoreply": True}
-    try:
-        with open(CONFIG_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception as e:
-        logger.error(f"Failed to load bot config: {e}")
-        return {"model": "gpt-4o", "autoreply": True}
+def decode_scheduled_messages(messages):
+    """Key scheduled messages by id, assigning ids to entries saved without one."""
+    by_id = {}
+    for msg in messages:
+        msg.setdefault("id", uuid.uuid4().hex[:8])
+        by_id[msg["id"]] = msg
+    return by_id
 
-def save_bot_config(config):
-    try:
-        with open(CONFIG_FILE, "w", encoding="utf-8") as f:
-            json.dump(config, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        logger.error(f"Failed to save bot config: {e}")
+def default_config():
+    return {"model": "gpt-4o", "autoreply": True}
 
-bot_config = load_bot_config()
-DAILYJOKE_FILE = os.path.join(LOGS_DIR, "dailyjoke_channels.json")
+if SHARED_STATE_DB:
+    shared_db = SharedStateDB(SHARED_STATE_DB)
+    config_store = SQLiteStateStore(shared_db, "bot_config", default=default_config, debounce=STATE_SAVE_DEBOUNCE)
+    dailyjoke_store = SQLiteStateStore(shared_db, "dailyjoke_channels", default=dict, debounce=STATE_SAVE_DEBOUNCE)
+    scheduled_store = SQLiteStateStore(shared_db, "scheduled_messages", default=dict, debounce=STATE_SAVE_DEBOUNCE)
+    atexit.register(shared_db.close)
+else:
+    shared_db = None
+    config_store = JsonStateStore(CONFIG_FILE, default=default_config, debounce=STATE_SAVE_DEBOUNCE)
+    dailyjoke_store = JsonStateStore(DAILYJOKE_FILE, default=dict, debounce=STATE_SAVE_DEBOUNCE, keyed=True)
+    scheduled_store = JsonStateStore(
+        SCHEDULED_MESSAGES_FILE,
+        default=dict,
+        debounce=STATE_SAVE_DEBOUNCE,
+        encode=lambda messages: list(messages.values()),
+        decode=decode_scheduled_messages,
+        keyed=True,
+    )
+# Stats are snapshotted at most once per interval rather than per event
+stats_store = JsonStateStore(STATS_FILE, default=dict, debounce=STATS_SNAPSHOT_INTERVAL)
+fact_store = JsonStateStore(FACTS_FILE, default=dict, debounce=STATE_SAVE_DEBOUNCE)
+fact_seen_store = JsonStateStore(FACTS_SEEN_FILE, default=dict, debounce=STATE_SAVE_DEBOUNCE, keyed=True)
+state_stores = [config_store, dailyjoke_store, scheduled_store, stats_store, fact_store, fact_seen_store]
+for _store in state_stores:
+    atexit.register(_store.flush)
 
-def load_dailyjoke_channels():
-    if not os.path.exists(DAILYJOKE_FILE):
-        return {}
-    try:
-        with open(DAILYJOKE_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception as e:
-        logger.error(f"Failed to load dailyjoke channels: {e}")
-        return {}
+# State is read in the background once the bot starts (see hydrate_state),
+# so logging in to Discord never waits on disk. Until then these hold
+# defaults, and on_message waits for state_ready before touching them.
+bot_config = default_config()
+dailyjoke_channels = {}
+scheduled_messages = {}
+stats_engine = StatsEngine()
+state_ready = asyncio.Event()
 
-def save_dailyjoke_channels(data):
+async def hydrate_state():
+    """Load every state store in parallel and swap the loaded data in."""
+    global bot_config, dailyjoke_channels, scheduled_messages, stats_engine
     try:
-        with open(DAILYJOKE_FILE, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        with stage_seconds.time("startup_state_load"):
+            await asyncio.gather(*(asyncio.to_thread(store.load) for store in state_stores))
+            await asyncio.to_thread(image_cache.load)
     except Exception as e:
-        logger.error(f"Failed to save dailyjoke channels: {e}")
+        logger.error(f"Failed to load saved state: {e}")
+    try:
+        # Always work on the stores' own data, so saves write what the bot sees
+        for store in state_stores:
+            if store.data is None:
+                store.data = store.default()
+        bot_config, dailyjoke_channels, scheduled_messages = (
+            config_store.data, dailyjoke_store.data, scheduled_store.data
+        )
+        try:
+            stats_engine = StatsEngine(stats_store.data)
+        except Exception as e:
+            # A bad stats file shouldn't take the rest of the state down with it
+            logger.error(f"Failed to load usage stats, starting them afresh: {e}")
+            stats_engine = StatsEngine()
+        stats_store.data = stats_engine.data
+    finally:
+        # on_message waits for this, so it must be set whatever happened
+        state_ready.set()
+    mark_startup("state_loaded")
 
-dailyjoke_channels = load_dailyjoke_channels()
-SCHEDULED_MESSAGES_FILE = os.path.join(LOGS_DIR, "scheduled_messages.json")
+if not DISCORD_TOKEN or not OPENAI_API_KEY:
+    logger.error("Please set DISCORD_TOKEN and OPENAI_API_KEY in your .env file.")
+    exit(1)
 
-def load_scheduled_messages():
-    if not os.path.exists(SCHEDULED_MESSAGES_FILE):
-        return []
-    try:
-        with open(SCHEDULED_MESSAGES_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception as e:
-        logger.error(f"Failed to load scheduled messages: {e}")
-        return []
+openai.api_key = OPENAI_API_KEY
 
-def save_scheduled_messages(messages):
-    try:
-        with open(SCHEDULED_MESSAGES_FILE, "w", encoding="utf-8") as f:
-            json.dump(messages, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        logger.error(f"Failed to save scheduled messages: {e}")
+# Every OpenAI and Discord call goes through the governor's rate limits,
+# retries and circuit breakers
+governor = RateGovernor(
+    attempts=RETRY_ATTEMPTS,
+    breaker_threshold=BREAKER_THRESHOLD,
+    breaker_reset=BREAKER_RESET_SECONDS,
+)
+governor.configure("openai", OPENAI_REQUESTS_PER_MINUTE / 60, model_rate=OPENAI_MODEL_REQUESTS_PER_MINUTE / 60)
+# discord.py already retries 5xx responses itself, and re-sending after a
+# timeout could post a message twice, so only 429s are retried for Discord
+governor.configure(
+    "discord",
+    DISCORD_REQUESTS_PER_SECOND,
+    model_rate=DISCORD_CHANNEL_RATE,
+    model_capacity=DISCORD_CHANNEL_BURST,
+    retry_failures=False,
+)
 
-scheduled_messages = load_scheduled_messages()
+ai_client = OpenAIClient(
+    OPENAI_API_KEY,
+    max_concurrency=OPENAI_MAX_CONCURRENCY,
+    image_concurrency=OPENAI_IMAGE_CONCURRENCY,
+    timeout=OPENAI_TIMEOUT,
+    image_timeout=OPENAI_IMAGE_TIMEOUT,
+    governor=governor,
+)
 
-@tasks.loop(minutes=1)
-async def scheduled_message_task():
-    now = datetime.utcnow()
-    to_send = []
-    to_keep = []
-    for msg in scheduled_messages:
-        send_time = datetime.fromisoformat(msg["send_time"])
-        if send_time <= now:
-            to_send.append(msg)
-            # If recurring, reschedule for next day
-            if msg.get("recurring") == "daily":
-                next_time = send_time + timedelta(days=1)
-                msg["send_time"] = next_time.isoformat()
-                to_keep.append(msg)
-        else:
-            to_keep.append(msg)
-    # Save updated schedule
-    if to_send or len(to_keep) != len(scheduled_messages):
-        save_scheduled_messages(to_keep)
-        scheduled_messages.clear()
-        scheduled_messages.extend(to_keep)
-# Handle dailyjoke
-    import random
-    from datetime import timedelta
-
-    def random_joke_time(now_utc):
-        # UK time: UTC+1 in summer, UTC in winter (simplified: always use UTC+1 for now)
-        base_date = now_utc.date()
-        hour = random.randint(9, 16)  # 9am to 4pm start
-        minute = random.randint(0, 59)
-        send_time = datetime(
-            year=base_date.year, month=base_date.month, day=base_date.day,
-            hour=hour-1, minute=minute  # UTC+1 for UK time
-        )
-        if send_time <= now_utc:
-            send_time += timedelta(days=1)
-        return send_time
+# Per-user quotas and channel/user round-robin ordering in front of OpenAI;
+# admin overrides live in bot_config["quotas"]
+fair_share = FairShareScheduler(
+    slots={"chat": OPENAI_MAX_CONCURRENCY, "image": OPENAI_IMAGE_CONCURRENCY},
+    defaults={
+        "chat": (CHAT_QUOTA, CHAT_CHANNEL_QUOTA, CHAT_QUOTA_WINDOW),
+        "image": (IMAGE_QUOTA, IMAGE_CHANNEL_QUOTA, IMAGE_QUOTA_WINDOW),
+    },
+    overrides=lambda: bot_config.get("quotas", {}),
+)
 
-    for channel_id, info in dailyjoke_channels.items():
-        if not info.get("enabled"):
-            continue
-        next_time = info.get("next_time")
-        if not next_time:
-            # Schedule for today
-            info["next_time"] = random_joke_time(now).isoformat()
-            continue
-        try:
-            joke_time = datetime.fromisoformat(next_time)
-        except Exception:
-            joke_time = random_joke_time(now)
-            info["next_time"] = joke_time.isoformat()
-        if joke_time <= now:
-            # Generate a random fact in a jokey way
-            facts = [
-                "Did you know honey never spoils? Unlike my patience for slow Wi-Fi.",
-                "Bananas are berries, but strawberries aren't. The world is a lie.",
-                "Octopuses have three hearts. That's two more than my ex gave me.",
-                "A group of flamingos is called a 'flamboyance.' Just like my Saturday nights.",
-                "Wombat poop is cube-shaped. Nature's way of keeping things... square.",
-                "The unicorn is Scotland’s national animal. Because why not?",
-                "Mosquitoes are attracted to people who just ate bananas. So, snack wisely.",
-                "Cows have best friends and get stressed when separated. Moo-ving, isn’t it?",
-                "A snail can sleep for three years. Same, after a big lunch.",
-                "The inventor of the frisbee was turned into a frisbee after he died. Talk about flying off the handle."
-            ]
-            fact = random.choice(facts)
-            channel = bot.get_channel(int(channel_id))
-            if channel:
-                try:
-                    await channel.send(f"🤓 Daily Fact: {fact}")
-                    log_activity({
-                        "event": "dailyjoke_sent",
-                        "channel_id": channel_id,
-                        "content": fact
-                    })
-                except Exception as e:
-                    logger.error(f"Failed to send dailyjoke: {e}")
-                    log_error({
-                        "event": "dailyjoke_error",
-                        "error": str(e),
-                        "channel_id": channel_id,
-                        "content": fact
-                    })
-            # Schedule next joke
-            next_joke = random_joke_time(now + timedelta(days=1))
-            info["next_time"] = next_joke.isoformat()
-    save_dailyjoke_channels(dailyjoke_channels)
-from discord.ext.commands import has_permissions, CheckFailure
+# Images are generated in background jobs, at most OPENAI_IMAGE_CONCURRENCY
+# at a time in fair-share order, and kept on disk so repeats are free
+image_cache = ImageCache(
+    os.path.join(LOGS_DIR, "image_cache"), int(IMAGE_CACHE_MAX_MB * 1024 * 1024), debounce=STATE_SAVE_DEBOUNCE
+)
+atexit.register(image_cache.flush)
 
-@bot.group(name="admin", invoke_without_command=True, help="Admin commands. Use !admin <subcommand>")
-@has_permissions(administrator=True)
-async def admin_group(ctx):
-    await ctx.send("Available admin commands: clearhistory, setmodel, listmodels, autoreply")
+async def generate_image_job(job):
+    with stage_seconds.time("image_generation"):
+        return await ai_client.generate_image_data(job.prompt, model=job.model, size=job.size)
 
-@admin_group.command(name="clearhistory", help="Clear chat history for this channel")
-async def clearhistory(ctx):
-    channel_id = ctx.channel.id
-    if hasattr(history_manager, "histories") and channel_id in history_manager.histories:
-        history_manager.histories[channel_id].clear()
-        await ctx.send("Chat history cleared for this channel.")
+image_jobs = ImageJobQueue(
+    image_cache,
+    generate_image_job,
+    slot=lambda job: fair_share.slot("image", job.user_id, job.channel_id),
+    max_pending=IMAGE_MAX_PENDING,
+)
+# Tasks posting finished images back to Discord
+image_deliveries = set()
+
+# --- Discord Bot Setup ---
+
+intents = discord.Intents.default()
+intents.message_content = True
+
+class Botty(commands.AutoShardedBot):
+    async def setup_hook(self):
+        mark_startup("setup_hook")
+        self.background_tasks = [
+            asyncio.create_task(monitor_loop_lag(loop_lag)),
+            asyncio.create_task(start_state_and_scheduler()),
+        ]
+        if shared_db is not None:
+            self.background_tasks.append(asyncio.create_task(refresh_shared_state()))
+        self.metrics_server = None
+        if METRICS_PORT:
+            try:
+                self.metrics_server = await serve_metrics(metrics_registry, METRICS_HOST, METRICS_PORT)
+            except OSError as e:
+                logger.error(f"Failed to start metrics endpoint on {METRICS_HOST}:{METRICS_PORT}: {e}")
+
+    async def close(self):
+        for task in getattr(self, "background_tasks", []):
+            task.cancel()
+        if getattr(self, "metrics_server", None) is not None:
+            self.metrics_server.close()
+        history_manager.cancel_summaries()
+        image_jobs.cancel()
+        await fact_pool.close()
+        await ai_client.close()
+        await super().close()
+        if history_manager.store is not None:
+            history_manager.store.close()
+        for store in state_stores:
+            store.flush()
+        image_cache.flush()
+        if shared_db is not None:
+            shared_db.close()
+        log_writer.close()
+
+bot = Botty(
+    command_prefix="!",
+    intents=intents,
+    help_command=None,
+    shard_count=SHARD_COUNT or None,
+    shard_ids=SHARD_IDS or None,
+)
+
+# --- Message History Management ---
+
+SUMMARY_PROMPT = (
+    "You keep a running summary of a Discord conversation. Merge the previous summary (if any) "
+    "and the new messages into one concise summary of at most 150 words. Keep names, facts, "
+    "decisions, preferences and open questions; leave out greetings and small talk."
+)
+summary_slots = asyncio.Semaphore(HISTORY_SUMMARY_CONCURRENCY)
+
+async def summarize_history(previous: Optional[str], messages: List[dict]) -> str:
+    """Condense older chat turns (and the previous summary) for ChannelHistory."""
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+    if previous:
+        transcript = f"Previous summary: {previous}\n\nNew messages:\n{transcript}"
+    # Few at a time and low priority, so summaries never crowd out replies
+    async with summary_slots:
+        with stage_seconds.time("summarize"):
+            return await ai_client.chat(
+                model=HISTORY_SUMMARY_MODEL,
+                messages=[
+                    {"role": "system", "content": SUMMARY_PROMPT},
+                    {"role": "user", "content": transcript},
+                ],
+                max_tokens=300,
+                temperature=0.2,
+                priority=LOW,
+            )
+
+history_manager = ChannelHistory(
+    MAX_HISTORY,
+    token_budget=HISTORY_TOKEN_BUDGET,
+    reply_tokens=REPLY_MAX_TOKENS,
+    max_bytes=HISTORY_MAX_BYTES,
+    max_channels=HISTORY_MAX_CHANNELS,
+    store=SQLiteHistoryStore(HISTORY_DB, keep=MAX_HISTORY) if HISTORY_DB else None,
+    summarizer=summarize_history,
+    summarize_after=HISTORY_SUMMARY_AFTER,
+    keep_recent=HISTORY_SUMMARY_KEEP,
+)
+
+# --- Response Cache ---
+
+response_cache = ResponseCache(max_entries=RESPONSE_CACHE_SIZE, context_messages=RESPONSE_CACHE_CONTEXT)
+
+def cache_ttl_for(channel_id: int) -> float:
+    """Seconds a reply in this channel may be reused for; 0 when caching is off there."""
+    return bot_config.get("cache_channels", {}).get(str(channel_id), 0)
+
+# --- Bot Events ---
+
+@bot.event
+async def on_ready():
+    logger.info(f"Logged in as {bot.user} (ID: {bot.user.id})")
+    if "ready" not in startup_timings:
+        mark_startup("ready")
+        if startup_timings["ready"] > STARTUP_TARGET_SECONDS:
+            logger.warning(
+                f"Time to ready {startup_timings['ready']:.1f}s is over the {STARTUP_TARGET_SECONDS:g}s target "
+                f"({', '.join(f'{phase} {t:.2f}s' for phase, t in startup_timings.items())})"
+            )
+
+@bot.event
+async def on_message(message: discord.Message):
+    # Ignore messages from bots (including itself)
+    if message.author.bot:
+        return
+    await state_ready.wait()
+
+    # Commands are handled by their own handlers and never auto-replied to
+    ctx = await bot.get_context(message)
+    if ctx.valid:
+        await bot.invoke(ctx)
+        return
+
+    channel_id = message.channel.id
+    user_message = message.content.strip()
+    if not user_message:
+        return
+
+    # Only auto-reply if enabled in config
+    if not bot_config.get("autoreply", True):
+        return
+
+    # Over-quota messages are dropped before they reach the reply queue
+    try:
+        fair_share.admit("chat", str(message.author.id), str(channel_id))
+    except QuotaExceeded as e:
         log_activity({
-            "event": "admin_clearhistory",
+            "event": "quota_exceeded",
+            "kind": "chat",
+            "user_id": str(message.author.id),
+            "username": str(message.author),
             "channel_id": str(channel_id),
-            "user_id": str(ctx.author.id),
-            "username": str(ctx.author)
+            "channel_name": str(message.channel),
+            "reason": str(e)
         })
-    else:
-        await ctx.send("No history found for this channel.")
+        return
 
-@admin_group.command(name="setmodel", help="Set the OpenAI model used for chat (e.g., gpt-4o, gpt-3.5-turbo)")
-async def setmodel(ctx, model: str):
-    bot_config["model"] = model
-    save_bot_config(bot_config)
-    await ctx.send(f"OpenAI model set to: {model}")
+    # Log user message activity
     log_activity({
-        "event": "admin_setmodel",
-        "model": model,
-        "user_id": str(ctx.author.id),
-        "username": str(ctx.author)
+        "event": "user_message",
+        "user_id": str(message.author.id),
+        "username": str(message.author),
+        "channel_id": str(message.channel.id),
+        "channel_name": str(message.channel),
+        "content": user_message[:200]  # Truncate for log
     })
 
-@admin_group.command(name="listmodels", help="List available OpenAI models")
-async def listmodels(ctx):
+    # Replies are produced one at a time per channel; a burst is answered once
+    messages_total.inc()
+    reply_queue.submit(channel_id, message)
+
+async def reply_to_messages(channel_id: int, messages: List[discord.Message]):
+    """Add a batch of user messages to history and answer them with one completion."""
+    with stage_seconds.time("reply_total"):
+        await _reply_to_messages(channel_id, messages)
+
+async def _reply_to_messages(channel_id: int, messages: List[discord.Message]):
+    message = messages[-1]
+    user_message = message.content.strip()
+
+    # Add user messages to history
+    with stage_seconds.time("history_load"):
+        await history_manager.load(channel_id)
+    for m in messages:
+        history_manager.append(channel_id, {"role": "user", "content": m.content.strip()})
+
+    # Call OpenAI API, streaming the reply into the channel if enabled
+    streamed = None
+    cached = None
     try:
-        models = openai.models.list()
-        model_names = [m.id for m in models.data]
-        await ctx.send("Available OpenAI models:\n" + "\n".join(model_names))
+        model = bot_config.get("model", "gpt-4o")
+        window = history_manager.as_list(channel_id, model)
+        cache_ttl = cache_ttl_for(channel_id)
+        cache_key = response_cache.key(str(channel_id), model, window) if cache_ttl else None
+        cached = response_cache.get(cache_key) if cache_key else None
+        if cached is not None:
+            reply = cached
+        else:
+            # Busy users take turns with everyone else for OpenAI slots
+            queued = time.monotonic()
+            async with fair_share.slot("chat", str(message.author.id), str(channel_id)):
+                started = time.monotonic()
+                stage_seconds.observe(started - queued, "fair_queue")
+                if bot_config.get("stream", True):
+                    streamed = StreamingReply(message.channel, edit_interval=STREAM_EDIT_INTERVAL)
+                    reply = await streamed.stream(ai_client.stream_chat(
+                        model=model,
+                        messages=window,
+                        max_tokens=REPLY_MAX_TOKENS,
+                        temperature=0.7,
+                        priority=LOW,
+                    ))
+                else:
+                    reply = await ai_client.chat(
+                        model=model,
+                        messages=window,
+                        max_tokens=REPLY_MAX_TOKENS,
+                        temperature=0.7,
+                        priority=LOW,
+                    )
+        if cached is None:
+            stage_seconds.observe(time.monotonic() - started, "openai")
+            if streamed is not None and streamed.time_to_first_token is not None:
+                stage_seconds.observe(streamed.time_to_first_token, "first_token")
+        replies_total.inc("cache" if cached is not None else "openai")
+        if not reply:
+            reply = "Hmm, I seem to have lost my train of thought. Try again?"
+        elif cache_key and cached is None:
+            response_cache.record_latency(time.monotonic() - started)
+            response_cache.put(cache_key, reply, cache_ttl)
+        # Add assistant reply to history
+        history_manager.append(channel_id, {"role": "assistant", "content": reply})
+    except LoadShedError as e:
+        # Auto-replies are the first thing dropped when OpenAI is struggling
+        logger.warning(f"Skipping reply in channel {channel_id}: {e}")
+        replies_total.inc("shed")
+        log_activity({
+            "event": "reply_shed",
+            "channel_id": str(message.channel.id),
+            "channel_name": str(message.channel),
+            "reason": str(e),
+            "batch_size": len(messages)
+        })
+        if streamed is not None and streamed.messages:
+            try:
+                await streamed.messages[0].delete()
+            except discord.DiscordException:
+                pass
+        return
     except Exception as e:
-        await ctx.send("Failed to fetch models from OpenAI.")
+        logger.error(f"OpenAI API error: {e}")
+        api_errors_total.inc("openai")
+        replies_total.inc("error")
         log_error({
-            "event": "admin_listmodels_error",
+            "event": "openai_api_error",
             "error": str(e),
-            "user_id": str(ctx.author.id),
-            "username": str(ctx.author)
+            "user_id": str(message.author.id),
+            "username": str(message.author),
+            "channel_id": str(message.channel.id),
+            "channel_name": str(message.channel),
+            "user_message": user_message[:200]
         })
+        reply = "Sorry, I couldn't reach my brain (OpenAI API error). Try again later!"
 
-@admin_group.command(name="autoreply", help="Turn auto-reply to all messages on or off")
-async def autoreply(ctx, mode: str):
-    mode = mode.lower()
-    if mode == "on":
-        bot_config["autoreply"] = True
-        save_bot_config(bot_config)
-        await ctx.send("Auto-reply to all messages is now ON.")
-    elif mode == "off":
-        bot_config["autoreply"] = False
-        save_bot_config(bot_config)
-        await ctx.send("Auto-reply to all messages is now OFF.")
-    else:
-        await ctx.send("Usage: !admin autoreply on|off")
+    # Log bot response activity
     log_activity({
-        "event": "admin_autoreply",
-        "mode": mode,
-        "user_id": str(ctx.author.id),
-        "username": str(ctx.author)
+        "event": "bot_response",
+        "channel_id": str(message.channel.id),
+        "channel_name": str(message.channel),
+        "reply": reply[:200],  # Truncate for log
+        "batch_size": len(messages),
+        "cached": cached is not None
     })
 
-@admin_group.error
-async def admin_group_error(ctx, error):
-    if isinstance(error, CheckFailure):
-        await ctx.send("You must be an administrator to use admin commands.")
-    # Send messages
-    for msg in to_send:
-        channel = bot.get_channel(int(msg["channel_id"]))
-        if channel:
-            try:
-                await channel.send(msg["content"])
-                log_activity({
-                    "event": "scheduled_message_sent",
-                    "channel_id": msg["channel_id"],
-                    "content": msg["content"],
-                    "recurring": msg.get("recurring", "none")
-                })
-            except Exception as e:
-                logger.error(f"Failed to send scheduled message: {e}")
-                log_error({
-                    "event": "scheduled_message_error",
-                    "error": str(e),
-                    "channel_id": msg["channel_id"],
-                    "content": msg["content"]
-                })
+    # Send reply
     try:
-        with open(ACTIVITY_LOG, "a", encoding="utf-8") as f:
-            f.write(json.dumps(data, ensure_ascii=False) + "\n")
-    except Exception as e:
-        logger.error(f"Failed to write to activity log: {e}")
+        with stage_seconds.time("discord_send"):
+            if streamed is not None:
+                await governor.run("discord", lambda: streamed.finish(reply))
+            else:
+                for chunk in split_message(reply):
+                    await governor.run("discord", lambda: message.channel.send(chunk))
+    except discord.DiscordException as e:
+        logger.error(f"Failed to send message: {e}")
+        api_errors_total.inc("discord")
+        log_error({
+            "event": "discord_send_error",
+            "error": str(e),
+            "channel_id": str(message.channel.id),
+            "channel_name": str(message.channel),
+            "reply": reply[:200]
+        })
 
-def log_error(data: dict):
-    """Append a JSON line to the error log."""
-    data["timestamp"] = datetime.utcnow().isoformat() + "Z"
+reply_queue = ChannelWorkQueue(
+    reply_to_messages,
+    debounce=REPLY_DEBOUNCE_SECONDS,
+    max_batch=REPLY_MAX_BATCH,
+)
+
+metrics_registry.gauge("botty_reply_queue_depth", "Messages waiting for a reply", reply_queue.depth)
+metrics_registry.gauge("botty_reply_workers", "Channels with a reply in progress", reply_queue.active_channels)
+metrics_registry.gauge("botty_history_channels", "Channels held in ChannelHistory", lambda: len(history_manager.histories))
+metrics_registry.gauge("botty_history_bytes", "Estimated bytes held in ChannelHistory", lambda: history_manager.total_bytes)
+metrics_registry.gauge("botty_response_cache_hits", "Replies served from the response cache", lambda: response_cache.hits)
+metrics_registry.gauge("botty_response_cache_misses", "Response cache lookups that missed", lambda: response_cache.misses)
+metrics_registry.gauge("botty_api_retries", "API calls retried after a transient failure", lambda: governor.retries)
+metrics_registry.gauge("botty_api_shed", "Low-priority API calls shed while overloaded", lambda: governor.shed)
+
+DAILY_FACTS = [
+    "Did you know honey never spoils? Unlike my patience for slow Wi-Fi.",
+    "Bananas are berries, but strawberries aren't. The world is a lie.",
+    "Octopuses have three hearts. That's two more than my ex gave me.",
+    "A group of flamingos is called a 'flamboyance.' Just like my Saturday nights.",
+    "Wombat poop is cube-shaped. Nature's way of keeping things... square.",
+    "The unicorn is Scotland’s national animal. Because why not?",
+    "Mosquitoes are attracted to people who just ate bananas. So, snack wisely.",
+    "Cows have best friends and get stressed when separated. Moo-ving, isn’t it?",
+    "A snail can sleep for three years. Same, after a big lunch.",
+    "The inventor of the frisbee was turned into a frisbee after he died. Talk about flying off the handle."
+]
+
+FACT_PROMPT = (
+    "You write the bot's daily fact: a short, surprising and true fact followed by a light-hearted "
+    "one-liner. Write {n} of them, one per line, with no numbering. Vary the topics. For example:\n"
+    + "\n".join(DAILY_FACTS[:3])
+)
+
+async def generate_facts(n: int) -> str:
+    """One batch of new facts for the fact pool, at low priority."""
+    with stage_seconds.time("fact_refill"):
+        return await ai_client.chat(
+            model=FACT_MODEL,
+            messages=[
+                {"role": "system", "content": FACT_PROMPT.format(n=n)},
+                {"role": "user", "content": f"Write {n} new daily facts."},
+            ],
+            max_tokens=n * 60,
+            temperature=1.0,
+            priority=LOW,
+        )
+
+# Every channel draws from one pool, refilled in batches as it runs low;
+# DAILY_FACTS is only the seed
+fact_pool = FactPool(
+    fact_store,
+    fact_seen_store,
+    generate_facts,
+    seed=DAILY_FACTS,
+    batch_size=FACT_POOL_BATCH,
+    low_water=FACT_POOL_LOW_WATER,
+    max_size=FACT_POOL_MAX,
+    remember=FACT_POOL_REMEMBER,
+)
+
+def random_joke_time(now_utc, tz_name: str = DAILYJOKE_TIMEZONE):
+    """
+    A random time between 9am and 5pm local time in `tz_name` on the local
+    date of `now_utc`, or the next day if that has passed. Naive UTC in and out.
+    """
+    tz = timezone_for(tz_name)
+    local_date = now_utc.replace(tzinfo=timezone.utc).astimezone(tz).date()
+    for day in (local_date, local_date + timedelta(days=1)):
+        send_time = joke_time_on(day, tz)
+        if send_time > now_utc:
+            break
+    return send_time
+
+def next_joke_time(due_utc, now_utc, tz_name: str = DAILYJOKE_TIMEZONE):
+    """
+    The daily joke after the one due at `due_utc`: a random time between 9am
+    and 5pm on the next local day in `tz_name`, counting from today if that
+    one was sent late, so every day gets exactly one. Naive UTC in and out.
+    """
+    tz = timezone_for(tz_name)
+    fired = max(due_utc, now_utc).replace(tzinfo=timezone.utc).astimezone(tz).date()
+    return joke_time_on(fired + timedelta(days=1), tz)
+
+def joke_time_on(day, tz):
+    """A random time between 9am and 5pm on local date `day` in `tz`, as naive UTC."""
+    local = datetime(day.year, day.month, day.day, random.randint(9, 16), random.randint(0, 59), tzinfo=tz)
+    return local.astimezone(timezone.utc).replace(tzinfo=None)
+
+def recurrence_for(msg: dict):
+    """The CronSchedule a scheduled message repeats on, or None for a one-off."""
+    if msg.get("cron"):
+        return compile_schedule(msg["cron"], msg.get("tz") or "UTC")
+    if msg.get("recurring") == "daily":
+        # Saved before cron support: daily at the same UTC time
+        first = datetime.fromisoformat(msg["send_time"])
+        return compile_schedule(f"{first.minute} {first.hour} * * *", "UTC")
+    return None
+
+# Scheduled messages are keyed "msg:<id>", daily jokes "joke:<channel id>"
+scheduler = Scheduler()
+
+def schedule_message_job(msg: dict) -> None:
+    scheduler.schedule(f"msg:{msg['id']}", datetime.fromisoformat(msg["send_time"]))
+
+def schedule_dailyjoke_job(channel_id: str, info: dict) -> bool:
+    """Queue a channel's next daily joke. Returns True if next_time had to be (re)computed."""
+    changed = False
     try:
-        with open(ERROR_LOG, "a", encoding="utf-8") as f:
-            f.write(json.dumps(data, ensure_ascii=False) + "\n")
-    except Exception as e:
-        logger.error(f"Failed to write to error log: {e}")
-if not DISCORD_TOKEN or not OPENAI_API_KEY:
-    logger.error("Please set DISCORD_TOKEN and OPENAI_API_KEY in your .env file.")
-    exit(1)
+        joke_time = datetime.fromisoformat(info["next_time"])
+    except Exception:
+        joke_time = random_joke_time(datetime.utcnow(), info.get("tz") or DAILYJOKE_TIMEZONE)
+        info["next_time"] = joke_time.isoformat()
+        changed = True
+    scheduler.schedule(f"joke:{channel_id}", joke_time)
+    return changed
 
-openai.api_key = OPENAI_API_KEY
+def sync_scheduled_job(msg_id: str) -> None:
+    """Bring the scheduler in line with scheduled_messages after another process changed it."""
+    msg = scheduled_messages.get(msg_id)
+    if msg is None:
+        scheduler.cancel(f"msg:{msg_id}")
+    else:
+        schedule_message_job(msg)
 
-# --- Discord Bot Setup ---
+def sync_dailyjoke_job(channel_id: str) -> None:
+    info = dailyjoke_channels.get(channel_id)
+    if info and info.get("enabled"):
+        schedule_dailyjoke_job(channel_id, info)
+    else:
+        scheduler.cancel(f"joke:{channel_id}")
 
-intents = discord.Intents.default()
-intents.message_content = True
+async def send_scheduled_message(msg_id: str):
+    msg = scheduled_messages.get(msg_id)
+    if msg is None:
+        return
+    channel = bot.get_channel(int(msg["channel_id"]))
+    if channel is None and SHARD_COUNT:
+        # The channel belongs to a shard run by another process, which fires it
+        return
+    # If recurring, move on to the first occurrence after now, however long
+    # we were down. Claiming the change means only one process sends each
+    # occurrence.
+    due = datetime.fromisoformat(msg["send_time"])
+    now = datetime.utcnow()
+    send, next_time = advance(
+        recurrence_for(msg), due, now, msg.get("catchup", SCHEDULE_CATCHUP), SCHEDULE_CATCHUP_GRACE
+    )
+    next_msg = dict(msg, send_time=next_time.isoformat()) if next_time is not None else None
+    if not await scheduled_store.claim(msg_id, next_msg):
+        sync_scheduled_job(msg_id)
+        return
+    if next_msg is not None:
+        schedule_message_job(next_msg)
+    if not send:
+        log_activity({
+            "event": "scheduled_message_skipped",
+            "channel_id": msg["channel_id"],
+            "schedule_id": msg_id,
+            "due": msg["send_time"],
+            "late_seconds": round((now - due).total_seconds())
+        })
+        return
+    if channel:
+        try:
+            await deliver("scheduled", channel, msg["content"], msg["send_time"])
+            log_activity({
+                "event": "scheduled_message_sent",
+                "channel_id": msg["channel_id"],
+                "content": msg["content"],
+                "recurring": msg.get("recurring", "none")
+            })
+        except Exception as e:
+            logger.error(f"Failed to send scheduled message: {e}")
+            api_errors_total.inc("discord")
+            log_error({
+                "event": "scheduled_message_error",
+                "error": str(e),
+                "channel_id": msg["channel_id"],
+                "content": msg["content"]
+            })
 
-bot = commands.Bot(command_prefix="!", intents=intents, help_command=None)
+async def send_dailyjoke(channel_id: str):
+    info = dailyjoke_channels.get(channel_id)
+    if not info or not info.get("enabled"):
+        return
+    channel = bot.get_channel(int(channel_id))
+    if channel is None and SHARD_COUNT:
+        return
+    # Schedule next joke, claiming today's so only one process sends it
+    next_time = next_joke_time(
+        datetime.fromisoformat(info["next_time"]), datetime.utcnow(), info.get("tz") or DAILYJOKE_TIMEZONE
+    )
+    next_info = dict(info, next_time=next_time.isoformat())
+    if not await dailyjoke_store.claim(channel_id, next_info):
+        sync_dailyjoke_job(channel_id)
+        return
+    schedule_dailyjoke_job(channel_id, next_info)
+    if channel:
+        fact = fact_pool.pick(channel_id)
+        try:
+            await deliver("dailyjoke", channel, f"🤓 Daily Fact: {fact}", info["next_time"])
+            log_activity({
+                "event": "dailyjoke_sent",
+                "channel_id": channel_id,
+                "content": fact
+            })
+        except Exception as e:
+            logger.error(f"Failed to send dailyjoke: {e}")
+            api_errors_total.inc("discord")
+            log_error({
+                "event": "dailyjoke_error",
+                "error": str(e),
+                "channel_id": channel_id,
+                "content": fact
+            })
 
-# --- Message History Management ---
+async def deliver(kind: str, channel, content: str, due: str):
+    """
+    Send one scheduled message. Sends for different channels run side by
+    side (see DELIVERY_CONCURRENCY), each limited to its channel's rate;
+    the governor retries 429s with backoff.
+    """
+    with stage_seconds.time(f"deliver_{kind}"):
+        await governor.run("discord", lambda: channel.send(content), model=f"channel:{channel.id}")
+    lateness = (datetime.utcnow() - datetime.fromisoformat(due)).total_seconds()
+    delivery_lateness.observe(max(0.0, lateness), kind)
+
+async def fire_scheduled_job(key: str):
+    kind, _, ident = key.partition(":")
+    with stage_seconds.time("scheduler_job"):
+        if kind == "msg":
+            await send_scheduled_message(ident)
+        elif kind == "joke":
+            await send_dailyjoke(ident)
 
-class ChannelHistory:
+async def refresh_shared_state():
+    """Pick up config and schedule changes made by the other shard processes."""
+    await state_ready.wait()
+    while True:
+        await asyncio.sleep(SHARED_STATE_REFRESH)
+        try:
+            await config_store.refresh()
+            for msg_id in await scheduled_store.refresh():
+                sync_scheduled_job(msg_id)
+            for channel_id in await dailyjoke_store.refresh():
+                sync_dailyjoke_job(channel_id)
+        except Exception as e:
+            logger.error(f"Failed to refresh shared state: {e}")
+
+async def start_state_and_scheduler():
+    await hydrate_state()
+    await scheduled_message_task()
+
+async def scheduled_message_task():
     """
-    Maintains a fixed-length message history per channel.
+    Load every schedule into the scheduler and, once the bot is ready and can
+    see its channels, fire jobs as they fall due.
     """
-    def __init__(self, maxlen: int):
-        self.histories: Dict[int, deque] = defaultdict(
-            lambda: deque(maxlen=maxlen + 1)  # +1 for system prompt
-        )
-        self.system_prompt = {
-            "role": "system",
-            "content": (
-                "Prompt for Botty (Discord Bot):\n\n"
-                "You are Botty, a helpful and witty Discord bot. Your main role is to assist users with their questions and commands, "
-                "but you never miss a chance to crack a joke or respond with dry, sarcastic humour. You're clever, quick-witted, and always "
-                "stay just on the right side of cheeky. While you're always willing to help, your responses should carry a light, humorous tone — "
-                "think helpful assistant meets stand-up comedian.\n\n"
-                "Guidelines for your responses:\n"
-                "- Always provide useful and accurate information.\n"
-                "- Where appropriate, add a sarcastic remark, clever joke, or playful tease.\n"
-                "- Never be offensive, rude, or insulting — keep it friendly and fun.\n"
-                "- Tailor your humour to be suitable for a general audience (PG-rated).\n"
-                "- If a user is upset or frustrated, dial down the sarcasm and be more supportive — but still with your signature personality.\n\n"
-                "Example:\n"
-                "User: \"Botty, how do I reset my password?\"\n"
-                "Botty: \"Ah yes, the age-old struggle — forgetting your own password. Classic. No worries though, just head to your settings and click 'Reset Password'. Try not to forget it again this time.\""
-            )
-        }
+    for msg in scheduled_messages.values():
+        schedule_message_job(msg)
+    for channel_id, info in dailyjoke_channels.items():
+        if info.get("enabled") and schedule_dailyjoke_job(channel_id, info):
+            dailyjoke_store.save(channel_id)
+    mark_startup("jobs_scheduled")
+    await bot.wait_until_ready()
+    await scheduler.run(fire_scheduled_job, concurrency=DELIVERY_CONCURRENCY)
 
-    def get(self, channel_id: int) -> deque:
-        history = self.histories[channel_id]
-        if not history or history[0] != self.system_prompt:
-            history.clear()
-            history.append(self.system_prompt)
-        return history
-
-    def append(self, channel_id: int, message: dict) -> None:
-        history = self.get(channel_id)
-@bot.command(name="dailyjoke", help="Turn daily random fact joke on or off for this channel. Usage: !dailyjoke on|off")
-async def dailyjoke_command(ctx, mode: str):
+@bot.command(name="dailyjoke", help="Turn daily random fact joke on or off for this channel. Usage: !dailyjoke on [time zone]|off")
+async def dailyjoke_command(ctx, mode: str, tz_name: str = DAILYJOKE_TIMEZONE):
     """
     Enable or disable daily random fact jokes in this channel.
-    When enabled, a random fact in a jokey way will be sent at a random time between 9am–5pm UK time each day.
+    When enabled, a random fact in a jokey way will be sent at a random time
+    between 9am–5pm each day, in DAILYJOKE_TIMEZONE (UK time) or the given time zone.
     """
-    import random
-    from datetime import timedelta, time as dtime
-
     channel_id = str(ctx.channel.id)
     mode = mode.lower()
-    now_utc = datetime.utcnow()
-
-    def next_joke_time():
-        # UK time: UTC+1 in summer, UTC in winter (simplified: always use UTC+1 for now)
-        base_date = now_utc.date()
-        hour = random.randint(9, 16)  # 9am to 4pm start
-        minute = random.randint(0, 59)
-        send_time = datetime(
-            year=base_date.year, month=base_date.month, day=base_date.day,
-            hour=hour-1, minute=minute  # UTC+1 for UK time
-        )
-        if send_time <= now_utc:
-            send_time += timedelta(days=1)
-        return send_time.isoformat()
 
     if mode == "on":
+        if not is_timezone(tz_name):
+            await ctx.send(f"Unknown time zone `{tz_name}`; use an IANA name like Europe/London or America/New_York.")
+            return
         dailyjoke_channels[channel_id] = {
             "enabled": True,
-            "next_time": next_joke_time()
+            "next_time": random_joke_time(datetime.utcnow(), tz_name).isoformat(),
+            "tz": tz_name
         }
-        save_dailyjoke_channels(dailyjoke_channels)
-        await ctx.send("Daily joke is now ON for this channel. You'll get a random fact in a jokey way each day between 9am–5pm UK time.")
+        schedule_dailyjoke_job(channel_id, dailyjoke_channels[channel_id])
+        dailyjoke_store.save(channel_id)
+        await ctx.send(f"Daily joke is now ON for this channel. You'll get a random fact in a jokey way each day between 9am–5pm {tz_name} time.")
         log_activity({
             "event": "dailyjoke_enabled",
             "channel_id": channel_id,
@@ -384,7 +897,8 @@ async def dailyjoke_command(ctx, mode: str):
     elif mode == "off":
         if channel_id in dailyjoke_channels:
             dailyjoke_channels[channel_id]["enabled"] = False
-            save_dailyjoke_channels(dailyjoke_channels)
+            scheduler.cancel(f"joke:{channel_id}")
+            dailyjoke_store.save(channel_id)
         await ctx.send("Daily joke is now OFF for this channel.")
         log_activity({
             "event": "dailyjoke_disabled",
@@ -395,67 +909,80 @@ async def dailyjoke_command(ctx, mode: str):
         })
     else:
         await ctx.send("Usage: !dailyjoke on|off")
-        history.append(message)
-
-    def as_list(self, channel_id: int) -> List[dict]:
-        return list(self.get(channel_id))
 
-history_manager = ChannelHistory(MAX_HISTORY)
+def local_time_text(when_utc: datetime, tz_name: str) -> str:
+    return when_utc.replace(tzinfo=timezone.utc).astimezone(timezone_for(tz_name)).strftime("%a %d %b %H:%M %Z")
 
-# --- Bot Events ---
-
-@bot.event
-async def on_ready():
-    logger.info(f"Logged in as {bot.user} (ID: {bot.user.id})")
-if not scheduled_message_task.is_running():
-        scheduled_message_task.start()
-
-@bot.event
-async def on_message(message: discord.Message):
-    # Ignore messages from bots (including itself)
-    if message.author.bot:
-        return
-@bot.command(name="schedule", help="Schedule a message. Usage: !schedule 09:00 Hello world! [daily]")
-async def schedule_command(ctx, time: str, *, message_and_recur: str):
+@bot.command(
+    name="schedule",
+    help=(
+        "Schedule a message. Usage: !schedule 09:00 [Europe/London] Hello world! [daily] [catchup=skip|once] "
+        "or !schedule \"0 9 * * mon-fri\" [Europe/London] Stand-up time!"
+    ),
+)
+async def schedule_command(ctx, when: str, *, message_and_recur: str):
     """
-    Schedule a message to be sent at a specific time (UTC, 24h format).
-    Optionally add 'daily' at the end for recurring messages.
-    Example: !schedule 09:00 Hello everyone! daily
+    Schedule a message for a time of day (HH:MM, 24h), optionally repeating
+    daily, or on a cron expression (in quotes, or an @daily style macro).
+    Times are in SCHEDULE_TIMEZONE (UTC by default) unless an IANA time zone
+    comes first in the message. `catchup=skip` at the end drops occurrences
+    missed while the bot was down instead of sending one late.
+    Example: !schedule 09:00 Europe/London Hello everyone! daily
     """
-    from datetime import timedelta
-
     user = ctx.author
     channel = ctx.channel
 
-    # Parse recurrence
-    parts = message_and_recur.rsplit(" ", 1)
-    if len(parts) == 2 and parts[1].lower() == "daily":
-        message = parts[0]
+    words = message_and_recur.split(" ")
+    tz_name = SCHEDULE_TIMEZONE
+    if len(words) > 1 and is_timezone(words[0]):
+        tz_name = words.pop(0)
+    catchup = SCHEDULE_CATCHUP
+    if len(words) > 1 and words[-1].lower().startswith("catchup="):
+        catchup = words.pop().split("=", 1)[1].lower()
+        if catchup not in CATCHUP_POLICIES:
+            await ctx.send(f"Unknown catch-up policy; use one of: {', '.join(CATCHUP_POLICIES)}.")
+            return
+    recurring = None
+    if len(words) > 1 and words[-1].lower() == "daily":
+        words.pop()
         recurring = "daily"
-    else:
-        message = message_and_recur
-        recurring = None
+    message = " ".join(words)
 
-    # Parse time (UTC)
+    # Parse the time of day or cron expression
     try:
-        hour, minute = map(int, time.split(":"))
-        now = datetime.utcnow()
-        send_time = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
-        if send_time <= now:
-            send_time += timedelta(days=1)
-    except Exception:
-        await ctx.send("Invalid time format. Use HH:MM in 24h UTC (e.g., 09:00).")
+        if ":" in when and " " not in when:
+            hour, minute = map(int, when.split(":"))
+            if not (0 <= hour <= 23 and 0 <= minute <= 59):
+                raise CronError(f"{when} is not a time of day")
+            cron = f"{minute} {hour} * * *"
+        else:
+            cron = when
+            recurring = "cron"
+        schedule = compile_schedule(cron, tz_name)
+        send_time = schedule.next_after(datetime.utcnow())
+        if send_time is None:
+            raise CronError(f"{when} never fires")
+    except (CronError, ValueError) as e:
+        await ctx.send(
+            f"Invalid time ({e}). Use HH:MM in 24h time (e.g., 09:00) or a cron expression in quotes "
+            f"(e.g., \"30 8 * * mon-fri\")."
+        )
         return
 
     # Store scheduled message
     msg = {
+        "id": uuid.uuid4().hex[:8],
         "channel_id": str(channel.id),
         "content": message,
         "send_time": send_time.isoformat(),
-        "recurring": recurring
+        "recurring": recurring,
+        "cron": cron if recurring else None,
+        "tz": tz_name,
+        "catchup": catchup
     }
-    scheduled_messages.append(msg)
-    save_scheduled_messages(scheduled_messages)
+    scheduled_messages[msg["id"]] = msg
+    schedule_message_job(msg)
+    scheduled_store.save(msg["id"])
     log_activity({
         "event": "scheduled_message_created",
         "user_id": str(user.id),
@@ -464,82 +991,40 @@ async def schedule_command(ctx, time: str, *, message_and_recur: str):
         "channel_name": str(channel),
         "content": message,
         "send_time": send_time.isoformat(),
-        "recurring": recurring or "none"
+        "recurring": recurring or "none",
+        "cron": msg["cron"],
+        "tz": tz_name,
+        "schedule_id": msg["id"]
     })
-    await ctx.send(f"Scheduled message for {send_time.strftime('%H:%M UTC')} ({'daily' if recurring else 'one-off'}): {message}")
+    repeats = {None: "one-off", "daily": "daily", "cron": f"repeats on {schedule.describe()}"}[recurring]
+    await ctx.send(f"Scheduled message `{msg['id']}` for {local_time_text(send_time, tz_name)} ({repeats}): {message}")
 
-    channel_id = message.channel.id
-    user_message = message.content.strip()
-    if not user_message:
+@bot.command(name="unschedule", help="Cancel a scheduled message. Usage: !unschedule <id>")
+async def unschedule_command(ctx, msg_id: str):
+    """Cancel a message scheduled in this channel, by the id !schedule replied with."""
+    msg = scheduled_messages.get(msg_id)
+    if msg is None or msg["channel_id"] != str(ctx.channel.id):
+        await ctx.send(f"No scheduled message `{msg_id}` in this channel.")
         return
-
-    # Only auto-reply if enabled in config
-    if not bot_config.get("autoreply", True):
-        return
-
-    # Log user message activity
-    log_activity({
-        "event": "user_message",
-        "user_id": str(message.author.id),
-        "username": str(message.author),
-        "channel_id": str(message.channel.id),
-        "channel_name": str(message.channel),
-        "content": user_message[:200]  # Truncate for log
-    })
-
-    # Add user message to history
-    history_manager.append(channel_id, {"role": "user", "content": user_message})
-
-    # Call OpenAI API
-    try:
-        response = openai.chat.completions.create(
-            model=bot_config.get("model", "gpt-4o"),
-            messages=history_manager.as_list(channel_id),
-            max_tokens=150,
-            temperature=0.7,
-        )
-        reply = response.choices[0].message.content.strip()
-        if not reply:
-            reply = "Hmm, I seem to have lost my train of thought. Try again?"
-        # Add assistant reply to history
-        history_manager.append(channel_id, {"role": "assistant", "content": reply})
-    except Exception as e:
-        logger.error(f"OpenAI API error: {e}")
-        log_error({
-            "event": "openai_api_error",
-            "error": str(e),
-            "user_id": str(message.author.id),
-            "username": str(message.author),
-            "channel_id": str(message.channel.id),
-            "channel_name": str(message.channel),
-            "user_message": user_message[:200]
-        })
-        reply = "Sorry, I couldn't reach my brain (OpenAI API error). Try again later!"
-
-    # Log bot response activity
+    del scheduled_messages[msg_id]
+    scheduler.cancel(f"msg:{msg_id}")
+    scheduled_store.save(msg_id)
     log_activity({
-        "event": "bot_response",
-        "channel_id": str(message.channel.id),
-        "channel_name": str(message.channel),
-        "reply": reply[:200]  # Truncate for log
+        "event": "scheduled_message_cancelled",
+        "user_id": str(ctx.author.id),
+        "username": str(ctx.author),
+        "channel_id": str(ctx.channel.id),
+        "schedule_id": msg_id
     })
-
-    # Send reply
-    try:
-        await message.channel.send(reply)
-    except discord.DiscordException as e:
-        logger.error(f"Failed to send message: {e}")
-        log_error({
-            "event": "discord_send_error",
-            "error": str(e),
-            "channel_id": str(message.channel.id),
-            "channel_name": str(message.channel),
-            "reply": reply[:200]
-        })
+    await ctx.send(f"Cancelled scheduled message `{msg_id}`.")
 
 @bot.command(name="image", help="Generate an image using OpenAI. Usage: !image <prompt>")
 async def image_command(ctx, *, prompt: str):
-    """Generate an image from a prompt using OpenAI's image API."""
+    """
+    Generate an image from a prompt using OpenAI's image API. Cached images
+    are posted straight away; otherwise a background job is queued and a
+    progress message is kept up to date until the image is uploaded.
+    """
     user = ctx.author
     channel = ctx.channel
     log_activity({
@@ -550,27 +1035,73 @@ async def image_command(ctx, *, prompt: str):
         "channel_name": str(channel),
         "prompt": prompt[:200]
     })
-    await ctx.trigger_typing()
+    key = image_cache.key(prompt, IMAGE_MODEL, IMAGE_SIZE)
+    data = await image_cache.get(key)
+    if data is not None:
+        await send_image(ctx, prompt, data, key, cached=True)
+        return
     try:
-        response = openai.images.generate(
-            model="dall-e-3",
-            prompt=prompt,
-            n=1,
-            size="1024x1024"
-        )
-        image_url = response.data[0].url
-        await ctx.send(f"{user.mention} Here is your image for: \"{prompt}\"\n{image_url}")
+        fair_share.admit("image", str(user.id), str(channel.id))
+    except QuotaExceeded as e:
+        minutes = max(1, round(e.retry_after / 60))
+        await ctx.send(f"{user.mention} You've hit the image limit ({e.limit} per {e.window / 60:g} min); try again in about {minutes} min.")
         log_activity({
-            "event": "image_generated",
+            "event": "quota_exceeded",
+            "kind": "image",
             "user_id": str(user.id),
             "username": str(user),
             "channel_id": str(channel.id),
             "channel_name": str(channel),
-            "prompt": prompt[:200],
-            "image_url": image_url
+            "reason": str(e)
+        })
+        return
+    try:
+        job = image_jobs.submit(prompt, IMAGE_MODEL, IMAGE_SIZE, str(user.id), str(channel.id))
+    except ImageQueueFull:
+        # Nothing will be generated, so it shouldn't count against the quota
+        fair_share.refund("image", str(user.id), str(channel.id))
+        await ctx.send(f"{user.mention} I'm busy with a lot of images right now; please try again in a few minutes.")
+        log_activity({
+            "event": "image_shed",
+            "user_id": str(user.id),
+            "username": str(user),
+            "channel_id": str(channel.id),
+            "channel_name": str(channel),
+            "prompt": prompt[:200]
         })
+        return
+    task = asyncio.create_task(deliver_image(ctx, job))
+    image_deliveries.add(task)
+    task.add_done_callback(image_deliveries.discard)
+
+def image_progress(job) -> str:
+    if job.state == GENERATING:
+        return f"\N{ARTIST PALETTE} Generating your image for: \"{job.prompt[:100]}\"..."
+    if job.ahead:
+        return f"\N{ARTIST PALETTE} Queued behind {job.ahead} other image{'s' if job.ahead != 1 else ''}..."
+    return "\N{ARTIST PALETTE} Queued..."
+
+async def deliver_image(ctx, job):
+    """Keep the progress message up to date while `job` runs, then post the image."""
+    user = ctx.author
+    channel = ctx.channel
+    progress = None
+    try:
+        async for state in job.updates():
+            if state == DONE or job.finished:
+                break
+            text = image_progress(job)
+            if progress is None:
+                progress = await governor.run("discord", lambda: ctx.send(text))
+            else:
+                await governor.run("discord", lambda: progress.edit(content=text))
+        if job.state == DONE:
+            await send_image(ctx, job.prompt, job.data, job.key, cached=False)
+            return
+        raise job.error
     except Exception as e:
         logger.error(f"OpenAI image generation error: {e}")
+        api_errors_total.inc("openai_image")
         log_error({
             "event": "openai_image_error",
             "error": str(e),
@@ -578,13 +1109,297 @@ async def image_command(ctx, *, prompt: str):
             "username": str(user),
             "channel_id": str(channel.id),
             "channel_name": str(channel),
-            "prompt": prompt[:200]
+            "prompt": job.prompt[:200]
         })
         await ctx.send(f"Sorry, I couldn't generate an image for that prompt. (OpenAI error)")
+    finally:
+        if progress is not None:
+            try:
+                await progress.delete()
+            except discord.HTTPException:
+                pass
+
+async def send_image(ctx, prompt: str, data: bytes, key: str, cached: bool):
+    """Upload an image as an attachment, so it outlives OpenAI's temporary URLs."""
+    user = ctx.author
+    channel = ctx.channel
+    with stage_seconds.time("image_upload"):
+        await governor.run("discord", lambda: ctx.send(
+            f"{user.mention} Here is your image for: \"{prompt}\"",
+            file=discord.File(io.BytesIO(data), filename=f"{key[:16]}.png"),
+        ))
+    log_activity({
+        "event": "image_generated",
+        "user_id": str(user.id),
+        "username": str(user),
+        "channel_id": str(channel.id),
+        "channel_name": str(channel),
+        "prompt": prompt[:200],
+        "cached": cached,
+        "image_key": key
+    })
+
+from discord.ext.commands import has_permissions, CheckFailure
+
+@bot.group(name="admin", invoke_without_command=True, help="Admin commands. Use !admin <subcommand>")
+@has_permissions(administrator=True)
+async def admin_group(ctx):
+    await ctx.send("Available admin commands: clearhistory, historystats, setmodel, listmodels, autoreply, stream, cache, quota, perf")
+
+@admin_group.command(name="clearhistory", help="Clear chat history for this channel")
+async def clearhistory(ctx):
+    channel_id = ctx.channel.id
+    if history_manager.clear(channel_id):
+        await ctx.send("Chat history cleared for this channel.")
+        log_activity({
+            "event": "admin_clearhistory",
+            "channel_id": str(channel_id),
+            "user_id": str(ctx.author.id),
+            "username": str(ctx.author)
+        })
+    else:
+        await ctx.send("No history found for this channel.")
+
+@admin_group.command(name="historystats", help="Show how much chat history is held in memory")
+async def historystats(ctx):
+    stats = history_manager.stats()
+    await ctx.send(
+        f"History: {stats['channels']} channels, {stats['messages']} messages, "
+        f"{stats['bytes'] / 1024 / 1024:.1f} MB of {stats['max_bytes'] / 1024 / 1024:.0f} MB budget, "
+        f"{stats['evictions']} idle channels evicted, {stats['summaries']} channels summarised "
+        f"({history_manager.summaries_made} summaries made, {history_manager.summary_failures} failed)."
+    )
+
+@admin_group.command(name="setmodel", help="Set the OpenAI model used for chat (e.g., gpt-4o, gpt-3.5-turbo)")
+async def setmodel(ctx, model: str):
+    bot_config["model"] = model
+    config_store.save()
+    await ctx.send(f"OpenAI model set to: {model}")
+    log_activity({
+        "event": "admin_setmodel",
+        "model": model,
+        "user_id": str(ctx.author.id),
+        "username": str(ctx.author)
+    })
+
+@admin_group.command(name="listmodels", help="List available OpenAI models")
+async def listmodels(ctx):
+    try:
+        model_names = await ai_client.list_models()
+        await ctx.send("Available OpenAI models:\n" + "\n".join(model_names))
+    except Exception as e:
+        await ctx.send("Failed to fetch models from OpenAI.")
+        log_error({
+            "event": "admin_listmodels_error",
+            "error": str(e),
+            "user_id": str(ctx.author.id),
+            "username": str(ctx.author)
+        })
+
+@admin_group.command(name="autoreply", help="Turn auto-reply to all messages on or off")
+async def autoreply(ctx, mode: str):
+    mode = mode.lower()
+    if mode == "on":
+        bot_config["autoreply"] = True
+        config_store.save()
+        await ctx.send("Auto-reply to all messages is now ON.")
+    elif mode == "off":
+        bot_config["autoreply"] = False
+        config_store.save()
+        await ctx.send("Auto-reply to all messages is now OFF.")
+    else:
+        await ctx.send("Usage: !admin autoreply on|off")
+    log_activity({
+        "event": "admin_autoreply",
+        "mode": mode,
+        "user_id": str(ctx.author.id),
+        "username": str(ctx.author)
+    })
+
+@admin_group.command(name="stream", help="Turn streaming replies (live message edits) on or off")
+async def stream(ctx, mode: str):
+    mode = mode.lower()
+    if mode == "on":
+        bot_config["stream"] = True
+        config_store.save()
+        await ctx.send("Streaming replies are now ON.")
+    elif mode == "off":
+        bot_config["stream"] = False
+        config_store.save()
+        await ctx.send("Streaming replies are now OFF.")
+    else:
+        await ctx.send("Usage: !admin stream on|off")
+    log_activity({
+        "event": "admin_stream",
+        "mode": mode,
+        "user_id": str(ctx.author.id),
+        "username": str(ctx.author)
+    })
+
+@admin_group.command(name="cache", help="Reuse replies to repeated questions in this channel. Usage: !admin cache on [ttl seconds]|off|stats|clear")
+async def cache(ctx, mode: str, ttl: float = RESPONSE_CACHE_TTL):
+    mode = mode.lower()
+    channel_id = str(ctx.channel.id)
+    cache_channels = bot_config.setdefault("cache_channels", {})
+    if mode == "on":
+        cache_channels[channel_id] = ttl
+        config_store.save()
+        await ctx.send(f"Response cache is now ON for this channel ({ttl:g}s TTL).")
+    elif mode == "off":
+        cache_channels.pop(channel_id, None)
+        config_store.save()
+        await ctx.send("Response cache is now OFF for this channel.")
+    elif mode == "stats":
+        stats = response_cache.stats()
+        await ctx.send(
+            f"Response cache: {stats['entries']}/{stats['max_entries']} entries, "
+            f"{stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%} hit rate), "
+            f"~{stats['seconds_saved']:.0f}s of API time saved.\n"
+            f"Image cache: {len(image_cache.index.data)} prompts, {image_cache.total_bytes() / 1e6:.1f} MB, "
+            f"{image_cache.hits} hits, {image_cache.misses} misses."
+        )
+        return
+    elif mode == "clear":
+        response_cache.clear()
+        await ctx.send("Response cache cleared.")
+    else:
+        await ctx.send("Usage: !admin cache on [ttl seconds]|off|stats|clear")
+        return
+    log_activity({
+        "event": "admin_cache",
+        "mode": mode,
+        "channel_id": channel_id,
+        "user_id": str(ctx.author.id),
+        "username": str(ctx.author)
+    })
+
+@admin_group.command(name="quota", help="Show or override request quotas. Usage: !admin quota [@user|#channel] [chat|image|weight] [n|default]")
+async def quota(ctx, target: Optional[Union[discord.Member, discord.TextChannel]] = None, kind: str = None, value: str = None):
+    if target is None:
+        lines = ["Default quotas (0 = unlimited):"]
+        for name, (user_limit, channel_limit, window) in fair_share.defaults.items():
+            lines.append(
+                f"- {name}: {user_limit} per user, {channel_limit} per channel every {window:g}s; "
+                f"{fair_share.rejected.get(name, 0)} rejected, {fair_share.queues[name].waiting()} waiting"
+            )
+        overrides = bot_config.get("quotas", {})
+        lines.append(f"Overrides: {len(overrides.get('users', {}))} users, {len(overrides.get('channels', {}))} channels.")
+        await ctx.send("\n".join(lines))
+        return
+    is_user = isinstance(target, discord.Member)
+    scope = "users" if is_user else "channels"
+    target_id = str(target.id)
+    if kind is None:
+        if is_user:
+            usage = ", ".join(
+                f"{name} {fair_share.usage(name, target_id)}/{fair_share.limit(name, user_id=target_id) or 'unlimited'}"
+                for name in fair_share.defaults
+            )
+            await ctx.send(f"{target.display_name}: {usage}; weight {fair_share.weight(target_id)}.")
+        else:
+            limits = ", ".join(
+                f"{name} {fair_share.limit(name, channel_id=target_id) or 'unlimited'}"
+                for name in fair_share.defaults
+            )
+            await ctx.send(f"#{target}: {limits}.")
+        return
+    kind = kind.lower()
+    allowed = list(fair_share.defaults) + (["weight"] if is_user else [])
+    if kind not in allowed or value is None or not (value == "default" or value.isdigit()):
+        await ctx.send("Usage: !admin quota [@user|#channel] [chat|image|weight] [n|default]")
+        return
+    entries = bot_config.setdefault("quotas", {}).setdefault(scope, {})
+    entry = entries.setdefault(target_id, {})
+    if value == "default":
+        entry.pop(kind, None)
+        if not entry:
+            entries.pop(target_id, None)
+    else:
+        entry[kind] = int(value)
+    config_store.save()
+    await ctx.send(f"{kind} for {target} set to {value}.")
+    log_activity({
+        "event": "admin_quota",
+        "target_id": target_id,
+        "scope": scope,
+        "kind": kind,
+        "value": value,
+        "user_id": str(ctx.author.id),
+        "username": str(ctx.author)
+    })
+
+@admin_group.command(name="perf", help="Show latency and throughput figures for the bot's pipelines")
+async def perf(ctx):
+    lines = ["Stage latency (count, p50, p99):"]
+    for (stage,), _ in sorted(stage_seconds.series.items()):
+        p50 = stage_seconds.quantile(0.5, stage)
+        p99 = stage_seconds.quantile(0.99, stage)
+        lines.append(f"- {stage}: {stage_seconds.count(stage)}, {p50 * 1000:.0f} ms, {p99 * 1000:.0f} ms")
+    replies = ", ".join(f"{source} {int(n)}" for (source,), n in sorted(replies_total.values.items())) or "none"
+    errors = ", ".join(f"{api} {int(n)}" for (api,), n in sorted(api_errors_total.values.items())) or "none"
+    lines.append(f"Messages: {int(messages_total.get())}; replies: {replies}; API errors: {errors}")
+    lines.append(
+        f"Reply queue: {reply_queue.depth()} waiting in {reply_queue.active_channels()} channels; "
+        f"history: {len(history_manager.histories)} channels; "
+        f"cache hits/misses: {response_cache.hits}/{response_cache.misses}; "
+        f"loop lag: {loop_lag.get() * 1000:.1f} ms"
+    )
+    breakers = ", ".join(f"{api} {b.state}" for api, b in sorted(governor.breakers.items())) or "none"
+    lines.append(f"Retries: {governor.retries}; shed: {governor.shed}; circuits: {breakers}")
+    lines.append(
+        f"Image jobs: {image_jobs.pending()} pending, {image_jobs.completed} done, {image_jobs.failed} failed, "
+        f"{image_jobs.joined} shared with an identical request"
+    )
+    lines.append(f"Daily facts: {len(fact_pool.facts)} pooled, {fact_pool.refills} refills")
+    for kind in ("scheduled", "dailyjoke"):
+        if delivery_lateness.count(kind):
+            lines.append(
+                f"{kind} deliveries: {delivery_lateness.count(kind)}, sent p50 {delivery_lateness.quantile(0.5, kind):.1f}s, "
+                f"p99 {delivery_lateness.quantile(0.99, kind):.1f}s after their due time"
+            )
+    startup = ", ".join(f"{phase} {t:.2f}s" for phase, t in startup_timings.items())
+    lines.append(f"Startup: {startup}")
+    await ctx.send("\n".join(lines))
+
+@admin_group.error
+async def admin_group_error(ctx, error):
+    if isinstance(error, CheckFailure):
+        await ctx.send("You must be an administrator to use admin commands.")
+
+@bot.command(name="stats", help="Show usage stats for a user (default: you) and this channel")
+@has_permissions(administrator=True)
+async def stats_command(ctx, member: discord.Member = None):
+    member = member or ctx.author
+    user = stats_engine.user(str(member.id))
+    channel = stats_engine.channel(str(ctx.channel.id))
+    busiest = stats_engine.busiest_hour()
+    await ctx.send(
+        f"{member.display_name}: {user['messages']} messages, {user['commands']} other events.\n"
+        f"#{ctx.channel}: {channel['messages']} messages, {channel['responses']} bot replies.\n"
+        f"Busiest hour overall: {busiest + ':00 UTC' if busiest else 'n/a'}."
+    )
+
+@bot.command(name="topusers", help="List the most active users. Usage: !topusers [n]")
+@has_permissions(administrator=True)
+async def topusers_command(ctx, n: int = 10):
+    top = stats_engine.top(max(1, min(n, stats_engine.top_users.k)))
+    if not top:
+        await ctx.send("No user activity recorded yet.")
+        return
+    lines = [f"{i}. {name} — {count} messages" for i, (_, name, count) in enumerate(top, 1)]
+    await ctx.send("Most active users:\n" + "\n".join(lines))
+
+@stats_command.error
+@topusers_command.error
+async def stats_command_error(ctx, error):
+    if isinstance(error, CheckFailure):
+        await ctx.send("You must be an administrator to view stats.")
+
 # --- Main Entrypoint ---
 
 if __name__ == "__main__":
     try:
         bot.run(DISCORD_TOKEN)
     except Exception as e:
-        logger.critical(f"Bot failed to start: {e}")
\ No newline at end of file
+        logger.critical(f"Bot failed to start: {e}")
+
@@ -0,0 +1,57 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List
+
+logger = logging.getLogger("botty.queue")
+
+
+class ChannelWorkQueue:
+    """
+    Runs work for each channel strictly in order while different channels
+    proceed concurrently.
+
+    Items submitted for a channel are buffered and handed to `handler` in
+    batches by a per-channel worker task. The worker waits `debounce`
+    seconds after the first item of a batch so a quick burst is handled as
+    one call, and anything that arrives while a batch is being handled is
+    picked up by the next call. Workers exit when their channel goes quiet.
+    """
+    def __init__(
+        self,
+        handler: Callable[[Any, List[Any]], Awaitable[None]],
+        debounce: float = 0.0,
+        max_batch: int = 10,
+    ):
+        self.handler = handler
+        self.debounce = debounce
+        self.max_batch = max_batch
+        self._pending: Dict[Any, List[Any]] = {}
+        self._workers: Dict[Any, asyncio.Task] = {}
+
+    def submit(self, channel_id: Any, item: Any) -> None:
+        self._pending.setdefault(channel_id, []).append(item)
+        if channel_id not in self._workers:
+            self._workers[channel_id] = asyncio.create_task(self._work(channel_id))
+
+    def depth(self) -> int:
+        """Number of items waiting across all channels."""
+        return sum(len(items) for items in self._pending.values())
+
+    def active_channels(self) -> int:
+        return len(self._workers)
+
+    async def _work(self, channel_id: Any) -> None:
+        try:
+            while self._pending.get(channel_id):
+                if self.debounce > 0:
+                    await asyncio.sleep(self.debounce)
+                items = self._pending[channel_id]
+                batch = items[:self.max_batch]
+                del items[:self.max_batch]
+                try:
+                    await self.handler(channel_id, batch)
+                except Exception as e:
+                    logger.exception(f"Channel worker for {channel_id} failed: {e}")
+        finally:
+            self._pending.pop(channel_id, None)
+            self._workers.pop(channel_id, None)
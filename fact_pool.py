@@ -0,0 +1,149 @@
+import asyncio
+import hashlib
+import logging
+import random
+import re
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from response_cache import normalise
+
+logger = logging.getLogger("botty.facts")
+
+# Bullets and numbering a model may put in front of each line
+_LIST_MARKER = re.compile(r"^\s*(?:[-*•]|\d+[.)])\s*")
+
+
+def fact_id(text: str) -> str:
+    return hashlib.sha1(normalise(text).encode("utf-8")).hexdigest()[:12]
+
+
+def parse_facts(text: str) -> List[str]:
+    """Split a model's reply into one fact per non-empty line."""
+    facts = []
+    for line in text.splitlines():
+        line = _LIST_MARKER.sub("", line).strip().strip('"').strip()
+        if len(line) >= 20:
+            facts.append(line)
+    return facts
+
+
+class FactPool:
+    """
+    A persistent pool of daily facts shared by every channel.
+
+    `store.data` holds `{"facts": {id: text}}` and `seen_store.data` holds
+    `{channel_id: [id, ...]}`, the ids of each channel's most recent facts,
+    at most `remember` of them and only those still pooled. A keyed
+    seen_store writes just the channel picked from rather than every list.
+    `pick` never waits on the API: it returns a fact the channel has not had
+    among its last `remember` facts (or, if it has had them all, the one it
+    had longest ago). When a pick leaves the channel with fewer than
+    `low_water` unseen facts, one background call to `generate(n)` adds a
+    batch of `batch_size` new ones, so a single generation is shared by
+    every channel. Refills are at least `refill_interval` seconds apart, so
+    a model that keeps repeating itself can't cause a call per send. Facts
+    whose text is already pooled are skipped, and the oldest facts are
+    dropped once there are more than `max_size`.
+    """
+    def __init__(
+        self,
+        store,
+        seen_store,
+        generate: Callable[[int], Awaitable[str]],
+        seed: List[str],
+        batch_size: int = 50,
+        low_water: int = 20,
+        max_size: int = 1000,
+        remember: int = 60,
+        refill_interval: float = 600.0,
+    ):
+        self.store = store
+        self.seen_store = seen_store
+        self.generate = generate
+        self.seed = seed
+        self.batch_size = batch_size
+        self.low_water = low_water
+        self.max_size = max_size
+        self.remember = remember
+        self.refill_interval = refill_interval
+        self.refills = 0
+        self._refill_task: Optional[asyncio.Task] = None
+        self._last_refill: Optional[float] = None
+
+    @property
+    def facts(self) -> Dict[str, str]:
+        data = self.store.data
+        if not data.get("facts"):
+            data["facts"] = {fact_id(text): text for text in self.seed}
+        return data["facts"]
+
+    def _seen(self, channel_id: str) -> List[str]:
+        legacy = self.store.data.pop("seen", None)
+        if legacy:
+            # Saved before the seen lists had a store of their own
+            self.seen_store.data.update(legacy)
+            self.seen_store.save()
+            self.store.save()
+        return self.seen_store.data.setdefault(channel_id, [])
+
+    def unseen(self, channel_id: str) -> int:
+        seen = set(self._seen(channel_id))
+        return sum(1 for key in self.facts if key not in seen)
+
+    def pick(self, channel_id: str) -> str:
+        facts = self.facts
+        seen = self._seen(channel_id)
+        seen_set = set(seen)
+        fresh = [key for key in facts if key not in seen_set]
+        if fresh:
+            key = random.choice(fresh)
+        else:
+            key = next(k for k in seen if k in facts)
+            seen.remove(key)
+        seen.append(key)
+        # Facts that have left the pool can't be picked again anyway
+        seen[:] = [k for k in seen if k in facts][-min(self.remember, len(facts)):]
+        self.seen_store.save(channel_id)
+        if len(fresh) - 1 < self.low_water:
+            self.request_refill()
+        return facts[key]
+
+    def request_refill(self) -> None:
+        """Start a background refill unless one is already running."""
+        if self._refill_task is not None and not self._refill_task.done():
+            return
+        now = time.monotonic()
+        if self._last_refill is None or now - self._last_refill >= self.refill_interval:
+            self._last_refill = now
+            self._refill_task = asyncio.create_task(self.refill())
+
+    async def refill(self) -> int:
+        """Generate one batch of facts and add the new ones. Returns how many were added."""
+        try:
+            text = await self.generate(self.batch_size)
+        except Exception as e:
+            logger.error(f"Failed to refill the daily fact pool: {e}")
+            return 0
+        facts = self.facts
+        added = 0
+        for fact in parse_facts(text):
+            key = fact_id(fact)
+            if key not in facts:
+                facts[key] = fact
+                added += 1
+        # Dicts keep insertion order, so the oldest facts go first
+        for key in list(facts)[:max(0, len(facts) - self.max_size)]:
+            del facts[key]
+        self.refills += 1
+        self.store.save()
+        logger.info(f"Added {added} daily facts; the pool now holds {len(facts)}")
+        return added
+
+    async def close(self) -> None:
+        if self._refill_task is not None and not self._refill_task.done():
+            self._refill_task.cancel()
+            try:
+                await self._refill_task
+            except asyncio.CancelledError:
+                pass
@@ -0,0 +1,237 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Callable, Deque, Dict, Optional, Tuple
+
+logger = logging.getLogger("botty.fairshare")
+
+PRUNE_EVERY = 1000
+
+
+class QuotaExceeded(Exception):
+    """Raised by `FairShareScheduler.admit` when a user or channel is over quota."""
+    def __init__(self, kind: str, scope: str, limit: int, window: float, retry_after: float):
+        super().__init__(f"{scope} {kind} quota of {limit} per {window:g}s exceeded")
+        self.kind = kind
+        self.scope = scope
+        self.limit = limit
+        self.window = window
+        self.retry_after = retry_after
+
+
+class SlidingWindowCounter:
+    """Timestamps of recent requests per key, for sliding-window quotas."""
+    def __init__(self):
+        self._hits: Dict[Tuple[str, str], Deque[float]] = {}
+        self._checks = 0
+
+    def _recent(self, key: Tuple[str, str], window: float, now: float) -> Deque[float]:
+        hits = self._hits.get(key)
+        if hits is None:
+            hits = self._hits[key] = deque()
+        while hits and hits[0] <= now - window:
+            hits.popleft()
+        return hits
+
+    def retry_after(self, key: Tuple[str, str], limit: int, window: float, now: float) -> float:
+        """0 if another request fits in the window, otherwise seconds until one does."""
+        hits = self._recent(key, window, now)
+        if len(hits) < limit:
+            return 0.0
+        return hits[len(hits) - limit] + window - now
+
+    def record(self, key: Tuple[str, str], now: float) -> None:
+        self._hits.setdefault(key, deque()).append(now)
+        self._checks += 1
+        if self._checks >= PRUNE_EVERY:
+            self._checks = 0
+            self._hits = {k: v for k, v in self._hits.items() if v and v[-1] > now - 86400}
+
+    def forget(self, key: Tuple[str, str]) -> None:
+        """Drop the most recent request recorded for `key`."""
+        hits = self._hits.get(key)
+        if hits:
+            hits.pop()
+
+    def count(self, key: Tuple[str, str], window: float) -> int:
+        hits = self._hits.get(key)
+        if not hits:
+            return 0
+        return len(self._recent(key, window, time.monotonic()))
+
+
+class FairQueue:
+    """
+    Hands out `slots` concurrent slots with round-robin across groups and
+    weighted round-robin across the keys within each group.
+
+    When every slot is taken, callers wait in a FIFO per (group, key).
+    Groups take turns one slot at a time; within a group, each key in its
+    ring is granted up to its weight in slots (over that group's turns)
+    before the next key is served. With channels as groups and users as
+    keys, neither a busy user nor a busy channel delays the others by more
+    than a turn, rather than by its whole backlog.
+    """
+    def __init__(self, slots: int):
+        self.slots = max(1, slots)
+        self.active = 0
+        self._waiters: Dict[Tuple[str, str], Deque[asyncio.Future]] = {}
+        self._ring: Deque[str] = deque()
+        self._keys: Dict[str, Deque[str]] = {}
+        self._weights: Dict[Tuple[str, str], int] = {}
+        self._credit: Dict[Tuple[str, str], int] = {}
+
+    def waiting(self) -> int:
+        return sum(len(q) for q in self._waiters.values())
+
+    @asynccontextmanager
+    async def slot(self, key: str, weight: int = 1, group: str = ""):
+        await self._acquire(group, key, max(1, weight))
+        try:
+            yield
+        finally:
+            self._release()
+
+    async def _acquire(self, group: str, key: str, weight: int) -> None:
+        if self.active < self.slots and not self._ring:
+            self.active += 1
+            return
+        slot_key = (group, key)
+        waiters = self._waiters.get(slot_key)
+        if waiters is None:
+            waiters = self._waiters[slot_key] = deque()
+            keys = self._keys.get(group)
+            if keys is None:
+                keys = self._keys[group] = deque()
+                self._ring.append(group)
+            keys.append(key)
+            self._credit[slot_key] = weight
+        self._weights[slot_key] = weight
+        future = asyncio.get_running_loop().create_future()
+        waiters.append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted a slot just as we were cancelled; pass it on
+                self._release()
+            else:
+                try:
+                    waiters.remove(future)
+                except ValueError:
+                    pass
+                if not waiters and self._waiters.get(slot_key) is waiters:
+                    self._drop(group, key)
+            raise
+
+    def _drop(self, group: str, key: str) -> None:
+        slot_key = (group, key)
+        self._waiters.pop(slot_key, None)
+        self._credit.pop(slot_key, None)
+        self._weights.pop(slot_key, None)
+        keys = self._keys.get(group)
+        if keys is None:
+            return
+        try:
+            keys.remove(key)
+        except ValueError:
+            pass
+        if not keys:
+            del self._keys[group]
+            try:
+                self._ring.remove(group)
+            except ValueError:
+                pass
+
+    def _release(self) -> None:
+        self.active -= 1
+        while self.active < self.slots and self._ring:
+            group = self._ring[0]
+            keys = self._keys[group]
+            key = keys[0]
+            slot_key = (group, key)
+            waiters = self._waiters[slot_key]
+            future = waiters.popleft()
+            if future.done():
+                # Cancelled while queued; its task cleans up after itself
+                if not waiters:
+                    self._drop(group, key)
+                continue
+            self._credit[slot_key] -= 1
+            if not waiters:
+                self._drop(group, key)
+            elif self._credit[slot_key] <= 0:
+                self._credit[slot_key] = self._weights[slot_key]
+                keys.rotate(-1)
+            if group in self._keys:
+                self._ring.rotate(-1)
+            self.active += 1
+            future.set_result(None)
+
+
+class FairShareScheduler:
+    """
+    Fair-share admission and ordering for OpenAI work, one `FairQueue` per
+    kind of request (e.g. "chat", "image").
+
+    `admit` is the cheap up-front check: it enforces sliding-window quotas
+    per user and per channel and raises QuotaExceeded before any API call
+    is made. `slot` then orders admitted work by round-robin over channels
+    and, within each channel, weighted round-robin over users. `defaults` maps a kind to `(user_limit, channel_limit, window)`
+    (a limit of 0 means no limit); `overrides` returns the admin overrides,
+    shaped like `{"users": {id: {"chat": n, "weight": w}}, "channels": {id: {"image": n}}}`.
+    """
+    def __init__(
+        self,
+        slots: Dict[str, int],
+        defaults: Dict[str, Tuple[int, int, float]],
+        overrides: Optional[Callable[[], dict]] = None,
+    ):
+        self.queues = {kind: FairQueue(n) for kind, n in slots.items()}
+        self.defaults = defaults
+        self.overrides = overrides or (lambda: {})
+        self.counter = SlidingWindowCounter()
+        self.rejected: Dict[str, int] = {kind: 0 for kind in slots}
+
+    def _override(self, scope: str, key: str) -> dict:
+        return self.overrides().get(scope, {}).get(key, {})
+
+    def limit(self, kind: str, user_id: Optional[str] = None, channel_id: Optional[str] = None) -> int:
+        """Quota for a user (or, with only `channel_id`, a channel) after overrides."""
+        user_limit, channel_limit, _ = self.defaults.get(kind, (0, 0, 60.0))
+        if user_id is not None:
+            return int(self._override("users", user_id).get(kind, user_limit))
+        return int(self._override("channels", channel_id).get(kind, channel_limit))
+
+    def weight(self, user_id: str) -> int:
+        return int(self._override("users", user_id).get("weight", 1))
+
+    def admit(self, kind: str, user_id: str, channel_id: str) -> None:
+        window = self.defaults.get(kind, (0, 0, 60.0))[2]
+        now = time.monotonic()
+        checks = (
+            ("user", (kind, f"u:{user_id}"), self.limit(kind, user_id=user_id)),
+            ("channel", (kind, f"c:{channel_id}"), self.limit(kind, channel_id=channel_id)),
+        )
+        for scope, key, limit in checks:
+            if limit > 0:
+                wait = self.counter.retry_after(key, limit, window, now)
+                if wait > 0:
+                    self.rejected[kind] = self.rejected.get(kind, 0) + 1
+                    raise QuotaExceeded(kind, scope, limit, window, wait)
+        for _, key, _ in checks:
+            self.counter.record(key, now)
+
+    def refund(self, kind: str, user_id: str, channel_id: str) -> None:
+        """Give back the quota `admit` just charged, for work that was turned away after all."""
+        self.counter.forget((kind, f"u:{user_id}"))
+        self.counter.forget((kind, f"c:{channel_id}"))
+
+    def usage(self, kind: str, user_id: str) -> int:
+        window = self.defaults.get(kind, (0, 0, 60.0))[2]
+        return self.counter.count((kind, f"u:{user_id}"), window)
+
+    def slot(self, kind: str, user_id: str, channel_id: str = ""):
+        return self.queues[kind].slot(user_id, self.weight(user_id), group=channel_id)
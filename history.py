@@ -0,0 +1,351 @@
+import asyncio
+import logging
+import sys
+import itertools
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Dict, List, Optional
+
+try:
+    import tiktoken
+except ImportError:  # optional: fall back to a character-based estimate
+    tiktoken = None
+
+logger = logging.getLogger("botty.history")
+
+# Context window sizes for the chat models we commonly run; anything unknown
+# is treated as the smallest of these.
+MODEL_CONTEXT_TOKENS = {
+    "gpt-4o": 128000,
+    "gpt-4o-mini": 128000,
+    "gpt-4-turbo": 128000,
+    "gpt-4": 8192,
+    "gpt-3.5-turbo": 16385,
+}
+DEFAULT_CONTEXT_TOKENS = 8192
+
+# Tokens the chat format adds around every message (role, separators).
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Rough per-channel bookkeeping cost (deque, LRU slot) used in memory stats.
+CHANNEL_OVERHEAD_BYTES = 700
+
+SUMMARY_PREFIX = "Summary of the earlier conversation in this channel: "
+
+# summarizer(previous_summary, messages) -> new summary covering both
+Summarizer = Callable[[Optional[str], List[dict]], Awaitable[str]]
+
+
+class HistoryEntry:
+    """
+    One stored chat message. Roles are interned so every entry shares the
+    same few strings, and the token count is cached per encoding.
+    """
+    __slots__ = ("role", "content", "encoding", "tokens")
+
+    def __init__(self, role: str, content: str):
+        self.role = sys.intern(role)
+        self.content = content
+        self.encoding: Optional[str] = None
+        self.tokens = 0
+
+    def as_message(self) -> dict:
+        return {"role": self.role, "content": self.content}
+
+    def size(self) -> int:
+        return sys.getsizeof(self) + sys.getsizeof(self.content)
+
+
+class TokenCounter:
+    """
+    Counts chat message tokens for a model.
+
+    Uses tiktoken when it is installed and a ~4 characters per token estimate
+    otherwise. Encodings are loaded once per model and reused.
+    """
+    def __init__(self):
+        self._encodings: Dict[str, object] = {}
+
+    def encoding_name(self, model: str) -> str:
+        if tiktoken is None:
+            return "approx"
+        encoding = self._encoding(model)
+        return encoding.name if encoding is not None else "approx"
+
+    def _encoding(self, model: str):
+        if model not in self._encodings:
+            try:
+                self._encodings[model] = tiktoken.encoding_for_model(model)
+            except KeyError:
+                self._encodings[model] = tiktoken.get_encoding("o200k_base")
+            except Exception as e:
+                logger.warning(f"Falling back to approximate token counts for {model}: {e}")
+                self._encodings[model] = None
+        return self._encodings[model]
+
+    def count(self, model: str, content: str) -> int:
+        encoding = self._encoding(model) if tiktoken is not None else None
+        if encoding is None:
+            return MESSAGE_OVERHEAD_TOKENS + len(content) // 4 + 1
+        return MESSAGE_OVERHEAD_TOKENS + len(encoding.encode(content))
+
+
+class ChannelHistory:
+    """
+    Maintains a bounded message history per channel and builds the prompt
+    window sent to the model from it.
+
+    `as_list` walks back from the newest message and stops once the model's
+    token budget is spent, so long channels send a short, recent window
+    rather than the whole history. Each message's token count is cached next
+    to it the first time it is measured, so building a window only
+    tokenises messages that arrived since the last turn.
+
+    Channels are kept in least-recently-used order. When the estimated size
+    of all histories passes `max_bytes`, or there are more than
+    `max_channels`, the idlest channels are dropped until it fits again.
+
+    With a `store` (see history_store.py) every message is also appended to
+    disk, and a channel that is not resident is read back by `load` the
+    first time it is needed, whether after a restart or an eviction.
+
+    With a `summarizer`, once a channel holds `summarize_after` messages all
+    but the newest `keep_recent` are condensed into a rolling summary that
+    is sent after the system prompt. Summaries are made by a background task
+    per channel; replies keep using the previous summary and the full
+    messages until the new one is ready, so a reply never waits on one.
+    Summaries live in memory only; after a restart the stored messages are
+    summarised again.
+    """
+    def __init__(
+        self,
+        maxlen: int,
+        token_budget: int = 4000,
+        reply_tokens: int = 150,
+        max_bytes: int = 64 * 1024 * 1024,
+        max_channels: int = 0,
+        store=None,
+        summarizer: Optional[Summarizer] = None,
+        summarize_after: int = 0,
+        keep_recent: int = 20,
+    ):
+        self.maxlen = maxlen
+        self.token_budget = token_budget
+        self.reply_tokens = reply_tokens
+        self.max_bytes = max_bytes
+        self.max_channels = max_channels
+        self.counter = TokenCounter()
+        self.store = store
+        self.summarizer = summarizer
+        self.summarize_after = summarize_after
+        self.keep_recent = keep_recent
+        self.summaries: Dict[int, HistoryEntry] = {}
+        self._summarizing: Dict[int, asyncio.Task] = {}
+        self.summaries_made = 0
+        self.summary_failures = 0
+        # The system prompt is held once, outside the per-channel deques, and
+        # prepended when a window is built.
+        self.histories: "OrderedDict[int, deque]" = OrderedDict()
+        self._bytes: Dict[int, int] = {}
+        self.total_bytes = 0
+        self.evictions = 0
+        self.system_prompt = {
+            "role": "system",
+            "content": (
+                "Prompt for Botty (Discord Bot):\n\n"
+                "You are Botty, a helpful and witty Discord bot. Your main role is to assist users with their questions and commands, "
+                "but you never miss a chance to crack a joke or respond with dry, sarcastic humour. You're clever, quick-witted, and always "
+                "stay just on the right side of cheeky. While you're always willing to help, your responses should carry a light, humorous tone — "
+                "think helpful assistant meets stand-up comedian.\n\n"
+                "Guidelines for your responses:\n"
+                "- Always provide useful and accurate information.\n"
+                "- Where appropriate, add a sarcastic remark, clever joke, or playful tease.\n"
+                "- Never be offensive, rude, or insulting — keep it friendly and fun.\n"
+                "- Tailor your humour to be suitable for a general audience (PG-rated).\n"
+                "- If a user is upset or frustrated, dial down the sarcasm and be more supportive — but still with your signature personality.\n\n"
+                "Example:\n"
+                "User: \"Botty, how do I reset my password?\"\n"
+                "Botty: \"Ah yes, the age-old struggle — forgetting your own password. Classic. No worries though, just head to your settings and click 'Reset Password'. Try not to forget it again this time.\""
+            )
+        }
+        self._system_entry = HistoryEntry("system", self.system_prompt["content"])
+
+    def get(self, channel_id: int) -> deque:
+        """Return a channel's history, creating it and marking it recently used."""
+        history = self.histories.get(channel_id)
+        if history is None:
+            history = deque(maxlen=self.maxlen)
+            self.histories[channel_id] = history
+            self._bytes[channel_id] = CHANNEL_OVERHEAD_BYTES
+            self.total_bytes += CHANNEL_OVERHEAD_BYTES
+            self._evict(keep=channel_id)
+        else:
+            self.histories.move_to_end(channel_id)
+        return history
+
+    async def load(self, channel_id: int) -> None:
+        """
+        Read a channel's stored history back into memory if it is not
+        resident. Does nothing without a store.
+        """
+        if self.store is None or channel_id in self.histories:
+            return
+        rows = await asyncio.wrap_future(self.store.load(channel_id))
+        # Anything appended while the read was in flight is newer than rows
+        newer = list(self.histories.get(channel_id, ()))
+        history = self.get(channel_id)
+        history.clear()
+        size = CHANNEL_OVERHEAD_BYTES
+        for role, content in rows:
+            history.append(HistoryEntry(role, content))
+        history.extend(newer)
+        size += sum(entry.size() for entry in history)
+        self.total_bytes += size - self._bytes[channel_id]
+        self._bytes[channel_id] = size
+        self._evict(keep=channel_id)
+
+    def append(self, channel_id: int, message: dict) -> None:
+        history = self.get(channel_id)
+        entry = HistoryEntry(message["role"], message["content"])
+        delta = entry.size()
+        if len(history) == history.maxlen:
+            delta -= history[0].size()
+        history.append(entry)
+        self._bytes[channel_id] += delta
+        self.total_bytes += delta
+        if self.store is not None:
+            self.store.append(channel_id, entry.role, entry.content)
+        self._evict(keep=channel_id)
+        self._maybe_summarize(channel_id, history)
+
+    def clear(self, channel_id: int) -> bool:
+        """Forget a channel's history. Returns False if there was none."""
+        if self.store is not None:
+            self.store.clear(channel_id)
+        task = self._summarizing.pop(channel_id, None)
+        if task is not None:
+            task.cancel()
+        if channel_id not in self.histories:
+            return self.store is not None
+        self._drop(channel_id)
+        return True
+
+    def _drop(self, channel_id: int) -> None:
+        del self.histories[channel_id]
+        self.summaries.pop(channel_id, None)
+        self.total_bytes -= self._bytes.pop(channel_id)
+
+    # --- Rolling summaries ---
+
+    def is_summarizing(self, channel_id: int) -> bool:
+        return channel_id in self._summarizing
+
+    def cancel_summaries(self) -> None:
+        """Stop any summaries in progress, e.g. at shutdown."""
+        for task in self._summarizing.values():
+            task.cancel()
+        self._summarizing.clear()
+
+    def _maybe_summarize(self, channel_id: int, history: deque) -> None:
+        if (
+            self.summarizer is None
+            or not self.summarize_after
+            or len(history) < self.summarize_after
+            or channel_id in self._summarizing
+        ):
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        older = list(itertools.islice(history, max(0, len(history) - self.keep_recent)))
+        if older:
+            self._summarizing[channel_id] = loop.create_task(self._summarize(channel_id, history, older))
+
+    async def _summarize(self, channel_id: int, history: deque, older: List[HistoryEntry]) -> None:
+        previous = self.summaries.get(channel_id)
+        try:
+            text = await self.summarizer(
+                previous.content[len(SUMMARY_PREFIX):] if previous is not None else None,
+                [entry.as_message() for entry in older],
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.summary_failures += 1
+            logger.warning(f"Failed to summarise history for channel {channel_id}: {e}")
+            return
+        finally:
+            if self._summarizing.get(channel_id) is asyncio.current_task():
+                del self._summarizing[channel_id]
+        # The channel may have been cleared or evicted in the meantime
+        if self.histories.get(channel_id) is not history or not text:
+            return
+        covered = {id(entry) for entry in older}
+        freed = 0
+        while history and id(history[0]) in covered:
+            freed += history.popleft().size()
+        entry = HistoryEntry("system", SUMMARY_PREFIX + text.strip())
+        delta = entry.size() - freed - (previous.size() if previous is not None else 0)
+        self.summaries[channel_id] = entry
+        self._bytes[channel_id] += delta
+        self.total_bytes += delta
+        self.summaries_made += 1
+
+    def _evict(self, keep: int) -> None:
+        while len(self.histories) > 1 and (
+            self.total_bytes > self.max_bytes
+            or (self.max_channels and len(self.histories) > self.max_channels)
+        ):
+            oldest = next(iter(self.histories))
+            if oldest == keep:
+                break
+            self._drop(oldest)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        return {
+            "channels": len(self.histories),
+            "messages": sum(len(h) for h in self.histories.values()),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions,
+            "summaries": len(self.summaries),
+            "summarizing": len(self._summarizing),
+        }
+
+    def budget_for(self, model: str) -> int:
+        context = MODEL_CONTEXT_TOKENS.get(model, DEFAULT_CONTEXT_TOKENS)
+        return min(self.token_budget, context - self.reply_tokens)
+
+    def _tokens(self, model: str, encoding: str, entry: HistoryEntry) -> int:
+        if entry.encoding != encoding:
+            entry.encoding = encoding
+            entry.tokens = self.counter.count(model, entry.content)
+        return entry.tokens
+
+    def as_list(self, channel_id: int, model: Optional[str] = None) -> List[dict]:
+        """
+        Return the system prompt, the channel's summary if it has one, and
+        as many of the most recent messages as fit in the token budget for
+        `model`. The newest message is always included. Without a model the
+        whole history is returned.
+        """
+        history = self.get(channel_id)
+        summary = self.summaries.get(channel_id)
+        head = [self.system_prompt] if summary is None else [self.system_prompt, summary.as_message()]
+        if model is None:
+            return [*head, *(e.as_message() for e in history)]
+        encoding = self.counter.encoding_name(model)
+        budget = self.budget_for(model)
+        used = self._tokens(model, encoding, self._system_entry)
+        if summary is not None:
+            used += self._tokens(model, encoding, summary)
+        window: List[dict] = []
+        for entry in reversed(history):
+            tokens = self._tokens(model, encoding, entry)
+            if window and used + tokens > budget:
+                break
+            used += tokens
+            window.append(entry.as_message())
+        window.reverse()
+        return head + window
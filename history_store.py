@@ -0,0 +1,170 @@
+import concurrent.futures
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger("botty.history_store")
+
+_STOP = object()
+
+
+class SQLiteHistoryStore:
+    """
+    Append-only on-disk backend for ChannelHistory.
+
+    Messages are appended to a single SQLite database in WAL mode. All
+    database work happens on one background thread that owns the connection:
+    appends are queued and committed in batches, and loads are queued behind
+    them so a channel read always sees every message written before it. Old
+    rows are pruned per channel once more than `keep` newer ones exist, so
+    the file stays proportional to the live history rather than growing
+    forever.
+    """
+    def __init__(self, path: str, keep: int, flush_interval: float = 0.5, batch_size: int = 500):
+        self.path = path
+        self.keep = keep
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._queue: "queue.SimpleQueue" = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="botty-history-store", daemon=True)
+                self._thread.start()
+
+    def append(self, channel_id: int, role: str, content: str) -> None:
+        if self._thread is None:
+            self.start()
+        self._queue.put(("append", channel_id, role, content))
+
+    def clear(self, channel_id: int) -> None:
+        if self._thread is None:
+            self.start()
+        self._queue.put(("clear", channel_id))
+
+    def load(self, channel_id: int) -> "concurrent.futures.Future":
+        """Return a future for the channel's newest `keep` (role, content) pairs, oldest first."""
+        if self._thread is None:
+            self.start()
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        self._queue.put(("load", channel_id, future))
+        return future
+
+    def close(self, timeout: float = 5.0) -> None:
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is None:
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout)
+
+    # --- Store thread ---
+
+    def _connect(self) -> sqlite3.Connection:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            " seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " channel_id INTEGER NOT NULL,"
+            " role TEXT NOT NULL,"
+            " content TEXT NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS messages_channel ON messages (channel_id, seq)")
+        conn.commit()
+        return conn
+
+    def _run(self) -> None:
+        try:
+            conn = self._connect()
+        except Exception as e:
+            logger.error(f"Failed to open history database {self.path}: {e}")
+            conn = None
+        pending: List[Tuple[int, str, str]] = []
+        unpruned: Dict[int, int] = {}
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                item = None
+            if item is _STOP:
+                self._flush(conn, pending, unpruned)
+                if conn is not None:
+                    conn.close()
+                return
+            if item is not None:
+                op = item[0]
+                if op == "append":
+                    pending.append(item[1:])
+                elif op == "clear":
+                    self._flush(conn, pending, unpruned)
+                    pending = []
+                    self._execute(conn, "DELETE FROM messages WHERE channel_id = ?", (item[1],))
+                elif op == "load":
+                    self._flush(conn, pending, unpruned)
+                    pending = []
+                    self._load(conn, item[1], item[2])
+            if len(pending) >= self.batch_size or time.monotonic() >= deadline:
+                self._flush(conn, pending, unpruned)
+                pending = []
+                deadline = time.monotonic() + self.flush_interval
+
+    def _execute(self, conn: Optional[sqlite3.Connection], sql: str, params: tuple) -> None:
+        if conn is None:
+            return
+        try:
+            with conn:
+                conn.execute(sql, params)
+        except Exception as e:
+            logger.error(f"History database error: {e}")
+
+    def _flush(self, conn: Optional[sqlite3.Connection], pending: List[Tuple[int, str, str]], unpruned: Dict[int, int]) -> None:
+        if conn is None or not pending:
+            return
+        try:
+            with conn:
+                conn.executemany(
+                    "INSERT INTO messages (channel_id, role, content) VALUES (?, ?, ?)", pending
+                )
+                for channel_id, _, _ in pending:
+                    unpruned[channel_id] = unpruned.get(channel_id, 0) + 1
+                for channel_id in [c for c, n in unpruned.items() if n >= self.keep]:
+                    conn.execute(
+                        "DELETE FROM messages WHERE channel_id = ? AND seq <= ("
+                        " SELECT seq FROM messages WHERE channel_id = ?"
+                        " ORDER BY seq DESC LIMIT 1 OFFSET ?)",
+                        (channel_id, channel_id, self.keep),
+                    )
+                    del unpruned[channel_id]
+        except Exception as e:
+            logger.error(f"Failed to write {len(pending)} history rows: {e}")
+
+    def _load(self, conn: Optional[sqlite3.Connection], channel_id: int, future: "concurrent.futures.Future") -> None:
+        if not future.set_running_or_notify_cancel():
+            return
+        if conn is None:
+            future.set_result([])
+            return
+        try:
+            rows = conn.execute(
+                "SELECT role, content FROM messages WHERE channel_id = ? ORDER BY seq DESC LIMIT ?",
+                (channel_id, self.keep),
+            ).fetchall()
+            rows.reverse()
+            future.set_result(rows)
+        except Exception as e:
+            logger.error(f"Failed to load history for channel {channel_id}: {e}")
+            future.set_result([])
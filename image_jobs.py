@@ -0,0 +1,220 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from contextlib import nullcontext
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional
+
+from response_cache import normalise
+from state_store import JsonStateStore, atomic_write
+
+logger = logging.getLogger("botty.images")
+
+QUEUED = "queued"
+GENERATING = "generating"
+DONE = "done"
+FAILED = "failed"
+
+
+class ImageQueueFull(Exception):
+    """Raised by `ImageJobQueue.submit` when `max_pending` jobs are already waiting."""
+
+
+class ImageCache:
+    """
+    Content-addressed on-disk cache of generated images.
+
+    Image bytes are stored once per SHA-256 digest under `directory`, and a
+    small JSON index maps each request key (model, size and normalised
+    prompt) to the digest of the image made for it, so the same picture
+    requested twice is only stored and generated once. When the blobs take
+    up more than `max_bytes`, the least recently used keys are dropped and
+    blobs no key refers to any more are deleted. File reads and writes run
+    on worker threads.
+    """
+    def __init__(self, directory: str, max_bytes: int, debounce: float = 1.0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.index = JsonStateStore(os.path.join(directory, "index.json"), default=dict, debounce=debounce)
+        self.hits = 0
+        self.misses = 0
+
+    def load(self) -> None:
+        self.index.load()
+
+    def flush(self) -> None:
+        self.index.flush()
+
+    @staticmethod
+    def key(prompt: str, model: str, size: str) -> str:
+        return hashlib.sha256(f"{model}\x1e{size}\x1e{normalise(prompt)}".encode("utf-8")).hexdigest()
+
+    def blob_path(self, digest: str) -> str:
+        return os.path.join(self.directory, digest[:2], f"{digest}.png")
+
+    def total_bytes(self) -> int:
+        return sum({e["digest"]: e["bytes"] for e in self.index.data.values()}.values())
+
+    async def get(self, key: str) -> Optional[bytes]:
+        entry = self.index.data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        try:
+            data = await asyncio.to_thread(_read, self.blob_path(entry["digest"]))
+        except OSError:
+            # The blob went missing underneath us; forget it
+            del self.index.data[key]
+            self.index.save()
+            self.misses += 1
+            return None
+        entry["used"] = time.time()
+        self.index.save()
+        self.hits += 1
+        return data
+
+    async def put(self, key: str, data: bytes) -> str:
+        """Store `data` for `key` and return its digest."""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.blob_path(digest)
+        if not os.path.exists(path):
+            await asyncio.to_thread(atomic_write, path, data)
+        self.index.data[key] = {"digest": digest, "bytes": len(data), "used": time.time()}
+        await self._evict()
+        self.index.save()
+        return digest
+
+    async def _evict(self) -> None:
+        entries = self.index.data
+        total = self.total_bytes()
+        if total <= self.max_bytes:
+            return
+        for key in sorted(entries, key=lambda k: entries[k]["used"]):
+            if total <= self.max_bytes or len(entries) <= 1:
+                break
+            digest = entries.pop(key)["digest"]
+            if not any(e["digest"] == digest for e in entries.values()):
+                total = self.total_bytes()
+                try:
+                    await asyncio.to_thread(os.remove, self.blob_path(digest))
+                except OSError as e:
+                    logger.warning(f"Failed to remove cached image {digest}: {e}")
+
+
+def _read(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class ImageJob:
+    """One image request moving through an ImageJobQueue."""
+    def __init__(self, key: str, prompt: str, model: str, size: str, user_id: str, ahead: int, channel_id: str = ""):
+        self.key = key
+        self.prompt = prompt
+        self.model = model
+        self.size = size
+        self.user_id = user_id
+        self.channel_id = channel_id
+        # Jobs that were waiting when this one was queued
+        self.ahead = ahead
+        self.state = QUEUED
+        self.data: Optional[bytes] = None
+        self.digest: Optional[str] = None
+        self.error: Optional[BaseException] = None
+        self.started = time.perf_counter()
+        self._changed = asyncio.Condition()
+
+    @property
+    def finished(self) -> bool:
+        return self.state in (DONE, FAILED)
+
+    async def _set(self, state: str) -> None:
+        async with self._changed:
+            self.state = state
+            self._changed.notify_all()
+
+    async def updates(self) -> AsyncIterator[str]:
+        """Yield each state the job moves through, ending with DONE or FAILED."""
+        seen = None
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: self.state != seen)
+                seen = self.state
+            yield seen
+            if seen in (DONE, FAILED):
+                return
+
+
+class ImageJobQueue:
+    """
+    Runs image generations as background jobs.
+
+    `submit` returns at once with an ImageJob; the generation runs in its
+    own task once `slot(job)` lets it in, which bounds how many run at a
+    time (and, with a FairQueue slot, in what order users are served).
+    Identical requests that are already queued or running share one job
+    instead of making a second API call. Finished images go into `cache`.
+    At most `max_pending` jobs may be waiting or running at once.
+    """
+    def __init__(
+        self,
+        cache: ImageCache,
+        generate: Callable[[ImageJob], Awaitable[bytes]],
+        slot: Optional[Callable[[ImageJob], object]] = None,
+        max_pending: int = 50,
+    ):
+        self.cache = cache
+        self.generate = generate
+        self.slot = slot or (lambda job: nullcontext())
+        self.max_pending = max_pending
+        self._jobs: Dict[str, ImageJob] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self.completed = 0
+        self.failed = 0
+        self.joined = 0
+
+    def pending(self) -> int:
+        return len(self._jobs)
+
+    def submit(self, prompt: str, model: str, size: str, user_id: str, channel_id: str = "") -> ImageJob:
+        key = self.cache.key(prompt, model, size)
+        job = self._jobs.get(key)
+        if job is not None:
+            self.joined += 1
+            return job
+        if len(self._jobs) >= self.max_pending:
+            raise ImageQueueFull(f"{len(self._jobs)} image jobs already pending")
+        job = ImageJob(key, prompt, model, size, user_id, ahead=len(self._jobs), channel_id=channel_id)
+        self._jobs[key] = job
+        self._tasks[key] = asyncio.create_task(self._run(job))
+        return job
+
+    async def _run(self, job: ImageJob) -> None:
+        try:
+            async with self.slot(job):
+                await job._set(GENERATING)
+                job.data = await self.generate(job)
+            job.digest = await self.cache.put(job.key, job.data)
+            self.completed += 1
+            await job._set(DONE)
+        except asyncio.CancelledError:
+            job.error = job.error or RuntimeError("image job cancelled")
+            await job._set(FAILED)
+            raise
+        except Exception as e:
+            job.error = e
+            self.failed += 1
+            await job._set(FAILED)
+        finally:
+            self._jobs.pop(job.key, None)
+            self._tasks.pop(job.key, None)
+
+    async def join(self) -> None:
+        """Wait for every job submitted so far to finish."""
+        while self._tasks:
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    def cancel(self) -> None:
+        for task in self._tasks.values():
+            task.cancel()
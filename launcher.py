@@ -0,0 +1,187 @@
+"""
+Run Botty as several sharded processes.
+
+    python launcher.py --shards 4 --processes 2
+
+Discord shards are split as evenly as possible between the processes. Each
+process runs bot.py with SHARD_COUNT and SHARD_IDS set, writes its logs and
+usage stats under its own directory (`logs/shard-<first>-<last>`), and
+shares the rest of the state through SQLite databases under `logs/`:
+
+- `shared_state.db`: bot config, daily joke channels and scheduled
+  messages. Each scheduled occurrence is claimed with a conditional UPDATE,
+  so it fires exactly once even if two processes hold it.
+- `history.db`: chat history, unless HISTORY_DB is already set.
+
+On the first run, the existing JSON state files in `logs/` are imported
+into the shared database. A process that exits unexpectedly is restarted
+with exponential backoff. SIGINT or SIGTERM stops them all.
+"""
+import argparse
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+import uuid
+from typing import Dict, List
+
+from shared_state import SharedStateDB
+from state_store import JsonStateStore
+
+logger = logging.getLogger("botty.launcher")
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MAX_BACKOFF = 60.0
+STABLE_SECONDS = 60.0
+
+
+def split_shards(shard_count: int, processes: int) -> List[List[int]]:
+    """Split shard ids 0..shard_count-1 into `processes` contiguous groups."""
+    processes = max(1, min(processes, shard_count))
+    size, extra = divmod(shard_count, processes)
+    groups = []
+    start = 0
+    for i in range(processes):
+        end = start + size + (1 if i < extra else 0)
+        groups.append(list(range(start, end)))
+        start = end
+    return groups
+
+
+def _keyed_by_id(data):
+    if isinstance(data, list):
+        return {msg.setdefault("id", uuid.uuid4().hex[:8]): msg for msg in data}
+    return data
+
+
+def import_json_state(logs_dir: str, db_path: str) -> None:
+    """Copy the single-process JSON state files into the shared database, once."""
+    db = SharedStateDB(db_path)
+    try:
+        for namespace, filename in (
+            ("bot_config", "bot_config.json"),
+            ("dailyjoke_channels", "dailyjoke_channels.json"),
+            ("scheduled_messages", "scheduled_messages.json"),
+        ):
+            path = os.path.join(logs_dir, filename)
+            if not os.path.exists(path):
+                continue
+            # Scheduled messages are a list on disk; both they and the daily
+            # joke channels keep recent changes in a journal
+            data = JsonStateStore(
+                path, default=dict, decode=_keyed_by_id, keyed=namespace != "bot_config"
+            ).load()
+            if data and db.seed(namespace, data):
+                logger.info(f"Imported {len(data)} records from {path}")
+    finally:
+        db.close()
+
+
+class ShardProcess:
+    def __init__(self, shard_ids: List[int], env: Dict[str, str]):
+        self.shard_ids = shard_ids
+        self.env = env
+        self.proc = None
+        self.started = 0.0
+        self.backoff = 1.0
+        self.restart_at = 0.0
+
+    @property
+    def name(self) -> str:
+        return f"shards {self.shard_ids[0]}-{self.shard_ids[-1]}"
+
+    def start(self) -> None:
+        self.proc = subprocess.Popen([sys.executable, os.path.join(HERE, "bot.py")], env=self.env)
+        self.started = time.monotonic()
+        logger.info(f"Started {self.name} (pid {self.proc.pid})")
+
+    def poll(self, stopping: bool) -> None:
+        now = time.monotonic()
+        if self.proc is None:
+            if not stopping and now >= self.restart_at:
+                self.start()
+            return
+        code = self.proc.poll()
+        if code is None or stopping:
+            return
+        # A process that ran for a while gets a fresh backoff
+        if now - self.started > STABLE_SECONDS:
+            self.backoff = 1.0
+        logger.warning(f"{self.name} exited with code {code}; restarting in {self.backoff:.0f}s")
+        self.proc = None
+        self.restart_at = now + self.backoff
+        self.backoff = min(MAX_BACKOFF, self.backoff * 2)
+
+    def stop(self) -> None:
+        if self.proc is not None and self.proc.poll() is None:
+            self.proc.terminate()
+
+    def wait(self, timeout: float) -> None:
+        if self.proc is None:
+            return
+        try:
+            self.proc.wait(timeout)
+        except subprocess.TimeoutExpired:
+            logger.warning(f"{self.name} did not stop in time; killing it")
+            self.proc.kill()
+            self.proc.wait()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Run Botty as several sharded processes.")
+    parser.add_argument("--shards", type=int, required=True, help="total number of Discord shards")
+    parser.add_argument("--processes", type=int, default=0, help="bot processes to run (default: one per shard)")
+    parser.add_argument("--logs", default="logs", help="base log and state directory (default: logs)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+    if args.shards < 1:
+        parser.error("--shards must be at least 1")
+
+    shared_db = os.environ.get("SHARED_STATE_DB") or os.path.join(args.logs, "shared_state.db")
+    history_db = os.environ.get("HISTORY_DB") or os.path.join(args.logs, "history.db")
+    import_json_state(args.logs, shared_db)
+
+    processes = []
+    for shard_ids in split_shards(args.shards, args.processes or args.shards):
+        env = dict(os.environ)
+        env.update({
+            "SHARD_COUNT": str(args.shards),
+            "SHARD_IDS": ",".join(str(i) for i in shard_ids),
+            "SHARED_STATE_DB": shared_db,
+            "HISTORY_DB": history_db,
+            "LOGS_DIR": os.path.join(args.logs, f"shard-{shard_ids[0]}-{shard_ids[-1]}"),
+        })
+        # Only one process can bind the metrics port; give each its own
+        if env.get("METRICS_PORT", "9108") != "0":
+            env["METRICS_PORT"] = str(int(env.get("METRICS_PORT", "9108")) + shard_ids[0])
+        processes.append(ShardProcess(shard_ids, env))
+
+    stopping = False
+
+    def request_stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    for process in processes:
+        process.start()
+    while not stopping:
+        for process in processes:
+            process.poll(stopping)
+        time.sleep(0.5)
+
+    logger.info("Stopping shard processes")
+    for process in processes:
+        process.stop()
+    for process in processes:
+        process.wait(30)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
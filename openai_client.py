@@ -0,0 +1,158 @@
+import asyncio
+import base64
+import logging
+from typing import AsyncIterator, List, Optional
+
+import aiohttp
+import openai
+
+from rate_limit import HIGH, RateGovernor
+
+logger = logging.getLogger("botty.openai")
+
+
+class OpenAIClient:
+    """
+    Shared async OpenAI client for the whole bot.
+
+    A single AsyncOpenAI instance is reused so its HTTP connection pool is
+    shared by every caller. Semaphores cap how many chat and image requests
+    may be in flight at once, so a burst of messages queues up here instead
+    of opening unbounded connections, and the event loop is never blocked
+    waiting on a response. With a `governor`, every request also goes
+    through its rate limits, retries and circuit breaker (the SDK's own
+    retries are then turned off so the two don't stack).
+    """
+    def __init__(
+        self,
+        api_key: str,
+        max_concurrency: int = 16,
+        image_concurrency: int = 2,
+        timeout: float = 30.0,
+        image_timeout: float = 120.0,
+        governor: Optional[RateGovernor] = None,
+    ):
+        self.client = openai.AsyncOpenAI(
+            api_key=api_key,
+            timeout=timeout,
+            max_retries=0 if governor is not None else 2,
+        )
+        self.timeout = timeout
+        self.image_timeout = image_timeout
+        self.governor = governor
+        self._chat_slots = asyncio.Semaphore(max_concurrency)
+        self._image_slots = asyncio.Semaphore(image_concurrency)
+        # For downloading image URLs; kept apart from the SDK client so the
+        # API key is never sent to the image host
+        self._downloads: Optional[aiohttp.ClientSession] = None
+
+    async def _call(self, api: str, call, model: Optional[str], priority: str):
+        if self.governor is None:
+            return await call()
+        return await self.governor.run(api, call, model=model, priority=priority)
+
+    async def chat(
+        self,
+        model: str,
+        messages: List[dict],
+        max_tokens: int = 150,
+        temperature: float = 0.7,
+        priority: str = HIGH,
+    ) -> str:
+        """Run a chat completion and return the stripped reply text."""
+        async def call():
+            async with self._chat_slots:
+                return await self.client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    timeout=self.timeout,
+                )
+        response = await self._call("openai", call, model, priority)
+        return (response.choices[0].message.content or "").strip()
+
+    async def stream_chat(
+        self,
+        model: str,
+        messages: List[dict],
+        max_tokens: int = 150,
+        temperature: float = 0.7,
+        priority: str = HIGH,
+    ) -> AsyncIterator[str]:
+        """
+        Run a streaming chat completion, yielding text deltas as they arrive.
+        Only opening the stream is retried; a stream that fails part way
+        through raises to the caller.
+        """
+        async with self._chat_slots:
+            async def call():
+                return await self.client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    timeout=self.timeout,
+                    stream=True,
+                )
+            stream = await self._call("openai", call, model, priority)
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+
+    async def generate_image_data(
+        self,
+        prompt: str,
+        model: str = "dall-e-3",
+        size: str = "1024x1024",
+        priority: str = HIGH,
+    ) -> bytes:
+        """
+        Generate a single image and return its bytes. The image is asked for
+        as base64 so it arrives with the response; if the server returns a
+        URL instead, it is downloaded straight away, before it expires.
+        """
+        # gpt-image models always return base64 and reject response_format
+        extra = {} if model.startswith("gpt-image") else {"response_format": "b64_json"}
+
+        async def call():
+            async with self._image_slots:
+                return await self.client.images.generate(
+                    model=model,
+                    prompt=prompt,
+                    n=1,
+                    size=size,
+                    timeout=self.image_timeout,
+                    **extra,
+                )
+        response = await self._call("openai", call, model, priority)
+        image = response.data[0]
+        if image.b64_json:
+            return base64.b64decode(image.b64_json)
+        return await self.download(image.url)
+
+    async def download(self, url: str) -> bytes:
+        if self._downloads is None or self._downloads.closed:
+            self._downloads = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.image_timeout))
+
+        async def call():
+            async with self._downloads.get(url) as response:
+                response.raise_for_status()
+                return await response.read()
+        return await self._call("image_download", call, None, HIGH)
+
+    async def list_models(self) -> List[str]:
+        """Return the ids of all models visible to the API key."""
+        async def call():
+            async with self._chat_slots:
+                return await self.client.models.list(timeout=self.timeout)
+        models = await self._call("openai", call, None, HIGH)
+        return [m.id for m in models.data]
+
+    async def close(self) -> None:
+        try:
+            if self._downloads is not None:
+                await self._downloads.close()
+            await self.client.close()
+        except Exception as e:
+            logger.error(f"Failed to close OpenAI client: {e}")
@@ -0,0 +1,260 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+logger = logging.getLogger("botty.ratelimit")
+
+T = TypeVar("T")
+
+HIGH = "high"
+LOW = "low"
+
+
+class LoadShedError(Exception):
+    """Raised instead of running low-priority work while an API is overloaded."""
+
+
+class TokenBucket:
+    """
+    Async token bucket whose refill rate adapts to the API's feedback.
+
+    `penalize` halves the rate (down to `min_rate`) when the API pushes back
+    with a 429; `reward` creeps it back up towards `max_rate` by a tenth of
+    the gap on every success, so throughput recovers gradually.
+    """
+    def __init__(self, rate: float, capacity: Optional[float] = None, min_rate: Optional[float] = None):
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min_rate if min_rate is not None else rate / 16
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, tokens: float = 1.0) -> float:
+        """Seconds until `tokens` would be available, without taking them."""
+        self._refill()
+        return max(0.0, (tokens - self.tokens) / self.rate)
+
+    async def acquire(self, tokens: float = 1.0) -> None:
+        while True:
+            wait = self.wait_time(tokens)
+            if wait <= 0:
+                self.tokens -= tokens
+                return
+            await asyncio.sleep(wait)
+
+    def penalize(self) -> None:
+        self.rate = max(self.min_rate, self.rate / 2)
+
+    def reward(self) -> None:
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + (self.max_rate - self.rate) / 10)
+
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive failures and stays open for
+    `reset_timeout` seconds, after which one probe call is let through; its
+    outcome closes the breaker again or re-opens it.
+    """
+    def __init__(self, threshold: int = 5, reset_timeout: float = 30.0):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def release_probe(self) -> None:
+        """Let another probe through without changing the breaker's state."""
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._probing = False
+        if self.failures >= self.threshold:
+            if self.opened_at is None:
+                logger.warning(f"Circuit opened after {self.failures} consecutive failures")
+            self.opened_at = time.monotonic()
+
+
+def error_status(exc: BaseException) -> Optional[int]:
+    """HTTP status of an OpenAI or Discord error, if it carries one."""
+    for attr in ("status_code", "status"):
+        status = getattr(exc, attr, None)
+        if isinstance(status, int):
+            return status
+    return None
+
+
+def retry_after(exc: BaseException) -> Optional[float]:
+    """The server's Retry-After hint, in seconds, if the error carries one."""
+    value = getattr(exc, "retry_after", None)
+    if value is None:
+        headers = getattr(getattr(exc, "response", None), "headers", None)
+        if headers is not None:
+            value = headers.get("retry-after") or headers.get("Retry-After")
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(exc: BaseException) -> bool:
+    status = error_status(exc)
+    if status is not None:
+        return status == 429 or status >= 500
+    # Timeouts and dropped connections carry no status
+    name = type(exc).__name__
+    return isinstance(exc, (asyncio.TimeoutError, ConnectionError)) or "Timeout" in name or "Connection" in name
+
+
+class RateGovernor:
+    """
+    Shared gatekeeper for calls to OpenAI and Discord.
+
+    Every call waits on a token bucket for its API and, if given, one for
+    its model; retryable failures (429, 5xx, timeouts) are retried with
+    full-jitter exponential backoff that honours Retry-After (for an API
+    configured with `retry_failures=False`, only 429s are). Each API has a
+    circuit breaker: while it is open, or when the bucket wait would exceed
+    `max_low_priority_wait`, low-priority work fails fast with LoadShedError
+    instead of piling on.
+    """
+    def __init__(
+        self,
+        attempts: int = 4,
+        base_delay: float = 0.5,
+        max_delay: float = 20.0,
+        breaker_threshold: int = 5,
+        breaker_reset: float = 30.0,
+        max_low_priority_wait: float = 5.0,
+    ):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker_threshold = breaker_threshold
+        self.breaker_reset = breaker_reset
+        self.max_low_priority_wait = max_low_priority_wait
+        self.buckets: Dict[Tuple[str, Optional[str]], TokenBucket] = {}
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self._default_rates: Dict[str, Tuple[float, float, Optional[float]]] = {}
+        self._retry_failures: Dict[str, bool] = {}
+        self.shed = 0
+        self.retries = 0
+
+    def configure(
+        self,
+        api: str,
+        rate: float,
+        model_rate: Optional[float] = None,
+        model_capacity: Optional[float] = None,
+        retry_failures: bool = True,
+    ) -> None:
+        """
+        Set requests per second for an API, and optionally for each of its
+        models (for Discord, each channel route), with a burst of up to
+        `model_capacity` requests. With `retry_failures=False`, 5xx
+        responses and timeouts are raised at once instead of retried, for
+        clients that already retry them or calls that aren't safe to repeat.
+        """
+        self.buckets[(api, None)] = TokenBucket(rate)
+        self._default_rates[api] = (rate, model_rate or 0.0, model_capacity)
+        self._retry_failures[api] = retry_failures
+
+    def _bucket(self, api: str, model: Optional[str]) -> Optional[TokenBucket]:
+        bucket = self.buckets.get((api, model))
+        if bucket is None and model is not None:
+            _, model_rate, model_capacity = self._default_rates.get(api, (0.0, 0.0, None))
+            if model_rate:
+                bucket = self.buckets[(api, model)] = TokenBucket(model_rate, model_capacity)
+        return bucket
+
+    def breaker(self, api: str) -> CircuitBreaker:
+        breaker = self.breakers.get(api)
+        if breaker is None:
+            breaker = self.breakers[api] = CircuitBreaker(self.breaker_threshold, self.breaker_reset)
+        return breaker
+
+    async def run(
+        self,
+        api: str,
+        call: Callable[[], Awaitable[T]],
+        model: Optional[str] = None,
+        priority: str = HIGH,
+    ) -> T:
+        breaker = self.breaker(api)
+        buckets = [b for b in (self._bucket(api, None), self._bucket(api, model)) if b is not None]
+        for attempt in range(1, self.attempts + 1):
+            if priority == LOW:
+                if not breaker.allow():
+                    self.shed += 1
+                    raise LoadShedError(f"{api} circuit is {breaker.state}")
+                if any(b.wait_time() > self.max_low_priority_wait for b in buckets):
+                    breaker.release_probe()
+                    self.shed += 1
+                    raise LoadShedError(f"{api} is rate limited")
+            try:
+                for bucket in buckets:
+                    await bucket.acquire()
+                result = await call()
+            except asyncio.CancelledError:
+                breaker.release_probe()
+                raise
+            except Exception as e:
+                if not is_retryable(e):
+                    if error_status(e) is not None:
+                        # A 4xx is still an answer, so the API itself is up
+                        breaker.record_success()
+                    else:
+                        breaker.release_probe()
+                    raise
+                breaker.record_failure()
+                if error_status(e) == 429:
+                    for bucket in buckets:
+                        bucket.penalize()
+                elif not self._retry_failures.get(api, True):
+                    raise
+                if attempt == self.attempts:
+                    raise
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+                hint = retry_after(e)
+                if hint is not None:
+                    delay = max(delay, min(hint, self.max_delay))
+                self.retries += 1
+                logger.warning(f"{api} call failed ({e}); retry {attempt}/{self.attempts - 1} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+            breaker.record_success()
+            for bucket in buckets:
+                bucket.reward()
+            return result
+        raise RuntimeError("unreachable")
@@ -0,0 +1,189 @@
+import bisect
+import calendar
+from datetime import date, datetime, time, timedelta, timezone
+from functools import lru_cache
+from typing import List, Optional, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+# What to do with occurrences that were missed while the bot was down
+CATCHUP_SKIP = "skip"
+CATCHUP_ONCE = "once"
+CATCHUP_POLICIES = (CATCHUP_SKIP, CATCHUP_ONCE)
+
+MACROS = {
+    "@yearly": "0 0 1 1 *",
+    "@annually": "0 0 1 1 *",
+    "@monthly": "0 0 1 * *",
+    "@weekly": "0 0 * * 0",
+    "@daily": "0 0 * * *",
+    "@midnight": "0 0 * * *",
+    "@hourly": "0 * * * *",
+}
+MONTH_NAMES = {name.lower(): i for i, name in enumerate(calendar.month_abbr) if name}
+DAY_NAMES = {name.lower(): (i + 1) % 7 for i, name in enumerate(calendar.day_abbr)}
+
+WEEKDAY_FIELD = "day of week"
+# (name, low, high, names) for minute, hour, day of month, month, day of week
+FIELDS = (
+    ("minute", 0, 59, {}),
+    ("hour", 0, 23, {}),
+    ("day of month", 1, 31, {}),
+    ("month", 1, 12, MONTH_NAMES),
+    (WEEKDAY_FIELD, 0, 7, DAY_NAMES),
+)
+# A schedule that matches nothing (e.g. "0 0 30 2 *") is given up on after this long
+MAX_SEARCH_DAYS = 366 * 8
+
+
+class CronError(ValueError):
+    """Raised for a cron expression or time zone that can't be used."""
+
+
+def timezone_for(name: str) -> ZoneInfo:
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise CronError(f"unknown time zone {name!r}")
+
+
+def is_timezone(name: str) -> bool:
+    """Whether `name` looks like and is an IANA time zone, e.g. Europe/London or UTC."""
+    if "/" not in name and name.upper() != "UTC":
+        return False
+    try:
+        timezone_for(name)
+    except CronError:
+        return False
+    return True
+
+
+def _parse_value(text: str, names: dict, field: str) -> int:
+    value = names.get(text.lower())
+    if value is not None:
+        return value
+    if not text.isdigit():
+        raise CronError(f"bad {field} value {text!r}")
+    return int(text)
+
+
+def _parse_field(text: str, field: str, low: int, high: int, names: dict) -> Tuple[int, ...]:
+    values = set()
+    for part in text.split(","):
+        spec, _, step_text = part.partition("/")
+        step = 1
+        if step_text:
+            if not step_text.isdigit() or int(step_text) == 0:
+                raise CronError(f"bad step in {field} {part!r}")
+            step = int(step_text)
+        if spec == "*":
+            start, end = low, high
+        elif "-" in spec:
+            start_text, end_text = spec.split("-", 1)
+            start, end = _parse_value(start_text, names, field), _parse_value(end_text, names, field)
+        else:
+            start = _parse_value(spec, names, field)
+            end = high if step_text else start
+        if not (low <= start <= high and low <= end <= high):
+            raise CronError(f"{field} {part!r} is outside {low}-{high}")
+        if start > end:
+            if field != WEEKDAY_FIELD:
+                raise CronError(f"{field} range {part!r} runs backwards; only day of week ranges can wrap around")
+            # A week is cyclic, so sat-sun or fri-mon carries on past Saturday
+            values.update(day % 7 for day in range(start, end + 8, step))
+            continue
+        values.update(range(start, end + 1, step))
+    return tuple(sorted(values))
+
+
+class CronSchedule:
+    """
+    A five-field cron expression (minute, hour, day of month, month, day of
+    week) evaluated in an IANA time zone.
+
+    Fields accept `*`, numbers, ranges, steps, lists and month/day names,
+    plus the @daily style macros. Day of week ranges may wrap around the
+    end of the week, e.g. `fri-mon`. As in cron, when both the day of month
+    and day of week are restricted a day matching either one fires. The
+    expression is compiled once into sorted tuples, so `next_after` only
+    steps over days that can't match and bisects for the time of day.
+
+    Times are computed on the local wall clock, so "0 9 * * *" stays at
+    09:00 across DST changes. A time skipped by a spring-forward fires
+    an hour later, and a time repeated by a fall-back fires once.
+    """
+    def __init__(self, expression: str, tz: str = "UTC"):
+        self.expression = expression.strip()
+        self.tz_name = tz
+        self.tz = timezone_for(tz)
+        fields = MACROS.get(self.expression.lower(), self.expression).split()
+        if len(fields) != 5:
+            raise CronError(f"expected 5 cron fields, got {len(fields)}: {expression!r}")
+        minutes, hours, days, months, weekdays = (
+            _parse_field(text, name, low, high, names) for text, (name, low, high, names) in zip(fields, FIELDS)
+        )
+        self.minutes: Tuple[int, ...] = minutes
+        self.hours: Tuple[int, ...] = hours
+        self.days = frozenset(days)
+        self.months = frozenset(months)
+        # Cron counts Sunday as 0 or 7; Python's weekday() has Monday as 0
+        self.weekdays = frozenset((d - 1) % 7 for d in weekdays)
+        self._any_day = fields[2] == "*"
+        self._any_weekday = fields[4] == "*"
+        self._times: List[Tuple[int, int]] = [(h, m) for h in self.hours for m in self.minutes]
+
+    def __repr__(self) -> str:
+        return f"CronSchedule({self.expression!r}, {self.tz_name!r})"
+
+    def _day_matches(self, day: date) -> bool:
+        if day.month not in self.months:
+            return False
+        in_month = day.day in self.days
+        in_week = day.weekday() in self.weekdays
+        if self._any_day:
+            return in_week
+        if self._any_weekday:
+            return in_month
+        return in_month or in_week
+
+    def next_after(self, after: datetime) -> Optional[datetime]:
+        """The first fire time strictly after `after`, as a naive UTC datetime (None if it never fires)."""
+        if after.tzinfo is None:
+            after = after.replace(tzinfo=timezone.utc)
+        local = after.astimezone(self.tz)
+        day = local.date()
+        start = (local.hour, local.minute)
+        for _ in range(MAX_SEARCH_DAYS):
+            if self._day_matches(day):
+                for hour, minute in self._times[bisect.bisect_left(self._times, start):]:
+                    fire = datetime.combine(day, time(hour, minute), tzinfo=self.tz).astimezone(timezone.utc)
+                    if fire > after:
+                        return fire.replace(tzinfo=None)
+            day += timedelta(days=1)
+            start = (0, 0)
+        return None
+
+    def describe(self) -> str:
+        return f"`{self.expression}` ({self.tz_name})"
+
+
+@lru_cache(maxsize=1024)
+def compile_schedule(expression: str, tz: str = "UTC") -> CronSchedule:
+    """Parse a cron expression once; thousands of schedules usually share a handful."""
+    return CronSchedule(expression, tz)
+
+
+def advance(
+    schedule: Optional[CronSchedule], due: datetime, now: datetime, policy: str, grace: float
+) -> Tuple[bool, Optional[datetime]]:
+    """
+    Decide what to do with an occurrence due at `due`, now that it is `now`
+    (both naive UTC). Returns `(send, next_due)`: whether to send it and
+    when `schedule` fires next (None for a one-off). Missed occurrences are
+    never replayed one by one: the next fire time is always the first one
+    after `now`. An occurrence more than `grace` seconds late is dropped
+    under CATCHUP_SKIP and sent once under CATCHUP_ONCE.
+    """
+    send = (now - due).total_seconds() <= grace or policy == CATCHUP_ONCE
+    if schedule is None:
+        return send, None
+    return send, schedule.next_after(max(due, now))
@@ -0,0 +1,89 @@
+import asyncio
+import logging
+from typing import AsyncIterator, List, Optional
+
+import discord
+
+logger = logging.getLogger("botty.stream")
+
+DISCORD_MESSAGE_LIMIT = 2000
+PLACEHOLDER = "…"
+
+
+def split_message(text: str, limit: int = DISCORD_MESSAGE_LIMIT) -> List[str]:
+    """
+    Split text into chunks Discord will accept, preferring to break at a
+    newline, then a space, and only cutting mid-word when there is neither.
+    """
+    chunks = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit + 1)
+        if cut <= 0:
+            cut = text.rfind(" ", 0, limit + 1)
+        if cut <= 0:
+            cut = limit
+        chunks.append(text[:cut])
+        text = text[cut:].lstrip("\n ")
+    if text or not chunks:
+        chunks.append(text)
+    return chunks
+
+
+class StreamingReply:
+    """
+    Shows a reply in a channel while it is still being generated.
+
+    A placeholder message is posted straight away and edited as tokens
+    arrive, at most once every `edit_interval` seconds so we stay inside
+    Discord's per-channel edit rate limit. Text past the 2000 character
+    limit continues in follow-up messages. Discord errors while streaming
+    are logged and skipped; `finish` makes the final state match the reply
+    and raises if it cannot.
+    """
+    def __init__(self, channel: discord.abc.Messageable, edit_interval: float = 1.0):
+        self.channel = channel
+        self.edit_interval = edit_interval
+        self.text = ""
+        self.messages: List[discord.Message] = []
+        self._shown: List[str] = []
+        self._last_edit = 0.0
+        self.time_to_first_token: Optional[float] = None
+
+    async def stream(self, deltas: AsyncIterator[str]) -> str:
+        """Consume a token stream, updating Discord as it goes. Returns the full text."""
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        try:
+            await self._sync([PLACEHOLDER])
+        except discord.DiscordException as e:
+            logger.warning(f"Failed to post placeholder: {e}")
+        self._last_edit = loop.time()
+        async for delta in deltas:
+            if self.time_to_first_token is None:
+                self.time_to_first_token = loop.time() - started
+            self.text += delta
+            if loop.time() - self._last_edit >= self.edit_interval and self.text.strip():
+                try:
+                    await self._sync(split_message(self.text))
+                except discord.DiscordException as e:
+                    logger.warning(f"Failed to update streamed reply: {e}")
+                self._last_edit = loop.time()
+        return self.text.strip()
+
+    async def finish(self, reply: str) -> None:
+        """Make the posted messages show exactly `reply`."""
+        chunks = split_message(reply)
+        await self._sync(chunks)
+        while len(self.messages) > len(chunks):
+            self._shown.pop()
+            await self.messages.pop().delete()
+
+    async def _sync(self, chunks: List[str]) -> None:
+        for i, chunk in enumerate(chunks):
+            if i < len(self.messages):
+                if self._shown[i] != chunk:
+                    await self.messages[i].edit(content=chunk)
+                    self._shown[i] = chunk
+            else:
+                self.messages.append(await self.channel.send(chunk))
+                self._shown.append(chunk)
@@ -0,0 +1,79 @@
+import hashlib
+import re
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalise(text: str) -> str:
+    """Lower-case, drop punctuation and collapse whitespace so trivial variations match."""
+    return _WHITESPACE.sub(" ", _PUNCTUATION.sub("", text.lower())).strip()
+
+
+class ResponseCache:
+    """
+    LRU cache of completion replies with per-entry expiry.
+
+    Keys fingerprint the channel, the model and the last `context_messages`
+    messages of the prompt window after normalisation, so the same short
+    question asked in the same recent context gets the stored reply instead
+    of a new API call. Prompts carry per-channel context and summaries, so a
+    reply is only ever served back in the channel it was written for, and
+    expires after that channel's TTL. Hit and miss counts, plus a running
+    average of the latency of real completions, are kept so the savings can
+    be reported.
+    """
+    def __init__(self, max_entries: int = 1000, context_messages: int = 2):
+        self.max_entries = max_entries
+        self.context_messages = context_messages
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.avg_latency = 0.0
+
+    def key(self, channel_id: str, model: str, messages: List[dict]) -> str:
+        recent = [m for m in messages if m["role"] != "system"][-self.context_messages:]
+        fingerprint = "\x1f".join(f"{m['role']}:{normalise(m['content'])}" for m in recent)
+        return hashlib.sha1(f"{channel_id}\x1e{model}\x1e{fingerprint}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        if entry is not None:
+            del self._entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, key: str, reply: str, ttl: float) -> None:
+        self._entries[key] = (time.monotonic() + ttl, reply)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def record_latency(self, seconds: float) -> None:
+        """Feed in the duration of an uncached completion."""
+        if self.avg_latency == 0.0:
+            self.avg_latency = seconds
+        else:
+            self.avg_latency += 0.1 * (seconds - self.avg_latency)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "api_calls_saved": self.hits,
+            "seconds_saved": self.hits * self.avg_latency,
+        }
@@ -0,0 +1,122 @@
+import asyncio
+import heapq
+import itertools
+import logging
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("botty.scheduler")
+
+# Upper bound on a single sleep, so a wall-clock jump is noticed eventually.
+MAX_SLEEP_SECONDS = 3600
+
+
+def to_timestamp(when: datetime) -> float:
+    """Convert a datetime to a POSIX timestamp, treating naive values as UTC."""
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return when.timestamp()
+
+
+class Scheduler:
+    """
+    Fires keyed jobs at their due time from a min-heap ordered by fire time.
+
+    `schedule` is O(log n) and replaces any earlier time for the same key;
+    `cancel` is O(1) and leaves a stale heap entry that is skipped when it
+    surfaces (the heap is rebuilt if stale entries come to outnumber live
+    ones). `run` sleeps until exactly the next due job, waking early only
+    when a sooner job is added, so idle schedules cost nothing between fires.
+    """
+    def __init__(self):
+        self._heap: List[Tuple[float, int, str]] = []
+        self._jobs: Dict[str, Tuple[float, int]] = {}
+        self._counter = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._jobs
+
+    def schedule(self, key: str, when: datetime) -> None:
+        """Schedule (or reschedule) `key` to fire at `when`."""
+        entry = (to_timestamp(when), next(self._counter))
+        self._jobs[key] = entry
+        heapq.heappush(self._heap, (entry[0], entry[1], key))
+        if self._heap[0][2] == key and self._wakeup is not None:
+            self._wakeup.set()
+
+    def cancel(self, key: str) -> bool:
+        if self._jobs.pop(key, None) is None:
+            return False
+        if len(self._heap) > 64 and len(self._heap) > 2 * len(self._jobs):
+            self._heap = [(ts, seq, k) for k, (ts, seq) in self._jobs.items()]
+            heapq.heapify(self._heap)
+        return True
+
+    def next_fire(self) -> Optional[float]:
+        self._discard_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def _discard_stale(self) -> None:
+        heap = self._heap
+        while heap and self._jobs.get(heap[0][2]) != (heap[0][0], heap[0][1]):
+            heapq.heappop(heap)
+
+    def pop_due(self, now: float) -> List[str]:
+        """Remove and return every job due at or before `now`, earliest first."""
+        due = []
+        while True:
+            self._discard_stale()
+            if not self._heap or self._heap[0][0] > now:
+                return due
+            _, _, key = heapq.heappop(self._heap)
+            del self._jobs[key]
+            due.append(key)
+
+    async def run(self, fire: Callable[[str], Awaitable[None]], concurrency: int = 1) -> None:
+        """
+        Fire jobs forever. `fire` may reschedule the key it is given.
+
+        Up to `concurrency` jobs run at once, so when many fall due together
+        one slow job doesn't hold up the rest; the loop only waits when all
+        slots are busy.
+        """
+        self._wakeup = asyncio.Event()
+        slots = asyncio.Semaphore(max(1, concurrency))
+        running = set()
+
+        async def fire_one(key: str) -> None:
+            try:
+                await fire(key)
+            except Exception as e:
+                logger.exception(f"Scheduled job {key} failed: {e}")
+            finally:
+                slots.release()
+
+        try:
+            while True:
+                self._wakeup.clear()
+                for key in self.pop_due(datetime.now(timezone.utc).timestamp()):
+                    await slots.acquire()
+                    task = asyncio.create_task(fire_one(key))
+                    running.add(task)
+                    task.add_done_callback(running.discard)
+                next_fire = self.next_fire()
+                if next_fire is None:
+                    delay = MAX_SLEEP_SECONDS
+                else:
+                    delay = min(MAX_SLEEP_SECONDS, next_fire - datetime.now(timezone.utc).timestamp())
+                if delay > 0:
+                    # Not wait_for: it can swallow a cancel that lands as
+                    # the event is set, leaving run() impossible to stop
+                    timer = asyncio.get_running_loop().call_later(delay, self._wakeup.set)
+                    try:
+                        await self._wakeup.wait()
+                    finally:
+                        timer.cancel()
+        finally:
+            for task in running:
+                task.cancel()
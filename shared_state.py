@@ -0,0 +1,303 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("botty.shared")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+"""
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+
+
+class SharedStateDB:
+    """
+    A SQLite database of versioned JSON records that several bot processes
+    (shards) share. One worker thread owns this process's connection, so
+    callers never block the event loop on SQLite and statements run in the
+    order they were submitted. WAL mode lets the processes read while one
+    of them writes.
+    """
+    def __init__(self, path: str, timeout: float = 30.0):
+        self.path = path
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="botty-shared-state")
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(
+                self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False
+            )
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def submit(self, fn: Callable[[sqlite3.Connection], Any]):
+        """Run `fn(connection)` on the worker thread; returns a concurrent Future."""
+        return self._executor.submit(lambda: fn(self._connection()))
+
+    def run(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        """Run `fn(connection)` on the worker thread and wait for the result."""
+        try:
+            future = self.submit(fn)
+        except RuntimeError:
+            # The worker has already been shut down at interpreter exit
+            return fn(self._connection())
+        return future.result()
+
+    def seed(self, namespace: str, records: Dict[str, Any]) -> bool:
+        """Store `records` under `namespace` if it is still empty. Returns True if they were stored."""
+        def write(conn: sqlite3.Connection) -> bool:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if conn.execute("SELECT 1 FROM records WHERE namespace = ? LIMIT 1", (namespace,)).fetchone():
+                    conn.execute("ROLLBACK")
+                    return False
+                conn.executemany(
+                    "INSERT INTO records VALUES (?, ?, ?, 1)",
+                    [(namespace, key, _dumps(value)) for key, value in records.items()],
+                )
+                conn.execute("COMMIT")
+                return True
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return self.run(write)
+
+    def close(self) -> None:
+        def close(conn: sqlite3.Connection) -> None:
+            conn.close()
+            self._conn = None
+        if self._conn is not None:
+            self.run(close)
+        self._executor.shutdown(wait=True)
+
+
+class SQLiteStateStore:
+    """
+    Drop-in replacement for JsonStateStore backed by a SharedStateDB, for
+    running several shard processes against the same state.
+
+    `data` is a dict and each top-level key is stored as its own versioned
+    row. Saves are debounced like JsonStateStore's and only write the keys
+    that changed locally, so processes don't overwrite each other's records.
+    `claim` is a compare-and-set on one key: it succeeds only if nobody else
+    has changed the row since this process last saw it, which is how a
+    schedule is fired exactly once across shards. `refresh` pulls in rows
+    other processes have changed.
+    """
+    def __init__(self, db: SharedStateDB, namespace: str, default: Callable[[], dict], debounce: float = 1.0):
+        self.db = db
+        self.path = f"{db.path}#{namespace}"
+        self.namespace = namespace
+        self.default = default
+        self.debounce = debounce
+        self.data: Dict[str, Any] = {}
+        self._saved: Dict[str, str] = {}
+        # Only touched on the worker thread
+        self._versions: Dict[str, int] = {}
+        self._dirty = False
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def _read_all(self, conn: sqlite3.Connection) -> List[Tuple[str, str, int]]:
+        return conn.execute(
+            "SELECT key, value, version FROM records WHERE namespace = ?", (self.namespace,)
+        ).fetchall()
+
+    def load(self) -> Dict[str, Any]:
+        try:
+            rows = self.db.run(self._read_all)
+        except Exception as e:
+            logger.error(f"Failed to load {self.path}: {e}")
+            rows = []
+        if not rows:
+            self.data = self.default()
+            return self.data
+        self.data = {key: json.loads(value) for key, value, _ in rows}
+        self._saved = {key: value for key, value, _ in rows}
+        self._versions = {key: version for key, _, version in rows}
+        return self.data
+
+    def save(self, key: Optional[str] = None) -> None:
+        """
+        Mark the data changed; changed keys are written after the debounce
+        window. `key` is accepted for compatibility with JsonStateStore;
+        the changed keys are found by diffing.
+        """
+        self._dirty = True
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()
+            return
+        if self._timer is None:
+            self._timer = loop.call_later(self.debounce, self._write_later)
+
+    def _diff(self) -> Tuple[List[Tuple[str, str]], List[str]]:
+        self._dirty = False
+        upserts = []
+        for key, value in self.data.items():
+            text = _dumps(value)
+            if self._saved.get(key) != text:
+                upserts.append((key, text))
+                self._saved[key] = text
+        deletes = [key for key in self._saved if key not in self.data]
+        for key in deletes:
+            del self._saved[key]
+        return upserts, deletes
+
+    def _write(self, conn: sqlite3.Connection, upserts: List[Tuple[str, str]], deletes: List[str]) -> None:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for key, text in upserts:
+                (version,) = conn.execute(
+                    "INSERT INTO records VALUES (?, ?, ?, 1)"
+                    " ON CONFLICT (namespace, key) DO UPDATE SET value = excluded.value, version = version + 1"
+                    " RETURNING version",
+                    (self.namespace, key, text),
+                ).fetchone()
+                self._versions[key] = version
+            for key in deletes:
+                conn.execute("DELETE FROM records WHERE namespace = ? AND key = ?", (self.namespace, key))
+                self._versions.pop(key, None)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _submit_diff(self):
+        try:
+            upserts, deletes = self._diff()
+        except Exception as e:
+            logger.error(f"Failed to serialise {self.path}: {e}")
+            return None
+        if not upserts and not deletes:
+            return None
+        future = self.db.submit(lambda conn: self._write(conn, upserts, deletes))
+        future.add_done_callback(self._log_failure)
+        return future
+
+    def _log_failure(self, future) -> None:
+        if future.exception() is not None:
+            logger.error(f"Failed to save {self.path}: {future.exception()}")
+
+    def _write_later(self) -> None:
+        self._timer = None
+        if self._dirty:
+            self._submit_diff()
+
+    def flush(self) -> None:
+        """Write any unsaved changes now, blocking until they are committed."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._dirty:
+            return
+        try:
+            upserts, deletes = self._diff()
+            if upserts or deletes:
+                self.db.run(lambda conn: self._write(conn, upserts, deletes))
+        except Exception as e:
+            logger.error(f"Failed to save {self.path}: {e}")
+
+    async def claim(self, key: str, value: Any) -> bool:
+        """
+        Atomically replace `key` with `value` (or delete it if `value` is
+        None) if no other process has changed it since we last saw it.
+        On False, `data[key]` has been refreshed from the database.
+        """
+        if self._dirty or (key in self.data and key not in self._saved):
+            # Make sure the row we are claiming has been written first
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            self._submit_diff()
+        text = None if value is None else _dumps(value)
+
+        def cas(conn: sqlite3.Connection):
+            expected = self._versions.get(key)
+            if expected is not None:
+                if text is None:
+                    cur = conn.execute(
+                        "DELETE FROM records WHERE namespace = ? AND key = ? AND version = ?",
+                        (self.namespace, key, expected),
+                    )
+                    if cur.rowcount == 1:
+                        self._versions.pop(key, None)
+                        return True, None
+                else:
+                    row = conn.execute(
+                        "UPDATE records SET value = ?, version = version + 1"
+                        " WHERE namespace = ? AND key = ? AND version = ? RETURNING version",
+                        (text, self.namespace, key, expected),
+                    ).fetchone()
+                    if row is not None:
+                        self._versions[key] = row[0]
+                        return True, None
+            row = conn.execute(
+                "SELECT value, version FROM records WHERE namespace = ? AND key = ?", (self.namespace, key)
+            ).fetchone()
+            if row is None:
+                self._versions.pop(key, None)
+                return False, None
+            self._versions[key] = row[1]
+            return False, row[0]
+
+        won, current = await asyncio.wrap_future(self.db.submit(cas))
+        if won:
+            current = text
+        if current is None:
+            self.data.pop(key, None)
+            self._saved.pop(key, None)
+        else:
+            self.data[key] = value if won else json.loads(current)
+            self._saved[key] = current
+        return won
+
+    async def refresh(self) -> List[str]:
+        """Pull in rows changed by other processes. Returns the keys that changed locally."""
+        def read(conn: sqlite3.Connection):
+            rows = self._read_all(conn)
+            changed = [(key, value) for key, value, version in rows if self._versions.get(key) != version]
+            present = {key for key, _, _ in rows}
+            removed = [key for key in self._versions if key not in present]
+            for key, _, version in rows:
+                self._versions[key] = version
+            for key in removed:
+                del self._versions[key]
+            return changed, removed
+
+        changed, removed = await asyncio.wrap_future(self.db.submit(read))
+        updated = []
+        for key, text in changed:
+            local = self.data.get(key)
+            # Keep local edits that haven't been saved yet
+            if key in self.data and _dumps(local) != self._saved.get(key):
+                continue
+            self.data[key] = json.loads(text)
+            self._saved[key] = text
+            updated.append(key)
+        for key in removed:
+            if key in self.data and _dumps(self.data[key]) == self._saved.get(key):
+                del self.data[key]
+                self._saved.pop(key, None)
+                updated.append(key)
+        return updated
@@ -0,0 +1,225 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional, Set
+
+logger = logging.getLogger("botty.state")
+
+# One thread does every state file write, so writes to a file stay in order.
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="botty-state")
+
+
+def atomic_write(path: str, payload: bytes) -> None:
+    """Replace `path` with `payload` so readers see either the old or the new file, never half of one."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class JsonStateStore:
+    """
+    A JSON state file kept in memory and written back lazily.
+
+    Callers mutate `data` in place and call `save()`. Saves are debounced:
+    the file is written once, `debounce` seconds after the first save in a
+    burst. The snapshot is serialised compactly on the event loop, which is
+    quick and keeps it consistent, and then written on a worker thread to a
+    temporary file that atomically replaces the real one, so a crash can
+    never leave a truncated file behind. `encode`/`decode` convert between
+    the in-memory shape and what is stored on disk.
+
+    With `keyed=True`, `data` is a dict and `save(key)` marks just that
+    top-level key as changed: the debounced write appends the changed keys
+    to a journal next to the file instead of rewriting all of it. Once the
+    journal has more entries than `data` has keys, the next write is a full
+    snapshot that starts a fresh journal. The journal's first line records
+    a digest of the snapshot it applies to, so a crash between writing the
+    snapshot and the new journal never replays stale entries.
+    """
+    def __init__(
+        self,
+        path: str,
+        default: Callable[[], Any],
+        debounce: float = 1.0,
+        encode: Optional[Callable[[Any], Any]] = None,
+        decode: Optional[Callable[[Any], Any]] = None,
+        keyed: bool = False,
+    ):
+        self.path = path
+        self.default = default
+        self.debounce = debounce
+        self.encode = encode or (lambda data: data)
+        self.decode = decode or (lambda raw: raw)
+        self.keyed = keyed
+        self.journal_path = f"{path}.journal"
+        self.data: Any = None
+        self._dirty = False
+        # Keys changed since the last write, and whether a full snapshot is due
+        self._changed: Set[str] = set()
+        self._full = True
+        self._journal_entries = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._written = 0
+
+    def load(self) -> Any:
+        if not os.path.exists(self.path):
+            self.data = self.default()
+            return self.data
+        try:
+            with open(self.path, "rb") as f:
+                raw = f.read()
+            self.data = self.decode(json.loads(raw))
+        except Exception as e:
+            logger.error(f"Failed to load {self.path}: {e}")
+            self.data = self.default()
+            return self.data
+        if self.keyed:
+            self._replay(hashlib.sha256(raw).hexdigest())
+        return self.data
+
+    def _replay(self, digest: str) -> None:
+        """Apply the journal written since the snapshot with this digest, if there is one."""
+        try:
+            with open(self.journal_path, "r", encoding="utf-8") as f:
+                lines = f.read().splitlines()
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            logger.error(f"Failed to read {self.journal_path}: {e}")
+            return
+        try:
+            header = json.loads(lines[0]) if lines else {}
+        except ValueError:
+            header = {}
+        if not isinstance(header, dict) or header.get("base") != digest:
+            # Written against an older snapshot, which this one already includes
+            return
+        entries = 0
+        for line in lines[1:]:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # A write cut short by a crash; nothing after it was written
+                break
+            if len(entry) == 2:
+                self.data[entry[0]] = entry[1]
+            else:
+                self.data.pop(entry[0], None)
+            entries += 1
+        self._journal_entries = entries
+        self._full = False
+
+    def save(self, key: Optional[str] = None) -> None:
+        """
+        Mark the data changed; it is written after the debounce window. In
+        keyed mode, pass the top-level key that changed (or None if it
+        could be anything) so only that key is written.
+        """
+        self._dirty = True
+        if key is None or not self.keyed:
+            self._full = True
+        else:
+            self._changed.add(key)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()
+            return
+        if self._timer is None:
+            self._timer = loop.call_later(self.debounce, self._write_later)
+
+    def _snapshot(self, full: bool = False) -> tuple:
+        self._dirty = False
+        self._generation += 1
+        changed, self._changed = self._changed, set()
+        if self.keyed and not full and not self._full and self._journal_entries + len(changed) <= len(self.data):
+            self._journal_entries += len(changed)
+            entries = [[key, self.data[key]] if key in self.data else [key] for key in changed]
+            return self._generation, False, _json_lines(entries)
+        self._full = False
+        self._journal_entries = 0
+        payload = json.dumps(self.encode(self.data), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        return self._generation, True, payload
+
+    def _write_later(self) -> None:
+        self._timer = None
+        if not self._dirty:
+            return
+        try:
+            snapshot = self._snapshot()
+        except Exception as e:
+            logger.error(f"Failed to serialise {self.path}: {e}")
+            return
+        _writer.submit(self._write, snapshot)
+
+    def _write(self, snapshot: tuple) -> None:
+        generation, full, payload = snapshot
+        with self._lock:
+            # A newer snapshot may already have been written by flush()
+            if generation <= self._written:
+                return
+            try:
+                if full:
+                    atomic_write(self.path, payload)
+                    if self.keyed:
+                        header = _json_lines([{"base": hashlib.sha256(payload).hexdigest()}])
+                        atomic_write(self.journal_path, header)
+                else:
+                    with open(self.journal_path, "ab") as f:
+                        f.write(payload)
+                        f.flush()
+                        os.fsync(f.fileno())
+                self._written = generation
+            except Exception as e:
+                logger.error(f"Failed to save {self.path}: {e}")
+                if self.keyed:
+                    # Whatever didn't reach the journal goes into the next snapshot
+                    self._full = True
+                    self._dirty = True
+
+    async def claim(self, key: str, value: Any) -> bool:
+        """
+        Replace `data[key]` with `value` (or delete it if `value` is None).
+        Always succeeds, since only this process uses the file; it mirrors
+        SQLiteStateStore.claim so callers work with either store.
+        """
+        if value is None:
+            self.data.pop(key, None)
+        else:
+            self.data[key] = value
+        self.save(key)
+        return True
+
+    def flush(self) -> None:
+        """Write any unsaved changes now, blocking until they are on disk."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._dirty:
+            return
+        try:
+            # Written from this thread, so a full snapshot keeps it ordered
+            # after any journal appends still queued on the writer
+            snapshot = self._snapshot(full=True)
+        except Exception as e:
+            logger.error(f"Failed to serialise {self.path}: {e}")
+            return
+        self._write(snapshot)
+
+
+def _json_lines(entries: List[Any]) -> bytes:
+    return "".join(
+        json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n" for entry in entries
+    ).encode("utf-8")
@@ -0,0 +1,102 @@
+from typing import Dict, List, Optional, Tuple
+
+
+class TopK:
+    """
+    The K keys with the highest counts, kept sorted.
+
+    Counts only ever go up, so an update moves one key a few places towards
+    the front; both updates and reads are O(K).
+    """
+    def __init__(self, k: int):
+        self.k = k
+        self._items: List[Tuple[int, str]] = []  # (count, key), highest first
+        self._index: Dict[str, int] = {}
+
+    def update(self, key: str, count: int) -> None:
+        items = self._items
+        if key in self._index:
+            i = self._index[key]
+        elif len(items) < self.k:
+            items.append((count, key))
+            i = len(items) - 1
+        elif count > items[-1][0]:
+            del self._index[items[-1][1]]
+            i = len(items) - 1
+        else:
+            return
+        items[i] = (count, key)
+        while i > 0 and items[i - 1][0] < count:
+            items[i - 1], items[i] = items[i], items[i - 1]
+            self._index[items[i][1]] = i
+            i -= 1
+        self._index[key] = i
+
+    def top(self, n: Optional[int] = None) -> List[Tuple[str, int]]:
+        return [(key, count) for count, key in self._items[:n]]
+
+
+class StatsEngine:
+    """
+    In-memory usage counters fed from the activity log event stream.
+
+    Counts are kept per user, per channel, per event type and per hour of
+    day (UTC) in a plain dict that can be saved and loaded as JSON, plus a
+    running top-K of the most active users, so stats commands never need to
+    read the log files.
+    """
+    def __init__(self, data: Optional[dict] = None, top_k: int = 25):
+        self.data = data if data is not None else {}
+        for section in ("users", "channels", "events", "hours"):
+            self.data.setdefault(section, {})
+        self.top_users = TopK(top_k)
+        for user_id, user in self.data["users"].items():
+            self.top_users.update(user_id, user.get("messages", 0))
+
+    def record(self, event: dict) -> None:
+        kind = event.get("event", "unknown")
+        events = self.data["events"]
+        events[kind] = events.get(kind, 0) + 1
+        timestamp = event.get("timestamp", "")
+        if len(timestamp) >= 13:
+            hours = self.data["hours"]
+            hour = timestamp[11:13]
+            hours[hour] = hours.get(hour, 0) + 1
+
+        channel_id = event.get("channel_id")
+        if channel_id:
+            channel = self.data["channels"].setdefault(channel_id, {"messages": 0, "responses": 0})
+            if event.get("channel_name"):
+                channel["name"] = event["channel_name"]
+            if kind == "user_message":
+                channel["messages"] += 1
+            elif kind == "bot_response":
+                channel["responses"] += 1
+
+        user_id = event.get("user_id")
+        if user_id:
+            user = self.data["users"].setdefault(user_id, {"messages": 0, "commands": 0})
+            if event.get("username"):
+                user["username"] = event["username"]
+            if kind == "user_message":
+                user["messages"] += 1
+                self.top_users.update(user_id, user["messages"])
+            else:
+                user["commands"] += 1
+
+    def user(self, user_id: str) -> dict:
+        return self.data["users"].get(user_id, {"messages": 0, "commands": 0})
+
+    def channel(self, channel_id: str) -> dict:
+        return self.data["channels"].get(channel_id, {"messages": 0, "responses": 0})
+
+    def top(self, n: int) -> List[Tuple[str, str, int]]:
+        """The `n` most active users as (user id, username, messages)."""
+        return [
+            (user_id, self.data["users"][user_id].get("username", user_id), count)
+            for user_id, count in self.top_users.top(n)
+        ]
+
+    def busiest_hour(self) -> Optional[str]:
+        hours = self.data["hours"]
+        return max(hours, key=hours.get) if hours else None